@@ -0,0 +1,256 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Self, cast
+
+import pytest
+from redis.exceptions import WatchError
+
+from vtt_common.sequences import (
+    BULK_SEQUENCE,
+    SEQUENCE_KWARG,
+    SEQUENCE_NAME_KWARG,
+    assign_sequence_numbers,
+    complete_sequence,
+    complete_task_sequence,
+    get_sequence_done_key,
+    get_sequence_head_key,
+    is_sequence_turn,
+)
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+    from typing import Any
+
+    from redis import Redis
+
+OWNER_ID = -1
+
+
+class FakeRedis:
+    """In-memory stand-in for the Redis commands used by the sequences, with WATCH semantics of transactions."""
+
+    def __init__(self) -> None:
+        self.strings: dict[str, bytes] = {}
+        self.zsets: dict[str, dict[str, float]] = {}
+        self.versions: dict[str, int] = {}
+        # Called before a transaction is executed, e.g. to change watched keys by another client
+        self.before_execute: Callable[[], None] | None = None
+        self.transaction_attempts = 0
+
+    def _touch(self, key: str) -> None:
+        self.versions[key] = self.versions.get(key, 0) + 1
+
+    def get(self, key: str) -> bytes | None:
+        return self.strings.get(key)
+
+    def set(self, key: str, value: object) -> bool:
+        self.strings[key] = str(value).encode()
+        self._touch(key)
+        return True
+
+    def incr(self, key: str) -> int:
+        value = int(self.strings.get(key, b"0")) + 1
+        self.set(key, value)
+        return value
+
+    def zadd(self, key: str, mapping: dict[str, float]) -> int:
+        zset = self.zsets.setdefault(key, {})
+        added = len(mapping.keys() - zset.keys())
+        zset.update(mapping)
+        self._touch(key)
+        return added
+
+    def zrange(self, key: str, start: int, end: int, *, withscores: bool = False) -> list[Any]:
+        items = sorted(self.zsets.get(key, {}).items(), key=lambda item: item[1])
+        items = items[start : None if end == -1 else end + 1]
+        return [(member.encode(), score) for member, score in items] if withscores else [m.encode() for m, _ in items]
+
+    def zremrangebyscore(self, key: str, min_score: str, max_score: float) -> int:
+        zset = self.zsets.get(key, {})
+        removed = [member for member, score in zset.items() if float(min_score) <= score <= float(max_score)]
+        for member in removed:
+            del zset[member]
+        self._touch(key)
+        return len(removed)
+
+    def pipeline(self, *, transaction: bool = True) -> FakePipeline:
+        return FakePipeline(self, transaction=transaction)
+
+    def transaction(self, func: Callable[[FakePipeline], None], *watches: str) -> list[Any]:
+        while True:
+            self.transaction_attempts += 1
+            with self.pipeline() as pipe:
+                pipe.watch(*watches)
+                func(pipe)
+                try:
+                    return pipe.execute()
+                except WatchError:
+                    continue
+
+
+class FakePipeline:
+    def __init__(self, redis: FakeRedis, *, transaction: bool) -> None:
+        self.redis = redis
+        self.transaction = transaction
+        self.watched: dict[str, int] = {}
+        self.commands: list[Callable[[], Any]] = []
+        # Commands of watching pipelines are executed immediately until `multi`
+        self.is_immediate = False
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.commands.clear()
+
+    def __getattr__(self, name: str) -> Callable[..., Any]:
+        command = getattr(self.redis, name)
+
+        def call(*args: Any, **kwargs: Any) -> Any:  # noqa: ANN401
+            if self.is_immediate:
+                return command(*args, **kwargs)
+            self.commands.append(lambda: command(*args, **kwargs))
+            return self
+
+        return call
+
+    def watch(self, *keys: str) -> None:
+        self.watched = {key: self.redis.versions.get(key, 0) for key in keys}
+        self.is_immediate = True
+
+    def multi(self) -> None:
+        self.is_immediate = False
+
+    def execute(self) -> list[Any]:
+        if self.watched:
+            before_execute, self.redis.before_execute = self.redis.before_execute, None
+            if before_execute:
+                before_execute()
+            if any(self.redis.versions.get(key, 0) != version for key, version in self.watched.items()):
+                raise WatchError
+        return [command() for command in self.commands]
+
+
+@pytest.fixture
+def redis_client() -> FakeRedis:
+    return FakeRedis()
+
+
+def _get_head(redis_client: FakeRedis, name: str = "live") -> int:
+    return int(redis_client.strings.get(get_sequence_head_key(OWNER_ID, name), b"0"))
+
+
+def _get_done(redis_client: FakeRedis) -> set[int]:
+    return {int(score) for score in redis_client.zsets.get(get_sequence_done_key(OWNER_ID), {}).values()}
+
+
+def test_assign_sequence_numbers(redis_client: FakeRedis) -> None:
+    kwargs_list = assign_sequence_numbers(
+        cast("Redis", redis_client),
+        [
+            ("app.main.forward_wall", {"owner_id": -1, "wall_id": 1}),
+            ("app.main.forward_playlist", {"owner_id": -1, "playlist_id": 1}),
+            ("app.main.forward_wall", {"owner_id": -2, "wall_id": 1}),
+            ("app.main.forward_wall", {"owner_id": -1, "wall_id": 2}),
+        ],
+    )
+
+    assert [kwargs.get(SEQUENCE_KWARG) for kwargs in kwargs_list] == [1, None, 1, 2]
+
+
+def test_assign_sequence_numbers_of_named_sequence(redis_client: FakeRedis) -> None:
+    client = cast("Redis", redis_client)
+    [live_kwargs] = assign_sequence_numbers(client, [("app.main.forward_wall", {"owner_id": -1, "wall_id": 1})])
+    bulk_kwargs_list = assign_sequence_numbers(
+        client,
+        [("app.main.forward_wall", {"owner_id": -1, "wall_id": wall_id}) for wall_id in (2, 3)],
+        BULK_SEQUENCE,
+    )
+
+    assert live_kwargs == {"owner_id": -1, "wall_id": 1, SEQUENCE_KWARG: 1}
+    assert bulk_kwargs_list == [
+        {"owner_id": -1, "wall_id": 2, SEQUENCE_KWARG: 1, SEQUENCE_NAME_KWARG: BULK_SEQUENCE},
+        {"owner_id": -1, "wall_id": 3, SEQUENCE_KWARG: 2, SEQUENCE_NAME_KWARG: BULK_SEQUENCE},
+    ]
+
+
+def test_complete_sequence_in_order(redis_client: FakeRedis) -> None:
+    client = cast("Redis", redis_client)
+    assert is_sequence_turn(client, OWNER_ID, 1)
+    assert not is_sequence_turn(client, OWNER_ID, 2)
+
+    complete_sequence(client, OWNER_ID, 1)
+
+    assert _get_head(redis_client) == 1
+    assert _get_done(redis_client) == set()
+    assert is_sequence_turn(client, OWNER_ID, 2)
+
+
+def test_complete_sequence_out_of_order(redis_client: FakeRedis) -> None:
+    client = cast("Redis", redis_client)
+
+    complete_sequence(client, OWNER_ID, 3)
+    complete_sequence(client, OWNER_ID, 2)
+
+    assert _get_head(redis_client) == 0
+    assert _get_done(redis_client) == {2, 3}
+    assert not is_sequence_turn(client, OWNER_ID, 2)
+
+    complete_sequence(client, OWNER_ID, 1)
+
+    assert _get_head(redis_client) == 3
+    assert _get_done(redis_client) == set()
+    assert is_sequence_turn(client, OWNER_ID, 4)
+
+
+def test_complete_sequence_skip_previous(redis_client: FakeRedis) -> None:
+    client = cast("Redis", redis_client)
+    complete_sequence(client, OWNER_ID, 6)
+
+    # Posts 1-4 were lost, post 5 skips them and the head moves over the completed post 6
+    complete_sequence(client, OWNER_ID, 5, skip_previous=True)
+
+    assert _get_head(redis_client) == 6
+    assert _get_done(redis_client) == set()
+
+
+def test_complete_sequence_skip_previous_does_not_move_head_back(redis_client: FakeRedis) -> None:
+    client = cast("Redis", redis_client)
+    for seq in (1, 2, 3):
+        complete_sequence(client, OWNER_ID, seq)
+
+    complete_sequence(client, OWNER_ID, 2, skip_previous=True)
+
+    assert _get_head(redis_client) == 3
+
+
+def test_complete_sequence_concurrently(redis_client: FakeRedis) -> None:
+    client = cast("Redis", redis_client)
+
+    # Post 1 is completed by another worker after post 2 read the head, but before its transaction is executed
+    redis_client.before_execute = lambda: complete_sequence(client, OWNER_ID, 1)
+    complete_sequence(client, OWNER_ID, 2)
+
+    assert redis_client.transaction_attempts == 3
+    assert _get_head(redis_client) == 2
+    assert _get_done(redis_client) == set()
+
+
+def test_sequences_are_independent(redis_client: FakeRedis) -> None:
+    client = cast("Redis", redis_client)
+    bulk_kwargs_list = assign_sequence_numbers(
+        client,
+        [("app.main.forward_wall", {"owner_id": OWNER_ID, "wall_id": wall_id}) for wall_id in range(1, 101)],
+        BULK_SEQUENCE,
+    )
+    [live_kwargs] = assign_sequence_numbers(client, [("app.main.forward_wall", {"owner_id": OWNER_ID, "wall_id": 101})])
+
+    # The live post does not wait for the bulk
+    assert is_sequence_turn(client, OWNER_ID, live_kwargs[SEQUENCE_KWARG])
+    complete_task_sequence(client, live_kwargs)
+    assert _get_head(redis_client) == 1
+    assert _get_head(redis_client, BULK_SEQUENCE) == 0
+
+    complete_task_sequence(client, bulk_kwargs_list[0])
+    assert _get_head(redis_client, BULK_SEQUENCE) == 1
+    assert is_sequence_turn(client, OWNER_ID, 2, BULK_SEQUENCE)
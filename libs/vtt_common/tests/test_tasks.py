@@ -0,0 +1,50 @@
+from __future__ import annotations
+
+import json
+from unittest.mock import MagicMock
+
+from vtt_common.schemas import VttTaskType
+from vtt_common.tasks import get_legacy_result_key, get_queued_task, get_task_state_key, get_task_states
+
+
+def _get_backend(values: dict[str, bytes]) -> MagicMock:
+    backend = MagicMock()
+    backend.client.mget.side_effect = lambda keys: [values.get(key) for key in keys]
+    return backend
+
+
+def test_get_task_states() -> None:
+    backend = _get_backend(
+        {
+            get_task_state_key("wall_-1_1"): b"STARTED:1700000000",
+            get_task_state_key("wall_-1_2"): b"SUCCESS:1700000001",
+            # Result of the same task, stored before the index, is ignored
+            get_legacy_result_key("wall_-1_2"): json.dumps({"status": "SENT", "date_done": None}).encode(),
+        },
+    )
+
+    assert get_task_states(backend, ["wall_-1_1", "wall_-1_2"]) == [
+        {"status": "STARTED", "timestamp": 1700000000},
+        {"status": "SUCCESS", "timestamp": 1700000001},
+    ]
+    backend.client.mget.assert_called_once()
+
+
+def test_get_task_states_legacy_results() -> None:
+    backend = _get_backend(
+        {
+            get_task_state_key("wall_-1_1"): b"STARTED:1700000000",
+            get_legacy_result_key("wall_-1_2"): json.dumps(
+                {"status": "SUCCESS", "result": "https://t.me/c/1/2", "date_done": "2023-11-14T22:13:20+00:00"},
+            ).encode(),
+            get_legacy_result_key("wall_-1_3"): json.dumps({"status": "SENT", "date_done": None}).encode(),
+        },
+    )
+
+    assert get_task_states(backend, ["wall_-1_1", "wall_-1_2", "wall_-1_3", "wall_-1_4"]) == [
+        {"status": "STARTED", "timestamp": 1700000000},
+        {"status": "SUCCESS", "timestamp": 1700000000},
+        {"status": "SENT", "timestamp": 0},
+        None,
+    ]
+    assert get_queued_task(backend, VttTaskType.wall, -1, 3) == {"status": "SENT", "timestamp": 0}
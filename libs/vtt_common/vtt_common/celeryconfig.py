@@ -9,6 +9,10 @@ result_backend = os.getenv("CELERY_RESULT_BACKEND", "redis://localhost/0")
 # Make task report its status as ‘started’ when executed by a worker.
 task_track_started = True
 
+# Task states are tracked by the index in `vtt_common.tasks`, Celery does not store results.
+# Tasks must be sent with `ignore_result=True` too, since the option of the message overrides this one.
+task_ignore_result = True
+
 # Kill all long-running tasks with late acknowledgment enabled on connection loss.
 worker_cancel_long_running_tasks_on_connection_loss = True
 
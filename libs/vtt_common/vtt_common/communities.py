@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import TYPE_CHECKING, cast
+
+from pydantic import BaseModel, TypeAdapter
+
+if TYPE_CHECKING:
+    from redis import Redis
+
+
+# Hash, that maps VK community id to its settings in JSON.
+COMMUNITIES_KEY = "vtt-communities"
+
+
+class Community(BaseModel):
+    """Settings of a VK community served by a shared deployment.
+
+    Tokens and options that are not set fall back to the deployment settings.
+    """
+
+    group_id: int
+    """Id of VK community (positive)."""
+
+    channel_id: int
+    """Id of Telegram channel, where wall posts are sent."""
+
+    pl_channel_id: int = 0
+    """Id of Telegram channel, where playlists are sent."""
+
+    mirror_channel_ids: list[int] = []
+    """Ids of Telegram channels, where wall posts are copied."""
+
+    vk_token: str | None = None
+    """VK user token, used by the worker."""
+
+    vk_community_token: str | None = None
+    """VK community token, used to set up callback server of the community."""
+
+    server_secret: str | None = None
+    """Secret key of callback requests of the community."""
+
+    ignore_ads: bool | None = None
+    """Ignore VK ad posts."""
+
+
+_communities_adapter = TypeAdapter(list[Community])
+
+
+def load_communities_file(path: str | Path) -> dict[int, Community]:
+    """Load communities from JSON file with a list of communities."""
+    communities = _communities_adapter.validate_json(Path(path).read_bytes())
+    return {community.group_id: community for community in communities}
+
+
+def get_communities(redis_client: Redis) -> dict[int, Community]:
+    values = cast("dict[bytes, bytes]", redis_client.hgetall(COMMUNITIES_KEY))
+    return {int(group_id): Community.model_validate_json(value) for group_id, value in values.items()}
+
+
+def get_community(redis_client: Redis, group_id: int) -> Community | None:
+    value = cast("bytes | None", redis_client.hget(COMMUNITIES_KEY, str(group_id)))
+    return Community.model_validate_json(value) if value else None
+
+
+def set_community(redis_client: Redis, community: Community) -> None:
+    redis_client.hset(COMMUNITIES_KEY, str(community.group_id), community.model_dump_json(exclude_none=True))
+
+
+def load_communities(file_path: str = "", redis_client: Redis | None = None) -> dict[int, Community]:
+    """Load communities from JSON file and/or Redis. Communities from Redis override the ones from the file."""
+    communities = load_communities_file(file_path) if file_path else {}
+    if redis_client:
+        communities.update(get_communities(redis_client))
+    return communities
+
+
+def delete_community(redis_client: Redis, group_id: int) -> None:
+    redis_client.hdel(COMMUNITIES_KEY, str(group_id))
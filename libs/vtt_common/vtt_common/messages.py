@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import json
+from typing import TYPE_CHECKING, TypedDict, cast
+
+from vtt_common.tasks import get_task_id
+
+if TYPE_CHECKING:
+    from redis import Redis
+
+    from vtt_common.schemas import VttTaskType
+
+
+# Hash per Telegram channel, that maps "{type}_{owner_id}_{post_id}" to the id of the channel message.
+MESSAGE_INDEX_KEY_PREFIX = "vtt-messages-"
+
+# Hash per Telegram channel, that maps "{type}_{owner_id}_{post_id}" to JSON `MessageMap` of the post.
+MESSAGE_MAP_KEY_PREFIX = "vtt-message-map-"
+
+
+class TextMessage(TypedDict):
+    """Telegram message with a part of the text of VK post."""
+
+    id: int
+    # 0 for the post itself, N for the N-th repost of its copy history
+    post_index: int
+    # Index of the part of the split text
+    part: int
+    is_caption: bool
+    link_preview: bool
+    # Hash of the sent text, to edit only the changed messages
+    text_hash: str
+
+
+class MessageMap(TypedDict):
+    """All Telegram messages, that VK post was sent as."""
+
+    message_ids: list[int]
+    texts: list[TextMessage]
+
+
+def get_message_index_key(channel_id: int) -> str:
+    return f"{MESSAGE_INDEX_KEY_PREFIX}{channel_id}"
+
+
+def get_message_id(
+    redis_client: Redis,
+    channel_id: int,
+    task_type: VttTaskType,
+    owner_id: int,
+    post_id: int,
+) -> int | None:
+    """Return id of the Telegram message, that VK post or playlist was sent as."""
+    message_id = cast(
+        "bytes | None",
+        redis_client.hget(get_message_index_key(channel_id), get_task_id(task_type, owner_id, post_id)),
+    )
+    return int(message_id) if message_id else None
+
+
+def set_message_id(
+    redis_client: Redis,
+    channel_id: int,
+    task_type: VttTaskType,
+    owner_id: int,
+    post_id: int,
+    message_id: int,
+) -> None:
+    redis_client.hset(get_message_index_key(channel_id), get_task_id(task_type, owner_id, post_id), str(message_id))
+
+
+def set_message_ids(redis_client: Redis, channel_id: int, message_ids: dict[str, int]) -> None:
+    """Store many message ids at once. Keys of `message_ids` are task ids, as returned by `get_task_id`."""
+    if message_ids:
+        redis_client.hset(
+            get_message_index_key(channel_id),
+            mapping={task_id: str(message_id) for task_id, message_id in message_ids.items()},
+        )
+
+
+def delete_message_id(
+    redis_client: Redis,
+    channel_id: int,
+    task_type: VttTaskType,
+    owner_id: int,
+    post_id: int,
+) -> None:
+    task_id = get_task_id(task_type, owner_id, post_id)
+    redis_client.hdel(get_message_index_key(channel_id), task_id)
+    redis_client.hdel(get_message_map_key(channel_id), task_id)
+
+
+def get_message_map_key(channel_id: int) -> str:
+    return f"{MESSAGE_MAP_KEY_PREFIX}{channel_id}"
+
+
+def get_message_map(
+    redis_client: Redis,
+    channel_id: int,
+    task_type: VttTaskType,
+    owner_id: int,
+    post_id: int,
+) -> MessageMap | None:
+    value = cast(
+        "bytes | None",
+        redis_client.hget(get_message_map_key(channel_id), get_task_id(task_type, owner_id, post_id)),
+    )
+    return cast("MessageMap", json.loads(value)) if value else None
+
+
+def set_message_map(
+    redis_client: Redis,
+    channel_id: int,
+    task_type: VttTaskType,
+    owner_id: int,
+    post_id: int,
+    message_map: MessageMap,
+) -> None:
+    redis_client.hset(
+        get_message_map_key(channel_id),
+        get_task_id(task_type, owner_id, post_id),
+        json.dumps(message_map, separators=(",", ":")),
+    )
@@ -0,0 +1,140 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, cast
+
+if TYPE_CHECKING:
+    from typing import Any
+
+    from redis import Redis
+    from redis.client import Pipeline
+
+
+# Every wall post gets a sequence number of its VK wall, when its task is sent.
+# Workers prepare posts in parallel, but publish a post only after all posts of the wall with lower numbers
+# are completed (published, skipped or failed), so channels of the wall get posts in the order they were sent.
+# Live posts, manual sends, bulks and backfills of the wall are numbered in separate sequences,
+# so a large bulk or backfill does not hold the live posts.
+
+# Tasks, that get a sequence number, when they are sent.
+SEQUENCED_TASKS = frozenset({"app.main.forward_wall"})
+
+# Keyword argument of sequenced tasks and their stages with the sequence number.
+SEQUENCE_KWARG = "seq"
+
+# Keyword argument of sequenced tasks and their stages with the sequence name.
+# It is not added for the live sequence.
+SEQUENCE_NAME_KWARG = "seq_name"
+
+# Sequence of posts received from VK.
+LIVE_SEQUENCE = "live"
+
+# Sequence of posts sent one by one by users.
+MANUAL_SEQUENCE = "manual"
+
+# Sequence of posts sent in bulks by users.
+BULK_SEQUENCE = "bulk"
+
+# Sequence of posts sent by the wall backfill.
+BACKFILL_SEQUENCE = "backfill"
+
+# Last sequence number of the wall.
+SEQUENCE_KEY_PREFIX = "vtt-seq-"
+
+# Sequence number of the wall, up to which all posts are completed.
+SEQUENCE_HEAD_KEY_PREFIX = "vtt-seq-head-"
+
+# Sorted set of completed sequence numbers of the wall, that are above the head.
+SEQUENCE_DONE_KEY_PREFIX = "vtt-seq-done-"
+
+
+def _get_sequence_id(owner_id: int, name: str) -> str:
+    # Keys of the live sequence have no name, as they had before sequences were named
+    return str(owner_id) if name == LIVE_SEQUENCE else f"{name}:{owner_id}"
+
+
+def get_sequence_key(owner_id: int, name: str = LIVE_SEQUENCE) -> str:
+    return f"{SEQUENCE_KEY_PREFIX}{_get_sequence_id(owner_id, name)}"
+
+
+def get_sequence_head_key(owner_id: int, name: str = LIVE_SEQUENCE) -> str:
+    return f"{SEQUENCE_HEAD_KEY_PREFIX}{_get_sequence_id(owner_id, name)}"
+
+
+def get_sequence_done_key(owner_id: int, name: str = LIVE_SEQUENCE) -> str:
+    return f"{SEQUENCE_DONE_KEY_PREFIX}{_get_sequence_id(owner_id, name)}"
+
+
+def assign_sequence_numbers(
+    redis_client: Redis,
+    tasks: list[tuple[str, dict[str, Any]]],
+    name: str = LIVE_SEQUENCE,
+) -> list[dict[str, Any]]:
+    """Return kwargs of the tasks, where sequenced tasks have numbers of the `name` sequence, with a single round trip.
+
+    Items of `tasks` are task names and kwargs. Numbers are assigned in the order of `tasks`.
+    """
+    sequenced = [index for index, (task_name, _) in enumerate(tasks) if task_name in SEQUENCED_TASKS]
+    kwargs_list = [kwargs for _, kwargs in tasks]
+    if not sequenced:
+        return kwargs_list
+
+    with redis_client.pipeline(transaction=False) as pipe:
+        for index in sequenced:
+            pipe.incr(get_sequence_key(kwargs_list[index]["owner_id"], name))
+        numbers = cast("list[int]", pipe.execute())
+
+    sequence_kwargs = {} if name == LIVE_SEQUENCE else {SEQUENCE_NAME_KWARG: name}
+    for index, number in zip(sequenced, numbers, strict=True):
+        kwargs_list[index] = {**kwargs_list[index], SEQUENCE_KWARG: number, **sequence_kwargs}
+    return kwargs_list
+
+
+def _get_head(redis_client: Redis | Pipeline, owner_id: int, name: str) -> int:
+    value = cast("bytes | None", redis_client.get(get_sequence_head_key(owner_id, name)))
+    return int(value) if value else 0
+
+
+def is_sequence_turn(redis_client: Redis, owner_id: int, seq: int, name: str = LIVE_SEQUENCE) -> bool:
+    """Return `True` if all posts of the wall before `seq` in the `name` sequence are completed."""
+    return seq <= _get_head(redis_client, owner_id, name) + 1
+
+
+def complete_sequence(
+    redis_client: Redis,
+    owner_id: int,
+    seq: int,
+    name: str = LIVE_SEQUENCE,
+    *,
+    skip_previous: bool = False,
+) -> None:
+    """Mark `seq` of the `name` sequence as completed and move the head over all consecutive completed numbers.
+
+    If `skip_previous` is specified, numbers before `seq` are treated as completed,
+    e.g. if their tasks were lost.
+    """
+    head_key = get_sequence_head_key(owner_id, name)
+    done_key = get_sequence_done_key(owner_id, name)
+    redis_client.zadd(done_key, {str(seq): seq})
+
+    def move_head(pipe: Pipeline) -> None:
+        head = _get_head(pipe, owner_id, name)
+        if skip_previous:
+            head = max(head, seq - 1)
+        done = {
+            int(score) for _, score in cast("list[tuple[bytes, float]]", pipe.zrange(done_key, 0, -1, withscores=True))
+        }
+        new_head = head
+        while new_head + 1 in done:
+            new_head += 1
+
+        pipe.multi()
+        pipe.set(head_key, new_head)
+        pipe.zremrangebyscore(done_key, "-inf", new_head)
+
+    redis_client.transaction(move_head, head_key, done_key)
+
+
+def complete_task_sequence(redis_client: Redis, kwargs: dict[str, Any]) -> None:
+    """Complete the sequence number of the task with `kwargs`, if it has one."""
+    if (seq := kwargs.get(SEQUENCE_KWARG)) is not None:
+        complete_sequence(redis_client, kwargs["owner_id"], seq, kwargs.get(SEQUENCE_NAME_KWARG, LIVE_SEQUENCE))
@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+import hashlib
+import json
+from typing import TYPE_CHECKING, Any, cast
+
+from telethon import utils
+from telethon.sessions import StringSession
+from telethon.tl.types import PeerChannel
+
+if TYPE_CHECKING:
+    from redis import Redis
+    from telethon.crypto import AuthKey
+
+
+# Hash with Telegram session: field "session" with DC and auth key in `StringSession` format,
+# fields "entity:{peer_id}" with JSON rows of the entity cache.
+SESSION_KEY_PREFIX = "vtt-tgm-session-"
+SESSION_FIELD = "session"
+ENTITY_FIELD_PREFIX = "entity:"
+
+
+def get_session_key(string: str) -> str:
+    """Return key of the session, that was created from `string`. New session string starts a new session."""
+    return f"{SESSION_KEY_PREFIX}{hashlib.sha256(string.encode()).hexdigest()[:16]}"
+
+
+class RedisSession(StringSession):
+    """Telegram session, that is shared by all processes through Redis.
+
+    It is created from the session string, then DC, auth key and entity cache are stored in Redis,
+    so they are kept between tasks and restarts.
+    New entities are kept in memory and stored by `save`, which Telethon calls on connect, every minute
+    and on disconnect, so updates are processed without Redis round trips.
+    """
+
+    def __init__(self, redis_client: Redis, string: str) -> None:
+        self.redis_client = redis_client
+        self.key = get_session_key(string)
+
+        values = cast("dict[bytes, bytes]", redis_client.hgetall(self.key))
+        stored_string = values.pop(SESSION_FIELD.encode(), b"").decode()
+        super().__init__(stored_string or string)
+
+        self._entities = {
+            tuple(json.loads(row))
+            for field, row in values.items()
+            if field.startswith(ENTITY_FIELD_PREFIX.encode())
+        }
+        # Rows of the entity cache, that are not stored in Redis yet
+        self._unsaved_entities: set[tuple[Any, ...]] = set()
+        self._saved_string = stored_string
+
+    def set_dc(self, dc_id: int, server_address: str, port: int) -> None:
+        super().set_dc(dc_id, server_address, port)
+        self.save()
+
+    @property
+    def auth_key(self) -> AuthKey | None:
+        return self._auth_key
+
+    @auth_key.setter
+    def auth_key(self, value: AuthKey | None) -> None:
+        self._auth_key = value
+        self.save()
+
+    def save(self) -> str:
+        """Store the changed session and new entities with a single `HSET` call."""
+        string = cast("str", super().save())
+        mapping = {f"{ENTITY_FIELD_PREFIX}{row[0]}": json.dumps(row) for row in self._unsaved_entities}
+        if string and string != self._saved_string:
+            mapping[SESSION_FIELD] = string
+        if mapping:
+            self.redis_client.hset(self.key, mapping=mapping)
+            self._unsaved_entities.clear()
+            self._saved_string = string or self._saved_string
+        return string
+
+    def close(self) -> None:
+        self.save()
+
+    def process_entities(self, tlo: Any) -> None:  # noqa: ANN401
+        rows = set(self._entities_to_rows(tlo)) - self._entities
+        self._entities |= rows
+        self._unsaved_entities |= rows
+
+    def get_channel_username(self, channel_id: int) -> tuple[bool, str | None]:
+        """Return whether the channel is in the entity cache and its username."""
+        if utils.resolve_id(channel_id)[1] is not PeerChannel:
+            return False, None
+        return next(
+            ((True, username) for peer_id, _, username, _, _ in self._entities if peer_id == channel_id),
+            (False, None),
+        )
@@ -1,53 +1,320 @@
 from __future__ import annotations
 
+import json
+import time
+from datetime import datetime
 from typing import TYPE_CHECKING
 
-from celery.app.task import Context
-from celery.signals import before_task_publish
+from celery.signals import before_task_publish, task_postrun, task_prerun
+from celery.states import READY_STATES
+
+from vtt_common.sequences import MANUAL_SEQUENCE, assign_sequence_numbers, complete_task_sequence
 
 if TYPE_CHECKING:
     from typing import Any, TypedDict
 
-    from celery.backends.base import BaseKeyValueStoreBackend
+    from celery import Celery
+    from celery.backends.redis import RedisBackend
 
     from vtt_common.schemas import VttTaskType
 
     class TaskMeta(TypedDict):
         status: str
+        timestamp: int
+
+
+# Header that marks tasks whose "SENT" state was already stored by `claim_task`.
+CLAIMED_HEADER = "vtt_claimed"
+
+# Keyword argument of stage tasks with id of the task, that started the pipeline.
+# States of stage tasks are stored as the state of that task.
+PARENT_TASK_KWARG = "parent_task_id"
+
+# Result of a stage task, that passed the work to the next stage.
+# The state of the pipeline stays "STARTED" until the last stage finishes.
+STAGE_PASSED = "STAGE_PASSED"
+
+# Task states are stored as "{state}:{timestamp}" strings under these keys,
+# instead of full Celery result objects. Tasks are sent with `ignore_result`, so Celery does not store them.
+TASK_STATE_KEY_PREFIX = "vtt-task-"
+
+# Full Celery results, that were stored before the task state index.
+# They are read, if a task has no state in the index, until they expire.
+# TODO: remove in the next release
+LEGACY_RESULT_KEY_PREFIX = "celery-task-meta-"
+
+
+def get_task_id(task_type: VttTaskType, owner_id: int, post_id: int) -> str:
+    return f"{task_type}_{owner_id}_{post_id}"
+
+
+def get_task_state_key(task_id: str) -> str:
+    return f"{TASK_STATE_KEY_PREFIX}{task_id}"
+
+
+def _encode_task_state(state: str) -> str:
+    return f"{state}:{int(time.time())}"
+
+
+def decode_task_state(value: bytes) -> TaskMeta:
+    state, _, timestamp = value.decode().rpartition(":")
+    return {"status": state, "timestamp": int(timestamp)}
+
+
+def get_legacy_result_key(task_id: str) -> str:
+    return f"{LEGACY_RESULT_KEY_PREFIX}{task_id}"
+
 
+def decode_legacy_result(value: bytes) -> TaskMeta:
+    result = json.loads(value)
+    date_done: str | None = result.get("date_done")
+    timestamp = int(datetime.fromisoformat(date_done).timestamp()) if date_done else 0
+    return {"status": result["status"], "timestamp": timestamp}
 
-def set_task_sent_state_handler(backend: BaseKeyValueStoreBackend) -> None:
+
+def merge_task_states(
+    values: list[bytes | None],
+    legacy_values: list[bytes | None],
+) -> list[TaskMeta | None]:
+    """Decode states from the index, falling back to legacy results of the tasks, that have no state.
+
+    `legacy_values` are values of the legacy result keys of the tasks without state, in the same order.
+    """
+    legacy_states = iter(legacy_values)
+    states: list[TaskMeta | None] = []
+    for value in values:
+        if value:
+            states.append(decode_task_state(value))
+        else:
+            legacy_value = next(legacy_states)
+            states.append(decode_legacy_result(legacy_value) if legacy_value else None)
+    return states
+
+
+def set_task_state(backend: RedisBackend, task_id: str, state: str) -> None:
+    backend.client.set(get_task_state_key(task_id), _encode_task_state(state), ex=backend.expires or None)
+
+
+def set_task_sent_state_handler(backend: RedisBackend) -> None:
     @before_task_publish.connect(weak=False)
-    def set_sent_state(
-        headers: dict,
-        body: tuple[dict, dict, dict],
-        routing_key: str,
-        **kwargs: Any,
+    def set_sent_state(headers: dict, **_: Any) -> None:
+        if headers.get(CLAIMED_HEADER):
+            return
+
+        set_task_state(backend, headers["id"], "SENT")
+
+
+def _get_state_task_id(task_id: str, kwargs: dict[str, Any] | None) -> str:
+    return (kwargs or {}).get(PARENT_TASK_KWARG) or task_id
+
+
+def set_task_state_handlers(backend: RedisBackend) -> None:
+    """Keep the task state index up to date, while the worker executes tasks."""
+
+    @task_prerun.connect(weak=False)
+    def set_started_state(task_id: str, kwargs: dict[str, Any] | None = None, **_: Any) -> None:
+        set_task_state(backend, _get_state_task_id(task_id, kwargs), "STARTED")
+
+    @task_postrun.connect(weak=False)
+    def set_finished_state(
+        task_id: str,
+        state: str | None = None,
+        retval: Any = None,  # noqa: ANN401
+        kwargs: dict[str, Any] | None = None,
+        **_: Any,
     ) -> None:
-        backend.store_result(
-            task_id=headers["id"],
-            result=None,
-            state="SENT",
-            request=Context(
-                task=headers["task"],
-                args=body[0],
-                kwargs=body[1],
-                delivery_info={
-                    "routing_key": routing_key,
-                },
-            ),
-            **kwargs,
-        )
+        kwargs = kwargs or {}
+        if not state or (state == "SUCCESS" and retval == STAGE_PASSED):
+            return
+        # Retried stage does not change the state of the pipeline
+        if state == "RETRY" and PARENT_TASK_KWARG in kwargs:
+            return
+
+        set_task_state(backend, _get_state_task_id(task_id, kwargs), state)
+        if state in READY_STATES:
+            complete_task_sequence(backend.client, kwargs)
+
+
+def get_task_states(backend: RedisBackend, task_ids: list[str]) -> list[TaskMeta | None]:
+    """Return states of the tasks with a single `MGET` call, and one more for legacy results of unknown tasks."""
+    if not task_ids:
+        return []
+
+    values: list[bytes | None] = backend.client.mget([get_task_state_key(task_id) for task_id in task_ids])
+    missing_task_ids = [task_id for task_id, value in zip(task_ids, values, strict=True) if not value]
+    legacy_values: list[bytes | None] = (
+        backend.client.mget([get_legacy_result_key(task_id) for task_id in missing_task_ids])
+        if missing_task_ids
+        else []
+    )
+    return merge_task_states(values, legacy_values)
 
 
 def get_queued_task(
-    backend: BaseKeyValueStoreBackend,
+    backend: RedisBackend,
     task_type: VttTaskType,
     owner_id: int,
     post_id: int,
 ) -> TaskMeta | None:
-    result = backend.get(backend.get_key_for_task(f"{task_type}_{owner_id}_{post_id}"))
-    if not result:
-        return None
+    return get_task_states(backend, [get_task_id(task_type, owner_id, post_id)])[0]
+
+
+def claim_tasks(backend: RedisBackend, task_ids: list[str], *, force: bool = False) -> list[bool]:
+    """Store "SENT" state of the tasks with pipelined `SET NX EX` calls in a single round trip.
+
+    For each task returns `False` if it already has any state, unless `force` is specified.
+    """
+    with backend.client.pipeline(transaction=False) as pipe:
+        for task_id in task_ids:
+            pipe.set(
+                get_task_state_key(task_id),
+                _encode_task_state("SENT"),
+                ex=backend.expires or None,
+                nx=not force,
+            )
+        return [bool(result) for result in pipe.execute()]
+
+
+def claim_task(
+    backend: RedisBackend,
+    task_type: VttTaskType,
+    owner_id: int,
+    post_id: int,
+    *,
+    force: bool = False,
+) -> bool:
+    return claim_tasks(backend, [get_task_id(task_type, owner_id, post_id)], force=force)[0]
+
+
+def release_task(backend: RedisBackend, task_id: str) -> None:
+    """Remove the claim, so the task can be sent again."""
+    backend.client.delete(get_task_state_key(task_id))
+
+
+def release_unsent_task(backend: RedisBackend, task_id: str, kwargs: dict[str, Any]) -> None:
+    """Remove the claim of the task, that failed to send, and complete its sequence number, if it has one.
+
+    Otherwise the following posts of the wall would wait for the task, that will never run.
+    """
+    release_task(backend, task_id)
+    complete_task_sequence(backend.client, kwargs)
+
+
+def send_claimed_task(
+    celery_app: Celery,
+    name: str,
+    task_type: VttTaskType,
+    owner_id: int,
+    post_id: int,
+    queue: str,
+    kwargs: dict[str, Any],
+    *,
+    force: bool = False,
+    sequence: str = MANUAL_SEQUENCE,
+) -> bool:
+    """Claim the task with `claim_task` and publish it, if the claim succeeded.
+
+    Sequenced tasks get a number of the `sequence` sequence, see `vtt_common.sequences`.
+    """
+    backend: RedisBackend = celery_app.backend
+    if not claim_task(backend, task_type, owner_id, post_id, force=force):
+        return False
+
+    task_id = get_task_id(task_type, owner_id, post_id)
+    try:
+        [kwargs] = assign_sequence_numbers(backend.client, [(name, kwargs)], sequence)
+        celery_app.send_task(
+            name,
+            task_id=task_id,
+            queue=queue,
+            kwargs=kwargs,
+            headers={CLAIMED_HEADER: True},
+            ignore_result=True,
+        )
+    except Exception:
+        release_unsent_task(backend, task_id, kwargs)
+        raise
+
+    return True
+
+
+def send_claimed_tasks(
+    celery_app: Celery,
+    name: str,
+    queue: str,
+    tasks: dict[str, dict[str, Any]],
+    sequence: str = MANUAL_SEQUENCE,
+) -> list[str]:
+    """Claim many tasks with `claim_tasks` and publish the claimed ones over a single producer connection.
+
+    Keys of `tasks` are task ids, values are task kwargs. Sequenced tasks get numbers of the `sequence` sequence.
+    Returns ids of the published tasks.
+    """
+    backend: RedisBackend = celery_app.backend
+    task_ids = list(tasks)
+    claimed = claim_tasks(backend, task_ids)
+    claimed_task_ids = [task_id for task_id, is_claimed in zip(task_ids, claimed, strict=True) if is_claimed]
+    try:
+        tasks_kwargs = dict(
+            zip(
+                claimed_task_ids,
+                assign_sequence_numbers(
+                    backend.client,
+                    [(name, tasks[task_id]) for task_id in claimed_task_ids],
+                    sequence,
+                ),
+                strict=True,
+            ),
+        )
+    except Exception:
+        for task_id in claimed_task_ids:
+            release_task(backend, task_id)
+        raise
+
+    sent_task_ids: list[str] = []
+    with celery_app.producer_or_acquire() as producer:
+        for index, (task_id, is_claimed) in enumerate(zip(task_ids, claimed, strict=True)):
+            if not is_claimed:
+                continue
+
+            try:
+                celery_app.send_task(
+                    name,
+                    task_id=task_id,
+                    queue=queue,
+                    kwargs=tasks_kwargs[task_id],
+                    headers={CLAIMED_HEADER: True},
+                    ignore_result=True,
+                    producer=producer,
+                )
+            except Exception:
+                # Release this and all the following claims, so these tasks can be sent again
+                for unsent_task_id, is_unsent_claimed in zip(task_ids[index:], claimed[index:], strict=True):
+                    if is_unsent_claimed:
+                        release_unsent_task(backend, unsent_task_id, tasks_kwargs[unsent_task_id])
+                raise
+            sent_task_ids.append(task_id)
+
+    return sent_task_ids
+
+
+def send_stage_task(
+    celery_app: Celery,
+    name: str,
+    parent_task_id: str,
+    stage: str,
+    queue: str,
+    kwargs: dict[str, Any],
+) -> None:
+    """Send the next stage of the pipeline, started by `parent_task_id`.
 
-    return backend.decode_result(result)
+    The stage task returns `STAGE_PASSED` if it sends the next stage, or the result of the pipeline otherwise.
+    """
+    celery_app.send_task(
+        name,
+        task_id=f"{parent_task_id}_{stage}",
+        queue=queue,
+        kwargs={**kwargs, PARENT_TASK_KWARG: parent_task_id},
+        headers={CLAIMED_HEADER: True},
+        ignore_result=True,
+    )
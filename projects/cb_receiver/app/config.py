@@ -17,15 +17,28 @@ class Settings(BaseSettings):
     VK_COMMUNITY_TOKEN: str
 
     VK_SERVER_TITLE: str = "vk-to-tgm"
-    SERVER_URL: str
+    # Not used by Long Poll receiver
+    SERVER_URL: str = ""
     VK_SERVER_SECRET: str = secrets.token_hex(25)
 
     VTT_IGNORE_ADS: bool = True
 
+    # Other communities served by this deployment, see `vtt_common.communities.Community`
+    VTT_COMMUNITIES_FILE: str = ""
+    VTT_COMMUNITIES_REDIS: bool = False
+
+    VTT_EVENT_CACHE_SIZE: int = 10000
+    VTT_EVENT_CACHE_TTL: int = 3600
+    VTT_EVENT_CACHE_SHARED: bool = False
+
+    VTT_PUBLISH_QUEUE_SIZE: int = 1000
+    VTT_PUBLISH_BATCH_SIZE: int = 100
+    VTT_PUBLISH_CLOSE_TIMEOUT: float = 5
+
     @field_validator("SERVER_URL")
     @classmethod
     def add_trailing_slash(cls, val: str) -> str:
-        return val if val.endswith("/") else f"{val}/"
+        return val if not val or val.endswith("/") else f"{val}/"
 
 
 @lru_cache
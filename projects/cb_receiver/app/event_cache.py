@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+from threading import Lock
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from redis import Redis
+
+
+class EventIdCache:
+    """Bounded LRU of seen VK callback event ids.
+
+    If `redis_client` is specified, ids are also stored in Redis with `ttl`,
+    so duplicates are detected across multiple receiver replicas.
+    """
+
+    KEY_PREFIX = "vtt-event-"
+
+    def __init__(self, maxsize: int, ttl: int, redis_client: Redis | None = None) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.redis_client = redis_client
+
+        self._event_ids: OrderedDict[str, None] = OrderedDict()
+        self._lock = Lock()
+
+    def _add_local(self, event_id: str) -> bool:
+        with self._lock:
+            if event_id in self._event_ids:
+                self._event_ids.move_to_end(event_id)
+                return False
+
+            self._event_ids[event_id] = None
+            if len(self._event_ids) > self.maxsize:
+                self._event_ids.popitem(last=False)
+            return True
+
+    def add(self, event_id: str) -> bool:
+        """Remember `event_id`. Returns `False` if it has been seen before."""
+        if not self._add_local(event_id):
+            return False
+
+        if self.redis_client is None:
+            return True
+
+        try:
+            return bool(self.redis_client.set(f"{self.KEY_PREFIX}{event_id}", 1, ex=self.ttl, nx=True))
+        except Exception:
+            # Otherwise VK retries of the event would be skipped as duplicates
+            with self._lock:
+                self._event_ids.pop(event_id, None)
+            raise
+
+    def discard(self, event_id: str) -> None:
+        """Forget `event_id`, so VK retries of a failed event are processed again."""
+        with self._lock:
+            self._event_ids.pop(event_id, None)
+
+        if self.redis_client is not None:
+            self.redis_client.delete(f"{self.KEY_PREFIX}{event_id}")
+
+    def clear(self) -> None:
+        with self._lock:
+            self._event_ids.clear()
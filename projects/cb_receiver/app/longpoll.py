@@ -0,0 +1,177 @@
+"""Receive VK events with Bots Long Poll API, as an alternative to Callback API.
+
+No public server URL is needed. Events are filtered, deduplicated and published the same way as callbacks.
+`ts` of the last processed event is stored in Redis, so events sent while the receiver was down are not missed.
+
+Usage: `python -m app.longpoll`
+"""
+
+from __future__ import annotations
+
+import asyncio
+import queue
+import signal
+from contextlib import suppress
+from typing import TYPE_CHECKING, cast
+
+import httpx
+from loguru import logger
+from msgspec import DecodeError
+
+from app.config import get_settings
+from app.event_cache import EventIdCache
+from app.main import handle_event
+from app.publisher import TaskPublisher
+from app.schemas import decode_long_poll_response
+from app.utils import close_http_client, configure_long_poll, get_long_poll_server
+from app.worker import create_worker
+
+if TYPE_CHECKING:
+    from redis import Redis
+
+    from app.config import Settings
+    from app.schemas import LongPollServer, VkCallback
+
+# Max time (in seconds) the Long Poll server holds the request
+LONG_POLL_WAIT = 25
+# Delay (in seconds) before the next attempt after a failed request
+RETRY_DELAY = 5
+# Delay (in seconds) before the next attempt to publish an event, if the publish queue is full
+PUBLISH_RETRY_DELAY = 1
+
+# Key with `ts` of the last processed event
+LONG_POLL_TS_KEY_PREFIX = "vtt-longpoll-ts-"
+
+
+class LongPollReceiver:
+    def __init__(
+        self,
+        settings: Settings,
+        publisher: TaskPublisher,
+        event_cache: EventIdCache,
+        redis_client: Redis,
+        http_client: httpx.AsyncClient | None = None,
+    ) -> None:
+        self.settings = settings
+        self.publisher = publisher
+        self.event_cache = event_cache
+        self.redis_client = redis_client
+        self.http_client = http_client or httpx.AsyncClient(timeout=httpx.Timeout(LONG_POLL_WAIT + 10, connect=5))
+
+        self.ts_key = f"{LONG_POLL_TS_KEY_PREFIX}{settings.VK_COMMUNITY_ID}"
+        self.server: LongPollServer | None = None
+        self.ts: str | None = None
+
+    async def _update_server(self, *, reset_ts: bool = False) -> LongPollServer:
+        self.server = await get_long_poll_server(group_id=self.settings.VK_COMMUNITY_ID)
+        if reset_ts or self.ts is None:
+            self.ts = self.server["ts"]
+        logger.info("Long Poll server has been updated.")
+        return self.server
+
+    async def start(self) -> None:
+        saved_ts = cast("bytes | None", await asyncio.to_thread(self.redis_client.get, self.ts_key))
+        if saved_ts:
+            self.ts = saved_ts.decode()
+            logger.info("Resuming from event {}", self.ts)
+
+        await self._update_server()
+
+    async def _handle_update(self, body: VkCallback) -> None:
+        ctx_logger = logger.bind(event_id=body.event_id)
+        ctx_logger.info("New event: {}", body.type)
+        while True:
+            try:
+                handle_event(body, self.settings, self.publisher, self.event_cache, ctx_logger)
+            except queue.Full:
+                ctx_logger.warning("Publish queue is full, retrying in {} s.", PUBLISH_RETRY_DELAY)
+                await asyncio.sleep(PUBLISH_RETRY_DELAY)
+            else:
+                return
+
+    async def poll(self) -> None:
+        """Wait for new events and publish them."""
+        server = self.server or await self._update_server()
+
+        response = await self.http_client.get(
+            server["server"],
+            params={
+                "act": "a_check",
+                "key": server["key"],
+                "ts": self.ts,
+                "wait": LONG_POLL_WAIT,
+            },
+        )
+        response.raise_for_status()
+        result = decode_long_poll_response(response.content)
+
+        if result.failed == 1 and result.ts is not None:
+            logger.warning("Events history is outdated, some events were lost.")
+            self.ts = str(result.ts)
+        elif result.failed:
+            logger.info("Long Poll key has expired (error {}).", result.failed)
+            await self._update_server(reset_ts=result.failed != 2)  # noqa: PLR2004
+        else:
+            for body in result.updates:
+                await self._handle_update(body)
+
+            if result.ts is not None:
+                # `ts` is saved only after the events are in the broker, so they are received again after a restart
+                if result.updates:
+                    await asyncio.to_thread(self.publisher.flush)
+                self.ts = str(result.ts)
+                await asyncio.to_thread(self.redis_client.set, self.ts_key, self.ts)
+
+    async def run(self) -> None:
+        await self.start()
+        while True:
+            try:
+                await self.poll()
+            except (httpx.HTTPError, DecodeError, RuntimeError) as error:
+                logger.warning("Long Poll request failed: {}", error)
+                await asyncio.sleep(RETRY_DELAY)
+
+    async def close(self) -> None:
+        await self.http_client.aclose()
+
+
+async def main() -> None:
+    settings = get_settings()
+    celery_app = create_worker()
+
+    publisher = TaskPublisher(
+        celery_app=celery_app,
+        maxsize=settings.VTT_PUBLISH_QUEUE_SIZE,
+        batch_size=settings.VTT_PUBLISH_BATCH_SIZE,
+        close_timeout=settings.VTT_PUBLISH_CLOSE_TIMEOUT,
+    )
+    event_cache = EventIdCache(
+        maxsize=settings.VTT_EVENT_CACHE_SIZE,
+        ttl=settings.VTT_EVENT_CACHE_TTL,
+        redis_client=celery_app.backend.client if settings.VTT_EVENT_CACHE_SHARED else None,
+    )
+    receiver = LongPollReceiver(
+        settings=settings,
+        publisher=publisher,
+        event_cache=event_cache,
+        redis_client=celery_app.backend.client,
+    )
+
+    await configure_long_poll(settings=settings)
+    publisher.start()
+    run_task = asyncio.create_task(receiver.run())
+    # Stop gracefully on `docker stop`, so queued events are sent to the broker
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, run_task.cancel)
+    try:
+        with suppress(asyncio.CancelledError):
+            await run_task
+    finally:
+        logger.info("Stopping Long Poll receiver.")
+        await receiver.close()
+        await asyncio.to_thread(publisher.close)
+        await close_http_client()
+
+
+if __name__ == "__main__":
+    with suppress(KeyboardInterrupt):
+        asyncio.run(main())
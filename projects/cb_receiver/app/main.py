@@ -1,18 +1,30 @@
 from __future__ import annotations
 
 import asyncio
+import queue
 from contextlib import asynccontextmanager
 from typing import TYPE_CHECKING, Annotated
 
-from fastapi import Body, Depends, FastAPI, Request, Response
+from fastapi import Depends, FastAPI, Request, Response
 from loguru import logger
+from msgspec import DecodeError
+from vtt_common.communities import load_communities
 from vtt_common.schemas import VttTaskType
-from vtt_common.tasks import get_queued_task
+from vtt_common.tasks import get_task_id
 
 from app.config import Settings, get_settings
+from app.event_cache import EventIdCache
 from app.logging import init_logging
-from app.schemas import CallbackType, VkCallback, WallPostType, WallWallpostFull
-from app.utils import configure_callback_server, get_confirmation_code
+from app.publisher import PublishItem, TaskPublisher
+from app.schemas import CallbackType, WallPostType, decode_callback, decode_post
+from app.utils import (
+    cache_confirmation_code,
+    close_http_client,
+    configure_callback_server,
+    get_cached_confirmation_code,
+    get_confirmation_code,
+    get_server_secret,
+)
 from app.worker import create_worker
 
 if TYPE_CHECKING:
@@ -21,37 +33,54 @@ if TYPE_CHECKING:
 
     from celery import Celery
     from loguru import Logger
+    from vtt_common.communities import Community
+
+    from app.schemas import VkCallback, WallWallpostFull
 
 
 init_logging()
 
 
-def _handle_wall_post_new(
-    body: VkCallback,
-    settings: Settings,
-    celery_app: Celery,
-    ctx_logger: Logger,
-) -> None:
-    post_data = body.object
-    if post_data is None:
-        ctx_logger.warning("Post object is missing")
-        return
+def _get_post(body: VkCallback, ctx_logger: Logger) -> tuple[WallWallpostFull, int, int] | None:
+    """Decode the post of the event. Returns the post, its owner id and id, or `None` if the post is invalid."""
+    try:
+        post = decode_post(body.object)
+    except DecodeError as error:
+        ctx_logger.warning("Invalid post object: {}", error)
+        return None
 
-    post = WallWallpostFull(**post_data)
+    if post is None:
+        ctx_logger.warning("Post object is missing")
+        return None
 
     owner_id = post.owner_id
     if not owner_id:
         ctx_logger.warning("Post does not have an owner_id")
-        return
+        return None
 
     post_id = post.id
     if not post_id:
         ctx_logger.warning("Post does not have a post_id")
+        return None
+
+    return post, owner_id, post_id
+
+
+def handle_wall_post_new(
+    body: VkCallback,
+    settings: Settings,
+    publisher: TaskPublisher,
+    ctx_logger: Logger,
+    community: Community | None = None,
+) -> None:
+    if not (result := _get_post(body, ctx_logger)):
         return
 
+    post, owner_id, post_id = result
     ctx_logger = ctx_logger.bind(full_id=f"{owner_id}_{post_id}")
 
-    if post.marked_as_ads and settings.VTT_IGNORE_ADS:
+    ignore_ads = settings.VTT_IGNORE_ADS if community is None or community.ignore_ads is None else community.ignore_ads
+    if post.marked_as_ads and ignore_ads:
         ctx_logger.warning("Ignoring ad post")
         return
 
@@ -67,32 +96,88 @@ def _handle_wall_post_new(
         WallPostType.VIDEO,
     ):
         ctx_logger.info("New post")
-        if get_queued_task(
-            backend=celery_app.backend,
-            task_type=VttTaskType.wall,
-            owner_id=owner_id,
-            post_id=post_id,
-        ):
-            ctx_logger.warning("Post already exists")
-        else:
-            celery_app.send_task(
-                "app.main.forward_wall",
-                task_id=f"{VttTaskType.wall}_{owner_id}_{post_id}",
+        publisher.publish(
+            PublishItem(
+                name="app.main.forward_wall",
+                task_id=get_task_id(VttTaskType.wall, owner_id, post_id),
                 queue="vtt-wall",
                 kwargs={
                     "owner_id": owner_id,
                     "wall_id": post_id,
                 },
-            )
+                logger=ctx_logger,
+            ),
+        )
+
+
+def handle_wall_post_edit(body: VkCallback, publisher: TaskPublisher, ctx_logger: Logger) -> None:
+    """Publish a task to edit Telegram messages of the post. Posts that were not sent are skipped by the worker."""
+    if not (result := _get_post(body, ctx_logger)):
+        return
+
+    _, owner_id, post_id = result
+    ctx_logger = ctx_logger.bind(full_id=f"{owner_id}_{post_id}")
+    ctx_logger.info("Edited post")
+    publisher.publish(
+        PublishItem(
+            name="app.main.edit_wall",
+            # Every edit is a separate task, retries of the same event are skipped
+            task_id=f"{get_task_id(VttTaskType.wall, owner_id, post_id)}_edit_{body.event_id}",
+            queue="vtt-wall",
+            kwargs={
+                "owner_id": owner_id,
+                "wall_id": post_id,
+            },
+            logger=ctx_logger,
+        ),
+    )
+
+
+def handle_event(
+    body: VkCallback,
+    settings: Settings,
+    publisher: TaskPublisher,
+    event_cache: EventIdCache,
+    ctx_logger: Logger,
+    community: Community | None = None,
+) -> None:
+    """Publish a task for the event, unless it is a duplicate. Raises `queue.Full` if the publish queue is full.
+
+    `community` is the routed community the event belongs to, `None` for the deployment community.
+    """
+    if not event_cache.add(body.event_id):
+        ctx_logger.warning("Duplicate event, skipping")
+        return
+
+    try:
+        if body.type == CallbackType.WALL_POST_NEW:
+            handle_wall_post_new(body, settings, publisher, ctx_logger, community)
+        elif body.type == CallbackType.WALL_POST_EDIT:
+            handle_wall_post_edit(body, publisher, ctx_logger)
+    except Exception:
+        event_cache.discard(body.event_id)
+        raise
+
+
+async def get_raw_body(request: Request) -> bytes:
+    return await request.body()
 
 
 def vk_callback(
     request: Request,
-    body: Annotated[VkCallback, Body(...)],
+    raw_body: Annotated[bytes, Depends(get_raw_body)],
     settings: Annotated[Settings, Depends(get_settings)],
 ) -> Response:
+    try:
+        body = decode_callback(raw_body)
+    except DecodeError as error:
+        logger.warning("Invalid request body: {}", error)
+        return Response(str(error), status_code=422)
+
     ctx_logger = logger.bind(event_id=body.event_id)
-    if body.secret != settings.VK_SERVER_SECRET:
+    communities: dict[int, Community] = request.app.state.communities
+    community = communities.get(body.group_id)
+    if body.secret != get_server_secret(settings, community):
         ctx_logger.warning("Unauthorized request")
         return Response(status_code=401)
 
@@ -100,30 +185,110 @@ def vk_callback(
     ctx_logger.info("New event: {}", event_type)
 
     if event_type == CallbackType.CONFIRMATION:
-        confirmation_code: str = request.state.confirmation_code
+        confirmation_code: str | None = (
+            request.state.confirmation_codes.get(body.group_id) if community else request.state.confirmation_code
+        )
         ctx_logger.info("Response with confirmation code '{}' has been sent.", confirmation_code)
         return Response(confirmation_code)
 
-    if event_type == CallbackType.WALL_POST_NEW:
-        _handle_wall_post_new(body, settings, request.app.state.celery_app, ctx_logger)
+    try:
+        handle_event(
+            body,
+            settings,
+            request.app.state.publisher,
+            request.app.state.event_cache,
+            ctx_logger,
+            community,
+        )
+    except queue.Full:
+        ctx_logger.warning("Publish queue is full, response 503 has been sent.")
+        return Response(status_code=503)
 
     ctx_logger.info("Response 'ok' has been sent.")
     return Response("ok")
 
 
 def create_app(settings: Settings | None = None, celery_app: Celery | None = None) -> FastAPI:
+    _settings = settings or get_settings()
+    _celery_app = create_worker(app=celery_app)
+
+    publisher = TaskPublisher(
+        celery_app=_celery_app,
+        maxsize=_settings.VTT_PUBLISH_QUEUE_SIZE,
+        batch_size=_settings.VTT_PUBLISH_BATCH_SIZE,
+        close_timeout=_settings.VTT_PUBLISH_CLOSE_TIMEOUT,
+    )
+
+    communities = load_communities(
+        file_path=_settings.VTT_COMMUNITIES_FILE,
+        redis_client=_celery_app.backend.client if _settings.VTT_COMMUNITIES_REDIS else None,
+    )
+    if communities:
+        logger.info("Serving {} other communities: {}", len(communities), ", ".join(map(str, communities)))
+
+    async def setup_callback_server(confirmation_code: str, community: Community | None = None) -> None:
+        await configure_callback_server(settings=_settings, community=community)
+        await asyncio.to_thread(
+            cache_confirmation_code,
+            _celery_app.backend.client,
+            _settings,
+            confirmation_code,
+            community,
+        )
+
+    async def prepare_callback_server(
+        cb_setup_tasks: list[asyncio.Task[None]],
+        community: Community | None = None,
+    ) -> str:
+        """Return the confirmation code. Set up the callback server in background, if its settings have changed."""
+        if confirmation_code := await asyncio.to_thread(
+            get_cached_confirmation_code,
+            _celery_app.backend.client,
+            _settings,
+            community,
+        ):
+            logger.info("Callback server settings have not changed, skipping setup.")
+            return confirmation_code
+
+        confirmation_code = await get_confirmation_code(
+            group_id=community.group_id if community else _settings.VK_COMMUNITY_ID,
+            token=community.vk_community_token if community else None,
+        )
+        cb_setup_tasks.append(asyncio.create_task(setup_callback_server(confirmation_code, community)))
+        return confirmation_code
+
     @asynccontextmanager
     async def lifespan(_: FastAPI) -> AsyncGenerator[Mapping[str, Any]]:
-        _settings = settings or get_settings()
-        confirmation_code = await get_confirmation_code(group_id=_settings.VK_COMMUNITY_ID)
-        _cb_setup_task = asyncio.create_task(configure_callback_server(settings=_settings))
-        yield {"confirmation_code": confirmation_code}
-        await _cb_setup_task
+        cb_setup_tasks: list[asyncio.Task[None]] = []
+        confirmation_code = None
+        confirmation_codes: dict[int, str] = {}
+        if not _settings.SERVER_URL:
+            logger.warning("SERVER_URL is not set, skipping callback server setup.")
+        else:
+            confirmation_code = await prepare_callback_server(cb_setup_tasks)
+            for group_id, community in communities.items():
+                if not community.vk_community_token:
+                    logger.warning("Community {} does not have a token, skipping callback server setup.", group_id)
+                    continue
+                confirmation_codes[group_id] = await prepare_callback_server(cb_setup_tasks, community)
+
+        publisher.start()
+        yield {"confirmation_code": confirmation_code, "confirmation_codes": confirmation_codes}
+        await asyncio.to_thread(publisher.close)
+        await asyncio.gather(*cb_setup_tasks)
+        await close_http_client()
 
     app = FastAPI(lifespan=lifespan)
     app.add_api_route("/", methods=["POST"], endpoint=vk_callback)
 
-    app.state.celery_app = create_worker(app=celery_app)
+    app.state.celery_app = _celery_app
+    app.state.publisher = publisher
+    app.state.communities = communities
+    app.state.event_cache = EventIdCache(
+        maxsize=_settings.VTT_EVENT_CACHE_SIZE,
+        ttl=_settings.VTT_EVENT_CACHE_TTL,
+        redis_client=_celery_app.backend.client if _settings.VTT_EVENT_CACHE_SHARED else None,
+    )
 
     if settings:
         app.dependency_overrides[get_settings] = lambda: settings
@@ -0,0 +1,218 @@
+from __future__ import annotations
+
+import queue
+import threading
+import time
+from dataclasses import dataclass, replace
+from typing import TYPE_CHECKING
+
+from loguru import logger
+from vtt_common.sequences import assign_sequence_numbers
+from vtt_common.tasks import CLAIMED_HEADER, claim_tasks, release_unsent_task
+
+if TYPE_CHECKING:
+    from typing import Any
+
+    from celery import Celery
+    from loguru import Logger
+
+
+# Delay (in seconds) before the first retry of tasks, that failed to send. Doubled on every failed retry.
+RETRY_DELAY = 1
+# Max delay (in seconds) between retries
+MAX_RETRY_DELAY = 30
+
+
+@dataclass(slots=True, frozen=True)
+class PublishItem:
+    name: str
+    task_id: str
+    queue: str
+    kwargs: dict[str, Any]
+    logger: Logger
+    # Set once the claim of the task is stored, so a retry does not see its own claim as a duplicate
+    is_claimed: bool = False
+    # Set once `kwargs` have the sequence number, so a retry does not take another one
+    is_sequenced: bool = False
+
+
+class TaskPublisher:
+    """Publishes tasks to the broker in batches from a background thread.
+
+    Callback handlers only put tasks into a bounded in-process queue,
+    so their latency does not include Redis round trips.
+
+    VK is answered before tasks are sent, so tasks that failed to send are kept and retried with backoff.
+    They are given up only if they still fail `close_timeout` seconds after `close` is called.
+    """
+
+    def __init__(self, celery_app: Celery, maxsize: int, batch_size: int, close_timeout: float = 5) -> None:
+        self.celery_app = celery_app
+        self.batch_size = batch_size
+        self.close_timeout = close_timeout
+
+        self._queue: queue.Queue[PublishItem | None] = queue.Queue(maxsize=maxsize)
+        self._thread: threading.Thread | None = None
+        self._closing = threading.Event()
+
+    def publish(self, item: PublishItem) -> None:
+        """Put `item` into the queue. Raises `queue.Full` if the queue is full."""
+        self._queue.put_nowait(item)
+
+    def _get_batch(self, size: int, *, block: bool) -> tuple[list[PublishItem], bool]:
+        """Get up to `size` items. Waits for the first one only if `block` is specified."""
+        batch: list[PublishItem] = []
+        while len(batch) < size:
+            try:
+                item = self._queue.get(block=block and not batch)
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.task_done()
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _claim_batch(self, batch: list[PublishItem]) -> list[PublishItem]:
+        """Return items of the batch with stored claims. Skips tasks that were already claimed by someone else."""
+        unclaimed = [item for item in batch if not item.is_claimed]
+        if not unclaimed:
+            return batch
+
+        claimed = iter(claim_tasks(self.celery_app.backend, [item.task_id for item in unclaimed]))
+        claimed_batch: list[PublishItem] = []
+        for item in batch:
+            if item.is_claimed:
+                claimed_batch.append(item)
+            elif next(claimed):
+                claimed_batch.append(replace(item, is_claimed=True))
+            else:
+                item.logger.warning("Post already exists")
+        return claimed_batch
+
+    def _sequence_batch(self, batch: list[PublishItem]) -> list[PublishItem]:
+        unsequenced = [index for index, item in enumerate(batch) if not item.is_sequenced]
+        if not unsequenced:
+            return batch
+
+        kwargs_list = assign_sequence_numbers(
+            self.celery_app.backend.client,
+            [(batch[index].name, batch[index].kwargs) for index in unsequenced],
+        )
+        sequenced_batch = list(batch)
+        for index, kwargs in zip(unsequenced, kwargs_list, strict=True):
+            sequenced_batch[index] = replace(batch[index], kwargs=kwargs, is_sequenced=True)
+        return sequenced_batch
+
+    def _send_batch(self, batch: list[PublishItem]) -> list[PublishItem]:
+        """Send tasks of the batch. Returns items, that failed and have to be retried, in the original order."""
+        try:
+            batch = self._claim_batch(batch)
+            batch = self._sequence_batch(batch)
+        except Exception:  # noqa: BLE001
+            logger.exception("Failed to prepare {} tasks", len(batch))
+            return batch
+
+        # Task messages are published directly with the producer of the batch, instead of `send_task`,
+        # which also routes the task, merges options and creates a result object for every message.
+        amqp = self.celery_app.amqp
+        send_sent_event = self.celery_app.conf.task_send_sent_event
+        failed: list[PublishItem] = []
+        processed_count = 0
+        try:
+            with self.celery_app.producer_or_acquire() as producer:
+                for item in batch:
+                    try:
+                        message = amqp.create_task_message(
+                            item.task_id,
+                            item.name,
+                            kwargs=item.kwargs,
+                            create_sent_event=send_sent_event,
+                            ignore_result=True,
+                        )
+                        amqp.send_task_message(
+                            producer,
+                            item.name,
+                            message,
+                            queue=item.queue,
+                            headers={CLAIMED_HEADER: True},
+                        )
+                    except Exception:
+                        item.logger.exception("Failed to send task")
+                        failed.append(item)
+                    processed_count += 1
+        except Exception:  # noqa: BLE001
+            logger.exception("Failed to acquire a producer")
+
+        return failed + batch[processed_count:]
+
+    def _give_up(self, batch: list[PublishItem]) -> None:
+        """Release claims of the tasks, that could not be sent before shutdown, so they can be sent again.
+
+        Their sequence numbers are completed, so the following posts of the wall do not wait for them.
+        """
+        for item in batch:
+            item.logger.error("Task {} has not been sent before shutdown", item.task_id)
+            if not item.is_claimed:
+                continue
+            try:
+                release_unsent_task(self.celery_app.backend, item.task_id, item.kwargs)
+            except Exception:
+                item.logger.exception("Failed to release task")
+
+    def _mark_done(self, count: int) -> None:
+        """Mark `count` items as processed (sent, skipped or given up) for `flush`."""
+        for _ in range(count):
+            self._queue.task_done()
+
+    def _run(self) -> None:
+        pending: list[PublishItem] = []
+        delay: float = RETRY_DELAY
+        deadline: float | None = None
+        is_closed = False
+        while True:
+            batch, is_batch_closed = self._get_batch(self.batch_size - len(pending), block=not pending)
+            is_closed = is_closed or is_batch_closed
+            if deadline is None and self._closing.is_set():
+                deadline = time.monotonic() + self.close_timeout
+
+            batch = pending + batch
+            pending = self._send_batch(batch) if batch else []
+            self._mark_done(len(batch) - len(pending))
+            if pending and deadline is not None and time.monotonic() >= deadline:
+                self._give_up(pending)
+                self._mark_done(len(pending))
+                pending = []
+
+            if not pending:
+                if is_closed:
+                    return
+                delay = RETRY_DELAY
+                continue
+
+            logger.warning("Failed to send {} tasks, retrying in {} s.", len(pending), delay)
+            if deadline is None:
+                # Wakes up early on `close`
+                self._closing.wait(delay)
+            else:
+                time.sleep(max(0, min(delay, deadline - time.monotonic())))
+            delay = min(delay * 2, MAX_RETRY_DELAY)
+
+    def start(self) -> None:
+        self._closing.clear()
+        self._thread = threading.Thread(target=self._run, name="task-publisher", daemon=True)
+        self._thread.start()
+
+    def flush(self) -> None:
+        """Wait until all queued tasks are sent. Blocks while they are retried."""
+        self._queue.join()
+
+    def close(self) -> None:
+        """Send all queued tasks and stop the background thread."""
+        if self._thread is None:
+            return
+
+        self._closing.set()
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
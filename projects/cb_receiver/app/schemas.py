@@ -1,9 +1,9 @@
 from __future__ import annotations
 
 from enum import StrEnum
-from typing import Any, TypedDict
+from typing import TypedDict
 
-from pydantic import BaseModel, Field
+from msgspec import Raw, Struct, json
 
 
 class CallbackServerDict(TypedDict):
@@ -24,9 +24,16 @@ class GetConfirmationCodeResponse(TypedDict):
     code: str
 
 
+class LongPollServer(TypedDict):
+    key: str
+    server: str
+    ts: str
+
+
 class CallbackType(StrEnum):
     CONFIRMATION = "confirmation"
     WALL_POST_NEW = "wall_post_new"
+    WALL_POST_EDIT = "wall_post_edit"
 
 
 class WallPostType(StrEnum):
@@ -41,49 +48,90 @@ class WallPostType(StrEnum):
     CLIP = "clip"
 
 
-class WallWallpostDonut(BaseModel):
+class WallWallpostDonut(Struct):
     """Info about paid wall post. Model: `WallWallpostDonut`."""
 
-    is_donut: bool = Field()
+    is_donut: bool
     """Post only for dons."""
 
 
-class WallWallpostFull(BaseModel):
-    """Model: `WallWallpostFull`."""
+class WallWallpostFull(Struct):
+    """Model: `WallWallpostFull`.
+
+    Only fields used by the receiver are declared, the rest are skipped while decoding.
+    """
 
-    owner_id: int | None = Field(default=None)
+    owner_id: int | None = None
     """Wall owner's ID."""
 
-    id: int | None = Field(default=None)
+    id: int | None = None
     """Post ID."""
 
-    marked_as_ads: bool | None = Field(default=None)
+    marked_as_ads: bool | None = None
     """Information whether the post is marked as ads."""
 
-    donut: WallWallpostDonut | None = Field(default=None)
+    donut: WallWallpostDonut | None = None
     """Property `WallWallpostFull.donut`."""
 
-    post_type: WallPostType | None = Field(default=None)
+    post_type: WallPostType | None = None
     """Property `WallWallpost.post_type`."""
 
 
-class VkCallback(BaseModel):
+class VkCallback(Struct):
     """Model: `VkCallback`."""
 
-    type: CallbackType | str = Field()
+    type: str
     """Property `VkCallback.type`."""
 
-    group_id: int = Field()
+    group_id: int
     """Property `VkCallback.group_id`."""
 
-    event_id: str = Field()
+    event_id: str
     """Unique event id. If it passed twice or more - you should ignore it.."""
 
-    v: str = Field()
+    v: str
     """API object version."""
 
-    secret: str | None = Field(default=None)
+    secret: str | None = None
     """Property `VkCallback.secret`."""
 
-    object: dict[str, Any] | None = Field(default=None)
-    """Property `VkCallback.object`."""
+    object: Raw = Raw()
+    """Property `VkCallback.object`.
+
+    Kept as raw JSON bytes and decoded only when needed.
+    """
+
+
+class LongPollResponse(Struct):
+    """Response of Bots Long Poll server."""
+
+    ts: str | int | None = None
+    """Number of the last event, to be passed in the next request."""
+
+    updates: list[VkCallback] = []
+    """Events in the same format as callbacks, without `secret`."""
+
+    failed: int | None = None
+    """Error code: 1 - `ts` is outdated, 2 - `key` is expired, 3 - `key` and `ts` are lost."""
+
+
+_callback_decoder = json.Decoder(VkCallback, strict=False)
+_long_poll_decoder = json.Decoder(LongPollResponse, strict=False)
+_post_decoder: json.Decoder[WallWallpostFull | None] = json.Decoder(WallWallpostFull | None, strict=False)
+
+
+def decode_callback(data: bytes) -> VkCallback:
+    """Decode callback body. Raises `msgspec.DecodeError` if it is invalid."""
+    return _callback_decoder.decode(data)
+
+
+def decode_post(data: Raw) -> WallWallpostFull | None:
+    """Decode `VkCallback.object` of `wall_post_new` and `wall_post_edit` events."""
+    if not data:
+        return None
+    return _post_decoder.decode(data)
+
+
+def decode_long_poll_response(data: bytes) -> LongPollResponse:
+    """Decode Bots Long Poll response. Raises `msgspec.DecodeError` if it is invalid."""
+    return _long_poll_decoder.decode(data)
@@ -1,12 +1,10 @@
 from __future__ import annotations
 
-import asyncio
+import hashlib
 import json
 from typing import TYPE_CHECKING, cast
-from urllib.error import HTTPError, URLError
-from urllib.parse import urlencode
-from urllib.request import urlopen
 
+import httpx
 from loguru import logger
 
 from app.config import get_settings
@@ -14,55 +12,86 @@ from app.config import get_settings
 if TYPE_CHECKING:
     from typing import Any
 
+    from redis import Redis
+    from vtt_common.communities import Community
+
     from app.config import Settings
     from app.schemas import (
         AddCallbackServerResponse,
         GetCallbackServersResponse,
         GetConfirmationCodeResponse,
+        LongPollServer,
     )
 
 
+VK_API_URL = "https://api.vk.ru/method/"
+VK_API_VERSION = "5.199"
+
+# Events sent by VK to the callback server and the Long Poll server
+EVENT_TYPES = ("wall_post_new", "wall_post_edit")
+
+# Hash with the confirmation code and the fingerprint of the settings it was configured with.
+CALLBACK_SERVER_KEY_PREFIX = "vtt-callback-server-"
+
+_http_client: httpx.AsyncClient | None = None
+
+
+def _get_http_client() -> httpx.AsyncClient:
+    """Return the shared client, so VK API calls reuse pooled connections."""
+    global _http_client  # noqa: PLW0603
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            base_url=VK_API_URL,
+            timeout=httpx.Timeout(10.0, connect=5.0),
+            limits=httpx.Limits(max_connections=10, max_keepalive_connections=5),
+        )
+    return _http_client
+
+
+async def close_http_client() -> None:
+    global _http_client  # noqa: PLW0603
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
 async def _vk_api_request(
     method: str,
     params: dict[str, Any] | None = None,
     *,
     data: dict[str, Any] | None = None,
+    token: str | None = None,
 ) -> dict[str, Any]:
-    settings = get_settings()
     request_params = dict(params or {})
-    request_params["access_token"] = settings.VK_COMMUNITY_TOKEN
-    request_params["v"] = "5.199"
+    request_params["access_token"] = token or get_settings().VK_COMMUNITY_TOKEN
+    request_params["v"] = VK_API_VERSION
 
     if data:
         request_params.update(data)
 
-    encoded = urlencode(request_params).encode()
-
-    def _request() -> dict[str, Any]:
-        try:
-            with urlopen(f"https://api.vk.ru/method/{method}", data=encoded) as resp:
-                result: dict[str, Any] = json.loads(resp.read())
-        except HTTPError as e:
-            msg = f"VK API HTTP error {e.code}: {e.reason}"
-            raise RuntimeError(msg) from e
-        except URLError as e:
-            msg = f"VK API connection error: {e.reason}"
-            raise RuntimeError(msg) from e
-        except json.JSONDecodeError as e:
-            msg = f"VK API invalid JSON response: {e}"
-            raise RuntimeError(msg) from e
-
-        error = cast("dict[str, Any] | None", result.get("error"))
-        if error:
-            msg = error.get("error_msg", str(error))
-            raise RuntimeError(f"VK API error: {msg}")
+    try:
+        resp = await _get_http_client().post(method, data=request_params)
+        resp.raise_for_status()
+        result: dict[str, Any] = resp.json()
+    except httpx.HTTPStatusError as e:
+        msg = f"VK API HTTP error {e.response.status_code}: {e.response.reason_phrase}"
+        raise RuntimeError(msg) from e
+    except httpx.RequestError as e:
+        msg = f"VK API connection error: {e}"
+        raise RuntimeError(msg) from e
+    except json.JSONDecodeError as e:
+        msg = f"VK API invalid JSON response: {e}"
+        raise RuntimeError(msg) from e
 
-        try:
-            return cast("dict[str, Any]", result["response"])
-        except KeyError:
-            raise RuntimeError(f"VK API response missing 'response' key: {result}") from None
+    error = cast("dict[str, Any] | None", result.get("error"))
+    if error:
+        msg = error.get("error_msg", str(error))
+        raise RuntimeError(f"VK API error: {msg}")
 
-    return await asyncio.to_thread(_request)
+    try:
+        return cast("dict[str, Any]", result["response"])
+    except KeyError:
+        raise RuntimeError(f"VK API response missing 'response' key: {result}") from None
 
 
 async def _find_or_create_server(
@@ -70,10 +99,11 @@ async def _find_or_create_server(
     server_url: str,
     server_title: str,
     secret_key: str,
+    token: str | None = None,
 ) -> int:
     servers = cast(
         "GetCallbackServersResponse",
-        await _vk_api_request("groups.getCallbackServers", {"group_id": group_id}),
+        await _vk_api_request("groups.getCallbackServers", {"group_id": group_id}, token=token),
     )
 
     items = servers["items"]
@@ -93,6 +123,7 @@ async def _find_or_create_server(
                 "title": server_title,
                 "secret_key": secret_key,
             },
+            token=token,
         )
         logger.info(f"Using existing callback server '{server_title}'")
         return server_id
@@ -107,6 +138,7 @@ async def _find_or_create_server(
                 "title": server_title,
                 "secret_key": secret_key,
             },
+            token=token,
         ),
     )
     server_id = new_server["server_id"]
@@ -119,12 +151,13 @@ async def _find_or_create_server(
     return server_id
 
 
-async def get_confirmation_code(group_id: int) -> str:
+async def get_confirmation_code(group_id: int, token: str | None = None) -> str:
     confirmation = cast(
         "GetConfirmationCodeResponse",
         await _vk_api_request(
             "groups.getCallbackConfirmationCode",
             {"group_id": group_id},
+            token=token,
         ),
     )
     code = confirmation["code"]
@@ -132,35 +165,115 @@ async def get_confirmation_code(group_id: int) -> str:
     return code
 
 
-async def _set_callback_settings(group_id: int, server_id: int) -> None:
+async def _set_callback_settings(group_id: int, server_id: int, token: str | None = None) -> None:
     await _vk_api_request(
         "groups.setCallbackSettings",
         data={
             "group_id": group_id,
             "server_id": server_id,
-            "api_version": "5.199",
-            "wall_post_new": 1,
+            "api_version": VK_API_VERSION,
+            **dict.fromkeys(EVENT_TYPES, 1),
         },
+        token=token,
     )
     logger.info("Callback server settings has been set.")
 
 
-async def configure_callback_server(settings: Settings | None = None) -> None:
+def get_server_secret(settings: Settings, community: Community | None = None) -> str:
+    return community.server_secret if community and community.server_secret else settings.VK_SERVER_SECRET
+
+
+async def configure_callback_server(settings: Settings | None = None, community: Community | None = None) -> None:
+    """Set up callback server of the deployment community or, if `community` is passed, of that community."""
     if not settings:
         settings = get_settings()
 
-    logger.info("Setting up callback server...")
+    group_id = community.group_id if community else settings.VK_COMMUNITY_ID
+    token = community.vk_community_token if community else None
 
-    group_id = settings.VK_COMMUNITY_ID
+    logger.info("Setting up callback server of community {}...", group_id)
 
     server_id = await _find_or_create_server(
         group_id=group_id,
         server_url=settings.SERVER_URL,
         server_title=settings.VK_SERVER_TITLE,
-        secret_key=settings.VK_SERVER_SECRET,
+        secret_key=get_server_secret(settings, community),
+        token=token,
     )
 
     await _set_callback_settings(
         group_id=group_id,
         server_id=server_id,
+        token=token,
+    )
+
+
+async def configure_long_poll(settings: Settings | None = None) -> None:
+    """Enable Bots Long Poll API with the same events as the callback server."""
+    if not settings:
+        settings = get_settings()
+
+    await _vk_api_request(
+        "groups.setLongPollSettings",
+        data={
+            "group_id": settings.VK_COMMUNITY_ID,
+            "enabled": 1,
+            "api_version": VK_API_VERSION,
+            **dict.fromkeys(EVENT_TYPES, 1),
+        },
+    )
+    logger.info("Long Poll settings has been set.")
+
+
+async def get_long_poll_server(group_id: int) -> LongPollServer:
+    return cast(
+        "LongPollServer",
+        await _vk_api_request("groups.getLongPollServer", {"group_id": group_id}),
+    )
+
+
+def get_callback_server_fingerprint(settings: Settings, community: Community | None = None) -> str:
+    """Return a hash of the settings applied by `configure_callback_server`."""
+    config = [
+        community.group_id if community else settings.VK_COMMUNITY_ID,
+        settings.SERVER_URL,
+        settings.VK_SERVER_TITLE,
+        get_server_secret(settings, community),
+        VK_API_VERSION,
+        *EVENT_TYPES,
+    ]
+    return hashlib.sha256(json.dumps(config).encode()).hexdigest()
+
+
+def get_cached_confirmation_code(
+    redis_client: Redis,
+    settings: Settings,
+    community: Community | None = None,
+) -> str | None:
+    """Return the stored confirmation code, if the server was configured with the same settings."""
+    group_id = community.group_id if community else settings.VK_COMMUNITY_ID
+    cached = cast(
+        "dict[bytes, bytes]",
+        redis_client.hgetall(f"{CALLBACK_SERVER_KEY_PREFIX}{group_id}"),
+    )
+    if cached.get(b"fingerprint") != get_callback_server_fingerprint(settings, community).encode():
+        return None
+
+    code = cached.get(b"confirmation_code")
+    return code.decode() if code else None
+
+
+def cache_confirmation_code(
+    redis_client: Redis,
+    settings: Settings,
+    confirmation_code: str,
+    community: Community | None = None,
+) -> None:
+    group_id = community.group_id if community else settings.VK_COMMUNITY_ID
+    redis_client.hset(
+        f"{CALLBACK_SERVER_KEY_PREFIX}{group_id}",
+        mapping={
+            "fingerprint": get_callback_server_fingerprint(settings, community),
+            "confirmation_code": confirmation_code,
+        },
     )
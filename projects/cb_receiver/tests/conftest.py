@@ -34,6 +34,7 @@ def mock_vk(mocker: MockerFixture) -> VkMock:
         params: dict[str, Any] | None = None,  # noqa: ARG001
         *,
         data: dict[str, Any] | None = None,  # noqa: ARG001
+        token: str | None = None,  # noqa: ARG001
     ) -> object:
         if method not in mock._responses:
             msg = f"No mock registered for VK API method: {method}"
@@ -45,6 +46,31 @@ def mock_vk(mocker: MockerFixture) -> VkMock:
     return mock
 
 
+@pytest.fixture
+def mock_callback_cache(mocker: MockerFixture) -> None:
+    mocker.patch("app.main.get_cached_confirmation_code", return_value=None)
+    mocker.patch("app.main.cache_confirmation_code")
+
+
+@pytest.fixture
+def mock_vk_setup(mock_vk: VkMock, mock_callback_cache: None) -> VkMock:  # noqa: ARG001
+    mock_vk.post(
+        "groups.getCallbackConfirmationCode",
+        payload={"code": "test_code"},
+    )
+    mock_vk.post(
+        "groups.getCallbackServers",
+        payload={"count": 0, "items": []},
+    )
+    mock_vk.post(
+        "groups.addCallbackServer",
+        payload={"server_id": 1},
+    )
+    mock_vk.post("groups.setCallbackSettings", payload=1)
+
+    return mock_vk
+
+
 @pytest.fixture
 def caplog(caplog: LogCaptureFixture) -> Generator[LogCaptureFixture]:
     handler_id = logger.add(caplog.handler, format=format_record)
@@ -0,0 +1,355 @@
+"""Load-test harness for the callback receiver.
+
+Replays synthetic or recorded VK callback bodies against the ASGI app created by `create_app`,
+with Celery publishing to an in-memory broker and an in-process Redis stand-in,
+and reports latency percentiles and throughput.
+
+Usage: `python -m tests.load --requests 10000 --concurrency 50 [--recorded callbacks.jsonl]`
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+import statistics
+import threading
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import TYPE_CHECKING
+from unittest import mock
+
+import httpx
+from celery import Celery
+from celery.backends.redis import RedisBackend
+from loguru import logger
+from vtt_common.tasks import TASK_STATE_KEY_PREFIX
+
+from app.main import create_app
+from app.utils import cache_confirmation_code
+from tests.utils import get_settings_override
+
+if TYPE_CHECKING:
+    from collections.abc import AsyncGenerator, Iterable
+    from typing import Any, Self
+
+    from fastapi import FastAPI
+    from starlette.types import ASGIApp, Receive, Scope, Send
+
+    from app.config import Settings
+
+
+class InMemoryRedis:
+    """Thread-safe stand-in for the Redis commands used by the receiver."""
+
+    def __init__(self) -> None:
+        self._data: dict[str, tuple[Any, float | None]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _encode(value: Any) -> bytes:  # noqa: ANN401
+        if isinstance(value, bytes):
+            return value
+        return str(value).encode()
+
+    @staticmethod
+    def _key(key: str | bytes) -> str:
+        return key.decode() if isinstance(key, bytes) else key
+
+    def _get_alive(self, key: str) -> Any:  # noqa: ANN401
+        item = self._data.get(key)
+        if item is None:
+            return None
+
+        value, expires_at = item
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._data[key]
+            return None
+        return value
+
+    def get(self, key: str | bytes) -> bytes | None:
+        with self._lock:
+            value: bytes | None = self._get_alive(self._key(key))
+            return value
+
+    def set(self, key: str | bytes, value: Any, ex: int | None = None, *, nx: bool = False) -> bool | None:  # noqa: ANN401
+        key = self._key(key)
+        with self._lock:
+            if nx and self._get_alive(key) is not None:
+                return None
+            self._data[key] = (self._encode(value), time.monotonic() + ex if ex else None)
+            return True
+
+    def incr(self, key: str | bytes) -> int:
+        key = self._key(key)
+        with self._lock:
+            value = int(self._get_alive(key) or 0) + 1
+            self._data[key] = (self._encode(value), None)
+            return value
+
+    def delete(self, *keys: str | bytes) -> int:
+        with self._lock:
+            return sum(self._data.pop(self._key(key), None) is not None for key in keys)
+
+    def hgetall(self, key: str) -> dict[bytes, bytes]:
+        with self._lock:
+            return dict(self._get_alive(key) or {})
+
+    def hset(self, key: str, mapping: dict[str, Any]) -> int:
+        with self._lock:
+            value: dict[bytes, bytes] = self._get_alive(key) or {}
+            self._data[key] = (value, None)
+            added = len(mapping.keys() - {k.decode() for k in value})
+            value.update({self._encode(k): self._encode(v) for k, v in mapping.items()})
+            return added
+
+    def keys_with_prefix(self, prefix: str) -> list[str]:
+        with self._lock:
+            return [key for key in list(self._data) if key.startswith(prefix) and self._get_alive(key) is not None]
+
+    def pipeline(self, *, transaction: bool = True) -> InMemoryPipeline:  # noqa: ARG002
+        return InMemoryPipeline(self)
+
+    def pubsub(self, **kwargs: Any) -> InMemoryPubSub:  # noqa: ARG002
+        return InMemoryPubSub()
+
+
+class InMemoryPubSub:
+    """Accepts the result subscriptions Celery makes on publish. No messages are ever received."""
+
+    def __init__(self) -> None:
+        self.channels: set[str | bytes] = set()
+
+    def subscribe(self, *channels: str | bytes) -> None:
+        self.channels.update(channels)
+
+    def unsubscribe(self, *channels: str | bytes) -> None:
+        self.channels.difference_update(channels)
+
+    def get_message(self, timeout: float | None = None) -> None:  # noqa: ARG002
+        return None
+
+    def close(self) -> None:
+        self.channels.clear()
+
+
+class InMemoryPipeline:
+    def __init__(self, client: InMemoryRedis) -> None:
+        self._client = client
+        self._commands: list[tuple[str, tuple[Any, ...], dict[str, Any]]] = []
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self._commands.clear()
+
+    def set(self, *args: Any, **kwargs: Any) -> None:
+        self._commands.append(("set", args, kwargs))
+
+    def delete(self, *args: Any, **kwargs: Any) -> None:
+        self._commands.append(("delete", args, kwargs))
+
+    def incr(self, *args: Any, **kwargs: Any) -> None:
+        self._commands.append(("incr", args, kwargs))
+
+    def execute(self) -> list[Any]:
+        commands, self._commands = self._commands, []
+        return [getattr(self._client, name)(*args, **kwargs) for name, args, kwargs in commands]
+
+
+@dataclass(slots=True)
+class LoadReport:
+    requests: int
+    duration: float
+    latencies: list[float] = field(repr=False)
+    statuses: Counter[int]
+    published: int
+
+    @property
+    def throughput(self) -> float:
+        return self.requests / self.duration
+
+    def percentile(self, percent: int) -> float:
+        if len(self.latencies) < 2:
+            return self.latencies[0] if self.latencies else 0.0
+        return statistics.quantiles(self.latencies, n=100, method="inclusive")[percent - 1]
+
+    def format(self) -> str:
+        statuses = ", ".join(f"{status}: {count}" for status, count in sorted(self.statuses.items()))
+        return (
+            f"{self.requests} requests in {self.duration:.2f}s, {self.throughput:.0f} rps, "
+            f"p50: {self.percentile(50) * 1000:.2f} ms, p99: {self.percentile(99) * 1000:.2f} ms, "
+            f"statuses: [{statuses}], published tasks: {self.published}"
+        )
+
+
+def _create_wall_post_new(event_id: str, secret: str, post_id: int, **post: Any) -> dict[str, Any]:
+    return {
+        "type": "wall_post_new",
+        "event_id": event_id,
+        "group_id": 123456,
+        "v": "5.199",
+        "secret": secret,
+        "object": {
+            "inner_type": "wall_wallpost",
+            "owner_id": -123456,
+            "id": post_id,
+            "post_type": "post",
+            "text": "Post text " * 50,
+            **post,
+        },
+    }
+
+
+def generate_callbacks(
+    count: int,
+    secret: str,
+    *,
+    duplicates: float = 0.1,
+    confirmations: float = 0.01,
+    ads: float = 0.05,
+    donuts: float = 0.05,
+    seed: int = 0,
+) -> list[bytes]:
+    """Generate callback bodies with the given shares of VK retries, confirmations, ads and donuts."""
+    rnd = random.Random(seed)  # noqa: S311
+    bodies: list[bytes] = []
+    for i in range(1, count + 1):
+        roll = rnd.random() if bodies else 1.0
+        if roll < duplicates:
+            bodies.append(rnd.choice(bodies))
+            continue
+
+        roll -= duplicates
+        event_id = f"event{i}"
+        if roll < confirmations:
+            body = {"type": "confirmation", "event_id": event_id, "group_id": 123456, "v": "5.199", "secret": secret}
+        elif roll < confirmations + ads:
+            body = _create_wall_post_new(event_id, secret, i, marked_as_ads=1)
+        elif roll < confirmations + ads + donuts:
+            body = _create_wall_post_new(event_id, secret, i, donut={"is_donut": True})
+        else:
+            body = _create_wall_post_new(event_id, secret, i)
+        bodies.append(json.dumps(body).encode())
+    return bodies
+
+
+def load_recorded_callbacks(path: Path, secret: str) -> list[bytes]:
+    """Read callback bodies saved one per line and replace their secret with the test one."""
+    bodies: list[bytes] = []
+    with path.open("rb") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            body = json.loads(line)
+            body["secret"] = secret
+            bodies.append(json.dumps(body).encode())
+    return bodies
+
+
+class _LifespanStateMiddleware:
+    """Pass the lifespan state into requests, as the ASGI server would."""
+
+    def __init__(self, app: ASGIApp, state: dict[str, Any]) -> None:
+        self.app = app
+        self.state = state
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        scope["state"] = dict(self.state)
+        await self.app(scope, receive, send)
+
+
+@asynccontextmanager
+async def run_app(
+    settings: Settings | None = None,
+    redis_client: InMemoryRedis | None = None,
+) -> AsyncGenerator[tuple[FastAPI, httpx.AsyncClient, InMemoryRedis]]:
+    """Start the app with the in-memory broker and Redis, and yield a client to send callbacks with."""
+    settings = settings or get_settings_override()
+    redis_client = redis_client or InMemoryRedis()
+
+    # Skip the VK API calls on startup
+    cache_confirmation_code(redis_client, settings, "load_test_code")  # type: ignore[arg-type]
+
+    celery_app = Celery()
+    app = create_app(settings=settings, celery_app=celery_app)
+    celery_app.conf.broker_url = "memory://"
+
+    with mock.patch.object(RedisBackend, "client", redis_client):
+        async with app.router.lifespan_context(app) as state:
+            transport = httpx.ASGITransport(app=_LifespanStateMiddleware(app, dict(state or {})))
+            async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as client:
+                yield app, client, redis_client
+
+
+async def run_load(bodies: Iterable[bytes], concurrency: int = 50, settings: Settings | None = None) -> LoadReport:
+    bodies = list(bodies)
+    latencies: list[float] = []
+    statuses: Counter[int] = Counter()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with run_app(settings=settings) as (_, client, redis_client):
+
+        async def send(body: bytes) -> None:
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post("/", content=body)
+                latencies.append(time.perf_counter() - start)
+                statuses[response.status_code] += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(send(body) for body in bodies))
+        duration = time.perf_counter() - start
+
+    published = len(redis_client.keys_with_prefix(TASK_STATE_KEY_PREFIX))
+    return LoadReport(
+        requests=len(bodies),
+        duration=duration,
+        latencies=latencies,
+        statuses=statuses,
+        published=published,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=10000, help="number of synthetic callbacks")
+    parser.add_argument("--concurrency", type=int, default=50, help="number of requests in flight")
+    parser.add_argument("--recorded", type=Path, help="file with recorded callback bodies, one per line")
+    parser.add_argument("--duplicates", type=float, default=0.1, help="share of VK retries")
+    parser.add_argument("--confirmations", type=float, default=0.01, help="share of confirmation events")
+    parser.add_argument("--ads", type=float, default=0.05, help="share of ad posts")
+    parser.add_argument("--donuts", type=float, default=0.05, help="share of donut posts")
+    parser.add_argument("--verbose", action="store_true", help="keep the receiver logs")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logger.disable("app")
+        logging.getLogger("httpx").setLevel(logging.WARNING)
+        logging.getLogger("kombu").setLevel(logging.ERROR)
+
+    settings = get_settings_override()
+    if args.recorded:
+        bodies = load_recorded_callbacks(args.recorded, settings.VK_SERVER_SECRET)
+    else:
+        bodies = generate_callbacks(
+            args.requests,
+            settings.VK_SERVER_SECRET,
+            duplicates=args.duplicates,
+            confirmations=args.confirmations,
+            ads=args.ads,
+            donuts=args.donuts,
+        )
+
+    report = asyncio.run(run_load(bodies, concurrency=args.concurrency, settings=settings))
+    print(report.format())  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+import json
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any
+from unittest import mock
+
+import pytest
+from celery import Celery
+from celery.backends.redis import RedisBackend
+from fastapi.testclient import TestClient
+from loguru import logger
+from pydantic import BaseModel
+
+from app.main import create_app
+from app.schemas import WallPostType, decode_callback, decode_post
+from app.utils import cache_confirmation_code
+from tests.load import InMemoryRedis
+from tests.utils import get_settings_override
+
+if TYPE_CHECKING:
+    from collections.abc import Callable, Generator
+
+pytestmark = pytest.mark.benchmark
+
+
+class LegacyWallWallpostDonut(BaseModel):
+    is_donut: bool
+
+
+class LegacyWallWallpostFull(BaseModel):
+    owner_id: int | None = None
+    id: int | None = None
+    marked_as_ads: bool | None = None
+    donut: LegacyWallWallpostDonut | None = None
+    post_type: WallPostType | None = None
+
+
+class LegacyVkCallback(BaseModel):
+    type: str
+    group_id: int
+    event_id: str
+    v: str
+    secret: str | None = None
+    object: dict[str, Any] | None = None
+
+
+def _create_callback_body(attachments_count: int, event_id: str = "123", post_id: int = 111) -> bytes:
+    attachments = [
+        {
+            "type": "photo",
+            "photo": {
+                "id": i,
+                "owner_id": -1234,
+                "text": "Photo description " * 10,
+                "sizes": [
+                    {"type": size, "url": f"https://sun9-1.userapi.com/{size}/{i}.jpg", "width": 1280, "height": 720}
+                    for size in "smxyzw"
+                ],
+            },
+        }
+        for i in range(attachments_count)
+    ]
+    return json.dumps(
+        {
+            "type": "wall_post_new",
+            "event_id": event_id,
+            "group_id": 1234,
+            "v": "5.199",
+            "secret": "vk-server-secret",
+            "object": {
+                "inner_type": "wall_wallpost",
+                "owner_id": -1234,
+                "id": post_id,
+                "post_type": "post",
+                "marked_as_ads": 0,
+                "text": "Post text " * 500,
+                "attachments": attachments,
+            },
+        },
+    ).encode()
+
+
+def _legacy_decode(data: bytes) -> int | None:
+    body = LegacyVkCallback.model_validate_json(data)
+    post = LegacyWallWallpostFull(**(body.object or {}))
+    return post.id
+
+
+def _legacy_decode_post(data: dict[str, Any] | None) -> LegacyWallWallpostFull | None:
+    return LegacyWallWallpostFull(**data) if data else None
+
+
+def _fast_decode(data: bytes) -> int | None:
+    body = decode_callback(data)
+    post = decode_post(body.object)
+    return post.id if post else None
+
+
+def _get_rps(func: Callable[[bytes], int | None], data: bytes, duration: float = 1.0) -> float:
+    count = 0
+    start = time.perf_counter()
+    while (elapsed := time.perf_counter() - start) < duration:
+        assert func(data) == 111
+        count += 1
+    return count / elapsed
+
+
+@pytest.mark.parametrize("attachments_count", [0, 10])
+def test_callback_decoding(attachments_count: int, capsys: pytest.CaptureFixture[str]) -> None:
+    data = _create_callback_body(attachments_count)
+
+    legacy_rps = _get_rps(_legacy_decode, data)
+    fast_rps = _get_rps(_fast_decode, data)
+
+    with capsys.disabled():
+        print(  # noqa: T201
+            f"\n[{len(data)} bytes, {attachments_count} attachments] "
+            f"pydantic: {legacy_rps:.0f} rps, msgspec: {fast_rps:.0f} rps ({fast_rps / legacy_rps:.1f}x)",
+        )
+
+
+@contextmanager
+def _run_client() -> Generator[TestClient]:
+    """Start the app with the in-memory broker and Redis. Logs of the app are disabled, as in the load harness."""
+    settings = get_settings_override()
+    redis_client = InMemoryRedis()
+    # Skip the VK API calls on startup
+    cache_confirmation_code(redis_client, settings, "benchmark_code")  # type: ignore[arg-type]
+
+    celery_app = Celery()
+    app = create_app(settings=settings, celery_app=celery_app)
+    celery_app.conf.broker_url = "memory://"
+
+    logger.disable("app")
+    try:
+        with mock.patch.object(RedisBackend, "client", redis_client), TestClient(app) as client:
+            yield client
+    finally:
+        logger.enable("app")
+
+
+def _get_endpoint_rps(client: TestClient, attachments_count: int, duration: float = 1.0) -> float:
+    """Send new posts to `vk_callback` one by one and return the number of requests per second."""
+    bodies = [
+        _create_callback_body(attachments_count, event_id=f"event{post_id}", post_id=post_id)
+        for post_id in range(1, 5001)
+    ]
+    count = 0
+    start = time.perf_counter()
+    for body in bodies:
+        response = client.post("/", content=body)
+        assert response.status_code == 200
+        count += 1
+        if time.perf_counter() - start >= duration:
+            break
+    return count / (time.perf_counter() - start)
+
+
+@pytest.mark.parametrize("attachments_count", [0, 10])
+def test_callback_endpoint(attachments_count: int, capsys: pytest.CaptureFixture[str]) -> None:
+    with _run_client() as client:
+        fast_rps = _get_endpoint_rps(client, attachments_count)
+
+    with (
+        mock.patch("app.main.decode_callback", LegacyVkCallback.model_validate_json),
+        mock.patch("app.main.decode_post", _legacy_decode_post),
+        _run_client() as client,
+    ):
+        legacy_rps = _get_endpoint_rps(client, attachments_count)
+
+    with capsys.disabled():
+        print(  # noqa: T201
+            f"\n[vk_callback, {attachments_count} attachments] "
+            f"pydantic: {legacy_rps:.0f} rps, msgspec: {fast_rps:.0f} rps ({fast_rps / legacy_rps:.1f}x)",
+        )
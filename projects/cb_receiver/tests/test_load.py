@@ -0,0 +1,44 @@
+from __future__ import annotations
+
+import json
+
+import pytest
+
+from tests.load import generate_callbacks, run_load
+from tests.utils import get_settings_override
+
+
+def _count_forwarded_posts(bodies: list[bytes]) -> int:
+    post_ids = set()
+    for body in map(json.loads, bodies):
+        post = body.get("object", {})
+        if body["type"] == "wall_post_new" and not post.get("marked_as_ads") and not post.get("donut"):
+            post_ids.add(post["id"])
+    return len(post_ids)
+
+
+@pytest.mark.asyncio
+async def test_load_harness() -> None:
+    settings = get_settings_override()
+    bodies = generate_callbacks(200, settings.VK_SERVER_SECRET, duplicates=0.2, confirmations=0.1)
+
+    report = await run_load(bodies, concurrency=10, settings=settings)
+
+    assert report.requests == 200
+    assert report.statuses == {200: 200}
+    assert report.published == _count_forwarded_posts(bodies)
+    assert report.percentile(50) <= report.percentile(99)
+
+
+@pytest.mark.benchmark
+@pytest.mark.asyncio
+@pytest.mark.parametrize("concurrency", [1, 50])
+async def test_load(concurrency: int, capsys: pytest.CaptureFixture[str]) -> None:
+    settings = get_settings_override()
+    bodies = generate_callbacks(5000, settings.VK_SERVER_SECRET)
+
+    report = await run_load(bodies, concurrency=concurrency, settings=settings)
+
+    assert report.statuses[200] == report.requests
+    with capsys.disabled():
+        print(f"\n[concurrency {concurrency}] {report.format()}")  # noqa: T201
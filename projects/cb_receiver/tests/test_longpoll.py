@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Any
+from unittest.mock import MagicMock
+
+import httpx
+import pytest
+
+from app.event_cache import EventIdCache
+from app.longpoll import LongPollReceiver
+from tests.utils import get_settings_override
+
+if TYPE_CHECKING:
+    from tests.conftest import VkMock
+
+
+LONG_POLL_SERVER = {
+    "key": "long-poll-key",
+    "server": "https://lp.vk.ru/whp/123456",
+    "ts": "10",
+}
+
+
+def _wall_post_new(event_id: str, post_id: int) -> dict[str, Any]:
+    return {
+        "type": "wall_post_new",
+        "event_id": event_id,
+        "group_id": 123456,
+        "v": "5.199",
+        "object": {
+            "inner_type": "wall_wallpost",
+            "owner_id": -123456,
+            "id": post_id,
+            "post_type": "post",
+        },
+    }
+
+
+@pytest.fixture
+def mock_long_poll_server(mock_vk: VkMock) -> VkMock:
+    mock_vk.post("groups.getLongPollServer", payload=LONG_POLL_SERVER)
+    return mock_vk
+
+
+def _create_receiver(
+    responses: list[dict[str, Any]],
+    requests: list[httpx.Request],
+    saved_ts: bytes | None = None,
+) -> LongPollReceiver:
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(200, json=responses.pop(0))
+
+    redis_client = MagicMock()
+    redis_client.get.return_value = saved_ts
+    return LongPollReceiver(
+        settings=get_settings_override(),
+        publisher=MagicMock(),
+        event_cache=EventIdCache(maxsize=10, ttl=60),
+        redis_client=redis_client,
+        http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+    )
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("mock_long_poll_server")
+async def test_poll_publishes_new_posts() -> None:
+    requests: list[httpx.Request] = []
+    receiver = _create_receiver(
+        responses=[
+            {
+                "ts": "12",
+                "updates": [
+                    _wall_post_new("event-1", 1),
+                    _wall_post_new("event-1", 1),
+                    _wall_post_new("event-2", 2),
+                ],
+            },
+        ],
+        requests=requests,
+    )
+
+    await receiver.start()
+    await receiver.poll()
+
+    assert requests[0].url.params["ts"] == "10"
+    assert requests[0].url.params["key"] == "long-poll-key"
+    publisher = receiver.publisher
+    assert isinstance(publisher, MagicMock)
+    assert [call.args[0].task_id for call in publisher.publish.call_args_list] == [
+        "wall_-123456_1",
+        "wall_-123456_2",
+    ]
+    # Events are sent to the broker before `ts` is saved
+    publisher.flush.assert_called_once_with()
+    assert receiver.ts == "12"
+    redis_client = receiver.redis_client
+    assert isinstance(redis_client, MagicMock)
+    redis_client.set.assert_called_once_with("vtt-longpoll-ts-123456", "12")
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("mock_long_poll_server")
+async def test_resume_from_saved_ts() -> None:
+    requests: list[httpx.Request] = []
+    receiver = _create_receiver(responses=[{"ts": "43", "updates": []}], requests=requests, saved_ts=b"42")
+
+    await receiver.start()
+    await receiver.poll()
+
+    assert requests[0].url.params["ts"] == "42"
+    assert receiver.ts == "43"
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    ("response", "expected_ts"),
+    [
+        ({"failed": 1, "ts": "30"}, "30"),
+        ({"failed": 2}, "42"),
+        ({"failed": 3}, "10"),
+    ],
+)
+@pytest.mark.usefixtures("mock_long_poll_server")
+async def test_poll_failed(response: dict[str, Any], expected_ts: str) -> None:
+    requests: list[httpx.Request] = []
+    receiver = _create_receiver(responses=[response], requests=requests, saved_ts=b"42")
+
+    await receiver.start()
+    await receiver.poll()
+
+    assert receiver.ts == expected_ts
+    publisher = receiver.publisher
+    assert isinstance(publisher, MagicMock)
+    publisher.publish.assert_not_called()
@@ -1,15 +1,29 @@
 from __future__ import annotations
 
-from typing import TYPE_CHECKING
+import json
+import queue
+from typing import TYPE_CHECKING, cast
 
 import pytest
 from fastapi.testclient import TestClient
 
+from app.event_cache import EventIdCache
 from app.main import create_app
-from app.utils import configure_callback_server, get_confirmation_code
+from app.utils import (
+    cache_confirmation_code,
+    configure_callback_server,
+    get_cached_confirmation_code,
+    get_callback_server_fingerprint,
+    get_confirmation_code,
+)
+from tests.load import InMemoryRedis
 from tests.utils import get_settings_override
 
 if TYPE_CHECKING:
+    from pathlib import Path
+    from typing import Any
+    from unittest.mock import MagicMock, _Call
+
     from _pytest.logging import LogCaptureFixture
     from pytest_mock import MockerFixture
 
@@ -21,6 +35,11 @@ app = create_app(settings=get_settings_override())
 client = TestClient(app)
 
 
+@pytest.fixture(autouse=True)
+def clear_event_cache() -> None:
+    app.state.event_cache.clear()
+
+
 def test_missing_body() -> None:
     response = client.post("/")
 
@@ -135,21 +154,8 @@ async def test_create_new_vk_server_if_not_found_by_title(mock_vk: VkMock, caplo
     assert "No callback server found by title 'vk-to-tgm', added new." in caplog.text
 
 
-def test_confirmation(mock_vk: VkMock) -> None:
-    mock_vk.post(
-        "groups.getCallbackConfirmationCode",
-        payload={"code": "test_code"},
-    )
-    mock_vk.post(
-        "groups.getCallbackServers",
-        payload={"count": 0, "items": []},
-    )
-    mock_vk.post(
-        "groups.addCallbackServer",
-        payload={"server_id": 1},
-    )
-    mock_vk.post("groups.setCallbackSettings", payload=1)
-
+@pytest.mark.usefixtures("mock_vk_setup")
+def test_confirmation() -> None:
     with client:
         response = client.post(
             "/",
@@ -167,6 +173,58 @@ def test_confirmation(mock_vk: VkMock) -> None:
     assert response.text == "test_code"
 
 
+@pytest.mark.usefixtures("mock_vk")
+def test_skip_configured_callback_server(mocker: MockerFixture, caplog: LogCaptureFixture) -> None:
+    settings = get_settings_override()
+    redis_client = mocker.MagicMock()
+    redis_client.hgetall.return_value = {
+        b"fingerprint": get_callback_server_fingerprint(settings).encode(),
+        b"confirmation_code": b"cached_code",
+    }
+    mocker.patch("celery.backends.redis.RedisBackend.client", redis_client)
+
+    with client:
+        response = client.post(
+            "/",
+            json={
+                "type": "confirmation",
+                "event_id": "123",
+                "group_id": 123456,
+                "v": "5.199",
+                "secret": "vk-server-secret",
+                "object": {},
+            },
+        )
+
+    assert response.text == "cached_code"
+    assert "Callback server settings have not changed, skipping setup." in caplog.text
+    redis_client.hset.assert_not_called()
+
+
+@pytest.mark.usefixtures("mock_vk_setup")
+def test_reconfigure_changed_callback_server(mocker: MockerFixture, caplog: LogCaptureFixture) -> None:
+    mocker.patch("app.main.get_cached_confirmation_code", get_cached_confirmation_code)
+    mocker.patch("app.main.cache_confirmation_code", cache_confirmation_code)
+    redis_client = mocker.MagicMock()
+    redis_client.hgetall.return_value = {
+        b"fingerprint": b"outdated",
+        b"confirmation_code": b"cached_code",
+    }
+    mocker.patch("celery.backends.redis.RedisBackend.client", redis_client)
+
+    with client:
+        pass
+
+    assert "Added new callback server 'vk-to-tgm'" in caplog.text
+    redis_client.hset.assert_called_once_with(
+        "vtt-callback-server-123456",
+        mapping={
+            "fingerprint": get_callback_server_fingerprint(get_settings_override()),
+            "confirmation_code": "test_code",
+        },
+    )
+
+
 def test_missing_owner_id(caplog: LogCaptureFixture) -> None:
     response = client.post(
         "/",
@@ -256,71 +314,366 @@ def test_ignore_donut_post(caplog: LogCaptureFixture) -> None:
     assert "[123] [1234_111] Ignoring donut post" in caplog.text
 
 
-@pytest.mark.parametrize("post_type", ["post", "reply", "photo", "video"])
-def test_new_wall_post(mocker: MockerFixture, post_type: str) -> None:
-    mocker.patch("app.main.get_queued_task", return_value=None)
-    mocked_send_task = mocker.patch("celery.Celery.send_task")
+@pytest.fixture
+def mocked_publish(mocker: MockerFixture) -> MagicMock:
+    """Mock `publish` of the producer, that sends task messages to the broker."""
+    producer_or_acquire = mocker.patch("celery.Celery.producer_or_acquire")
+    return cast("MagicMock", producer_or_acquire.return_value.__enter__.return_value.publish)
 
-    response = client.post(
-        "/",
-        json={
-            "type": "wall_post_new",
-            "event_id": "123",
-            "group_id": 123456,
-            "v": "5.199",
-            "secret": "vk-server-secret",
-            "object": {
-                "inner_type": "wall_wallpost",
-                "owner_id": 1234,
-                "id": 111,
-                "post_type": post_type,
-            },
-        },
+
+def _get_published_task(call: _Call) -> dict[str, Any]:
+    body, headers = call.args[0], call.kwargs["headers"]
+    return {
+        "name": headers["task"],
+        "task_id": headers["id"],
+        "queue": call.kwargs["routing_key"],
+        "kwargs": body[1],
+        "claimed": headers["vtt_claimed"],
+        "ignore_result": headers["ignore_result"],
+    }
+
+
+@pytest.fixture
+def mock_claim(mocker: MockerFixture, mocked_publish: MagicMock) -> MagicMock:  # noqa: ARG001
+    mocker.patch("celery.backends.redis.RedisBackend.client", InMemoryRedis())
+    return mocker.patch(
+        "app.publisher.claim_tasks",
+        side_effect=lambda _backend, task_ids: [True] * len(task_ids),
     )
 
+
+@pytest.mark.parametrize("post_type", ["post", "reply", "photo", "video"])
+@pytest.mark.usefixtures("mock_vk_setup", "mock_claim")
+def test_new_wall_post(mocked_publish: MagicMock, post_type: str) -> None:
+    with client:
+        response = client.post(
+            "/",
+            json={
+                "type": "wall_post_new",
+                "event_id": "123",
+                "group_id": 123456,
+                "v": "5.199",
+                "secret": "vk-server-secret",
+                "object": {
+                    "inner_type": "wall_wallpost",
+                    "owner_id": 1234,
+                    "id": 111,
+                    "post_type": post_type,
+                },
+            },
+        )
+
     assert response.status_code == 200
     assert response.text == "ok"
 
-    assert mocked_send_task.call_args.args == ("app.main.forward_wall",)
-    assert mocked_send_task.call_args.kwargs == {
+    assert _get_published_task(mocked_publish.call_args) == {
+        "name": "app.main.forward_wall",
         "task_id": "wall_1234_111",
         "queue": "vtt-wall",
+        "kwargs": {"owner_id": 1234, "wall_id": 111, "seq": 1},
+        "claimed": True,
+        "ignore_result": True,
+    }
+
+
+@pytest.mark.usefixtures("mock_vk_setup", "mock_claim")
+def test_edited_wall_post(mocked_publish: MagicMock) -> None:
+    with client:
+        response = client.post(
+            "/",
+            json={
+                "type": "wall_post_edit",
+                "event_id": "123",
+                "group_id": 123456,
+                "v": "5.199",
+                "secret": "vk-server-secret",
+                "object": {
+                    "inner_type": "wall_wallpost",
+                    "owner_id": 1234,
+                    "id": 111,
+                    "post_type": "post",
+                },
+            },
+        )
+
+    assert response.status_code == 200
+    assert response.text == "ok"
+
+    assert _get_published_task(mocked_publish.call_args) == {
+        "name": "app.main.edit_wall",
+        "task_id": "wall_1234_111_edit_123",
+        "queue": "vtt-wall",
         "kwargs": {"owner_id": 1234, "wall_id": 111},
+        "claimed": True,
+        "ignore_result": True,
     }
 
 
-def test_skip_wall_post(mocker: MockerFixture) -> None:
-    mocker.patch(
-        "app.main.get_queued_task",
-        return_value={
-            "status": "SENT",
-            "result": None,
-            "traceback": None,
-            "children": [],
-            "date_done": None,
-            "task_id": "wall_1234_111",
+@pytest.mark.usefixtures("mock_vk_setup")
+def test_skip_wall_post(mocker: MockerFixture, mocked_publish: MagicMock, caplog: LogCaptureFixture) -> None:
+    mocker.patch("app.publisher.claim_tasks", return_value=[False])
+
+    with client:
+        response = client.post(
+            "/",
+            json={
+                "type": "wall_post_new",
+                "event_id": "123",
+                "group_id": 123456,
+                "v": "5.199",
+                "secret": "vk-server-secret",
+                "object": {
+                    "inner_type": "wall_wallpost",
+                    "owner_id": 1234,
+                    "id": 111,
+                    "post_type": "post",
+                },
+            },
+        )
+
+    assert response.status_code == 200
+    assert response.text == "ok"
+
+    assert not mocked_publish.called
+    assert "[123] [1234_111] Post already exists" in caplog.text
+
+
+@pytest.mark.usefixtures("mock_vk_setup", "mock_claim")
+def test_skip_duplicate_event(mocked_publish: MagicMock, caplog: LogCaptureFixture) -> None:
+    with client:
+        for _ in range(2):
+            response = client.post(
+                "/",
+                json={
+                    "type": "wall_post_new",
+                    "event_id": "123",
+                    "group_id": 123456,
+                    "v": "5.199",
+                    "secret": "vk-server-secret",
+                    "object": {
+                        "inner_type": "wall_wallpost",
+                        "owner_id": 1234,
+                        "id": 111,
+                        "post_type": "post",
+                    },
+                },
+            )
+
+            assert response.status_code == 200
+            assert response.text == "ok"
+
+    assert mocked_publish.call_count == 1
+    assert "[123] Duplicate event, skipping" in caplog.text
+
+
+def test_publish_queue_full(mocker: MockerFixture) -> None:
+    mocked_publish = mocker.patch.object(app.state.publisher, "publish", side_effect=[queue.Full, None])
+
+    json = {
+        "type": "wall_post_new",
+        "event_id": "123",
+        "group_id": 123456,
+        "v": "5.199",
+        "secret": "vk-server-secret",
+        "object": {
+            "inner_type": "wall_wallpost",
+            "owner_id": 1234,
+            "id": 111,
+            "post_type": "post",
         },
-    )
-    mocked_send_task = mocker.patch("celery.Celery.send_task")
+    }
+    response = client.post("/", json=json)
 
-    response = client.post(
+    assert response.status_code == 503
+
+    # VK retry of the rejected event is not skipped as a duplicate
+    response = client.post("/", json=json)
+
+    assert response.status_code == 200
+    assert response.text == "ok"
+    assert mocked_publish.call_count == 2
+
+
+@pytest.mark.usefixtures("mock_vk_setup")
+def test_publish_in_batches(mocker: MockerFixture, mock_claim: MagicMock, mocked_publish: MagicMock) -> None:
+    publisher = app.state.publisher
+    mocker.patch.object(publisher, "batch_size", 2)
+
+    for post_id in range(1, 6):
+        response = client.post(
+            "/",
+            json={
+                "type": "wall_post_new",
+                "event_id": str(post_id),
+                "group_id": 123456,
+                "v": "5.199",
+                "secret": "vk-server-secret",
+                "object": {
+                    "inner_type": "wall_wallpost",
+                    "owner_id": 1234,
+                    "id": post_id,
+                    "post_type": "post",
+                },
+            },
+        )
+        assert response.status_code == 200
+
+    # Queued tasks are sent on startup and flushed on shutdown
+    with client:
+        pass
+
+    assert mocked_publish.call_count == 5
+    assert [_get_published_task(call)["kwargs"]["seq"] for call in mocked_publish.call_args_list] == [1, 2, 3, 4, 5]
+    assert [len(call.args[1]) for call in mock_claim.call_args_list] == [2, 2, 1]
+
+
+@pytest.mark.usefixtures("mock_vk_setup")
+def test_retry_failed_publish(mocker: MockerFixture, mock_claim: MagicMock, mocked_publish: MagicMock) -> None:
+    mocker.patch("app.publisher.RETRY_DELAY", 0)
+    mock_claim.side_effect = [ConnectionError, [True]]
+    mocked_publish.side_effect = [ConnectionError, None]
+
+    with client:
+        response = client.post(
+            "/",
+            json={
+                "type": "wall_post_new",
+                "event_id": "123",
+                "group_id": 123456,
+                "v": "5.199",
+                "secret": "vk-server-secret",
+                "object": {
+                    "inner_type": "wall_wallpost",
+                    "owner_id": 1234,
+                    "id": 111,
+                    "post_type": "post",
+                },
+            },
+        )
+        assert response.status_code == 200
+
+        # Flush waits for the retried task
+        app.state.publisher.flush()
+        assert mocked_publish.call_count == 2
+
+    # The claim is stored and the sequence number is taken only once
+    assert mock_claim.call_count == 2
+    assert mocked_publish.call_count == 2
+    assert [_get_published_task(call)["kwargs"]["seq"] for call in mocked_publish.call_args_list] == [1, 1]
+
+
+@pytest.mark.usefixtures("mock_vk_setup", "mock_claim")
+def test_give_up_publish_on_shutdown(mocker: MockerFixture, mocked_publish: MagicMock) -> None:
+    mocked_publish.side_effect = ConnectionError
+    mocked_release = mocker.patch("app.publisher.release_unsent_task")
+    mocker.patch.object(app.state.publisher, "close_timeout", 0)
+
+    with client:
+        response = client.post(
+            "/",
+            json={
+                "type": "wall_post_new",
+                "event_id": "123",
+                "group_id": 123456,
+                "v": "5.199",
+                "secret": "vk-server-secret",
+                "object": {
+                    "inner_type": "wall_wallpost",
+                    "owner_id": 1234,
+                    "id": 111,
+                    "post_type": "post",
+                },
+            },
+        )
+        assert response.status_code == 200
+
+    # The claim is released and the sequence number is completed, so later posts of the wall do not wait for it
+    mocked_release.assert_called_once_with(mocker.ANY, "wall_1234_111", {"owner_id": 1234, "wall_id": 111, "seq": 1})
+
+
+def test_event_cache_eviction() -> None:
+    event_cache = EventIdCache(maxsize=2, ttl=60)
+
+    assert event_cache.add("1")
+    assert event_cache.add("2")
+    assert not event_cache.add("1")
+    assert event_cache.add("3")
+
+    assert list(event_cache._event_ids) == ["1", "3"]
+
+
+def test_event_cache_redis_error(mocker: MockerFixture) -> None:
+    redis_client = mocker.MagicMock()
+    redis_client.set.side_effect = [ConnectionError, True]
+    event_cache = EventIdCache(maxsize=2, ttl=60, redis_client=redis_client)
+
+    with pytest.raises(ConnectionError):
+        event_cache.add("1")
+
+    # VK retry of the failed event is not skipped as a duplicate
+    assert event_cache.add("1")
+
+
+@pytest.fixture
+def community_client(tmp_path: Path) -> TestClient:
+    communities_file = tmp_path / "communities.json"
+    communities_file.write_text(
+        json.dumps(
+            [
+                {
+                    "group_id": 654321,
+                    "channel_id": -100654321,
+                    "vk_community_token": "other-community-token",
+                    "server_secret": "other-server-secret",
+                },
+            ],
+        ),
+    )
+    settings = get_settings_override().model_copy(update={"VTT_COMMUNITIES_FILE": str(communities_file)})
+    return TestClient(create_app(settings=settings))
+
+
+@pytest.mark.parametrize(
+    ("group_id", "secret", "status_code"),
+    [
+        (654321, "other-server-secret", 200),
+        (654321, "vk-server-secret", 401),
+        (123456, "other-server-secret", 401),
+    ],
+)
+def test_community_secret(community_client: TestClient, group_id: int, secret: str, status_code: int) -> None:
+    response = community_client.post(
         "/",
         json={
             "type": "wall_post_new",
             "event_id": "123",
-            "group_id": 123456,
+            "group_id": group_id,
             "v": "5.199",
-            "secret": "vk-server-secret",
+            "secret": secret,
             "object": {
                 "inner_type": "wall_wallpost",
-                "owner_id": 1234,
-                "id": 111,
-                "post_type": "post",
             },
         },
     )
 
-    assert response.status_code == 200
-    assert response.text == "ok"
+    assert response.status_code == status_code
 
-    assert not mocked_send_task.called
+
+def test_community_confirmation(community_client: TestClient, mock_vk_setup: VkMock) -> None:
+    mock_vk_setup.post("groups.getCallbackConfirmationCode", payload={"code": "other_code"})
+
+    with community_client:
+        response = community_client.post(
+            "/",
+            json={
+                "type": "confirmation",
+                "event_id": "123",
+                "group_id": 654321,
+                "v": "5.199",
+                "secret": "other-server-secret",
+                "object": {},
+            },
+        )
+
+    assert response.status_code == 200
+    assert response.text == "other_code"
@@ -78,7 +78,7 @@ class Settings(BaseSettings):
 
     VK_SERVER_TITLE: str = Field(default="vk-to-tgm", min_length=1, max_length=14)
 
-    SERVER_URL: Annotated[str, pattern_validator(SERVER_URL_PATTERN)]
+    SERVER_URL: Annotated[str | None, pattern_validator(SERVER_URL_PATTERN)] = None
 
     TGM_API_ID: int
     TGM_API_HASH: str = Field(min_length=1)
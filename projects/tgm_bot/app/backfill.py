@@ -0,0 +1,115 @@
+"""Fill the index of sent VK posts and playlists from the history of Telegram channels.
+
+Posts sent before the index existed are found by VK links in channel messages.
+Telegram bots can't read channel history, so the user client is used.
+
+Usage: `python -m app.backfill`
+"""
+
+from __future__ import annotations
+
+import asyncio
+import re
+from typing import TYPE_CHECKING
+
+from loguru import logger
+from telethon import TelegramClient
+from telethon.sessions import StringSession
+from telethon.tl.types import MessageEntityTextUrl, MessageEntityUrl
+from vtt_common.messages import set_message_ids
+from vtt_common.proxy import get_tgm_proxy_config
+from vtt_common.schemas import VttTaskType
+from vtt_common.tasks import get_task_id
+
+from app.config import settings
+from app.worker import app as celery_app
+
+if TYPE_CHECKING:
+    from telethon.tl.patched import Message
+
+WALL_URL_PATTERN = re.compile(r"https://(m\.)?vk\.(ru|com)/wall(?P<owner_id>-?\d+)_(?P<id>\d+)")
+PLAYLIST_URL_PATTERN = re.compile(r"https://(m\.)?vk\.(ru|com)/music/playlist/(?P<owner_id>-?\d+)_(?P<id>\d+)")
+
+# Number of message ids stored in Redis at once
+BATCH_SIZE = 500
+
+
+def _get_post_id(message: Message, pattern: re.Pattern[str]) -> tuple[int, int] | None:
+    """Return owner id and id of the post from the last matching link, i.e. the link in the message footer."""
+    urls = [entity.url for entity in message.entities or [] if isinstance(entity, MessageEntityTextUrl)]
+    urls += [text for _, text in message.get_entities_text(MessageEntityUrl)]
+
+    for url in reversed(urls):
+        match = pattern.match(url)
+        if match:
+            return int(match["owner_id"]), int(match["id"])
+    return None
+
+
+async def backfill_channel(
+    client: TelegramClient,
+    channel_id: int,
+    task_type: VttTaskType,
+    pattern: re.Pattern[str],
+) -> int:
+    """Index messages from the oldest to the newest, so the newest message wins for reposted posts."""
+    redis_client = celery_app.backend.client
+    message_ids: dict[str, int] = {}
+    count = 0
+    async for message in client.iter_messages(channel_id, reverse=True):
+        post_id = _get_post_id(message, pattern)
+        if post_id is None:
+            continue
+
+        message_ids[get_task_id(task_type, *post_id)] = message.id
+        if len(message_ids) >= BATCH_SIZE:
+            set_message_ids(redis_client, channel_id, message_ids)
+            count += len(message_ids)
+            message_ids.clear()
+            logger.info("Indexed {} messages of channel {}", count, channel_id)
+
+    set_message_ids(redis_client, channel_id, message_ids)
+    return count + len(message_ids)
+
+
+async def main() -> None:
+    logger.info("Creating Telegram user client...")
+    proxy_config = (
+        get_tgm_proxy_config(
+            proxy_type=settings.TGM_PROXY_TYPE,
+            proxy_addr=settings.TGM_PROXY_ADDR,
+            proxy_port=settings.TGM_PROXY_PORT,
+            proxy_user=settings.TGM_PROXY_USER,
+            proxy_pass=settings.TGM_PROXY_PASS,
+            proxy_rdns=settings.TGM_PROXY_RDNS,
+        )
+        # NOTE: MTProto proxy not working with user client
+        # (ValueError: readexactly size can not be less than zero)
+        if settings.TGM_PROXY_TYPE != "mtproto"
+        else {}
+    )
+    client = TelegramClient(
+        session=StringSession(settings.TGM_CLIENT_SESSION),
+        api_id=settings.TGM_API_ID,
+        api_hash=settings.TGM_API_HASH,
+        **proxy_config,
+    )
+    await client.start(phone=lambda: settings.TGM_CLIENT_PHONE)
+    logger.info("Telegram user client started successfully")
+
+    async with client:
+        count = await backfill_channel(client, settings.TGM_CHANNEL_ID, VttTaskType.wall, WALL_URL_PATTERN)
+        logger.info("Indexed {} wall posts", count)
+
+        if settings.TGM_PL_CHANNEL_ID:
+            count = await backfill_channel(
+                client,
+                settings.TGM_PL_CHANNEL_ID,
+                VttTaskType.playlist,
+                PLAYLIST_URL_PATTERN,
+            )
+            logger.info("Indexed {} playlists", count)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -14,6 +14,7 @@ class Settings(BaseSettings):
 
     TGM_BOT_TOKEN: str
     TGM_BOT_SESSION: str
+    TGM_BOT_SESSION_BACKEND: Literal["string", "redis"] = "string"
 
     TGM_CLIENT_PHONE: str
     TGM_CLIENT_SESSION: str
@@ -36,6 +37,13 @@ class Settings(BaseSettings):
 
     VTT_LANGUAGE: Literal["en", "ru"] = "en"
 
+    VTT_PERMISSION_CACHE_TTL: int = 300
+    VTT_PERMISSION_CACHE_NEGATIVE_TTL: int = 30
+
+    VTT_BOT_STATE_BACKEND: Literal["memory", "redis"] = "memory"
+    VTT_BOT_STATE_TTL: int = 86400
+    VTT_BOT_STATE_MAX_USERS: int = 10000
+
 
 settings = Settings()
 
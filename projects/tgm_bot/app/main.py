@@ -6,10 +6,13 @@ from telethon.sessions import StringSession
 from vkbottle.api.api import API
 from vkbottle.http import AiohttpClient
 from vtt_common.proxy import get_tgm_proxy_config
+from vtt_common.sessions import RedisSession
 
 from app import plugins
 from app.config import settings
+from app.task_queue import METRICS_LOG_INTERVAL, task_queue
 from app.vk.request_validators import VkLangRequestValidator
+from app.worker import app as celery_app
 
 
 async def main() -> None:
@@ -17,34 +20,13 @@ async def main() -> None:
     vk_api.request_validators.append(VkLangRequestValidator())
     logger.info("VK API client initialized")
 
-    logger.info("Creating Telegram user client...")
-    proxy_config = (
-        get_tgm_proxy_config(
-            proxy_type=settings.TGM_PROXY_TYPE,
-            proxy_addr=settings.TGM_PROXY_ADDR,
-            proxy_port=settings.TGM_PROXY_PORT,
-            proxy_user=settings.TGM_PROXY_USER,
-            proxy_pass=settings.TGM_PROXY_PASS,
-            proxy_rdns=settings.TGM_PROXY_RDNS,
-        )
-        # NOTE: MTProto proxy not working with user client
-        # (ValueError: readexactly size can not be less than zero)
-        if settings.TGM_PROXY_TYPE != "mtproto"
-        else {}
-    )
-    client = TelegramClient(
-        session=StringSession(settings.TGM_CLIENT_SESSION),
-        api_id=settings.TGM_API_ID,
-        api_hash=settings.TGM_API_HASH,
-        **proxy_config,
-    )
-    client.parse_mode = "html"
-    await client.start(phone=lambda: settings.TGM_CLIENT_PHONE)
-    logger.info("Telegram user client started successfully")
-
     logger.info("Creating Telegram bot client...")
     bot = TelegramClient(
-        session=StringSession(settings.TGM_BOT_SESSION),
+        session=(
+            RedisSession(celery_app.backend.client, settings.TGM_BOT_SESSION)
+            if settings.TGM_BOT_SESSION_BACKEND == "redis"
+            else StringSession(settings.TGM_BOT_SESSION)
+        ),
         api_id=settings.TGM_API_ID,
         api_hash=settings.TGM_API_HASH,
         **get_tgm_proxy_config(
@@ -62,16 +44,18 @@ async def main() -> None:
     await bot.start(bot_token=settings.TGM_BOT_TOKEN)
     logger.info("Telegram bot client started successfully")
 
-    async with client:
-        await plugins.add_event_handlers(bot=bot, client=client, vk_api=vk_api)
+    await plugins.add_event_handlers(bot=bot, vk_api=vk_api)
 
-        logger.info("Starting bot event loop")
-        try:
-            await bot.run_until_disconnected()
-        finally:
-            await vk_api.http_client.close()
+    logger.info("Starting bot event loop")
+    metrics_task = asyncio.create_task(task_queue.log_metrics(interval=METRICS_LOG_INTERVAL))
+    try:
+        await bot.run_until_disconnected()
+    finally:
+        metrics_task.cancel()
+        await task_queue.close()
+        await vk_api.http_client.close()
 
-        logger.info("Bot disconnected, shutting down")
+    logger.info("Bot disconnected, shutting down")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,52 @@
+from __future__ import annotations
+
+import time
+
+from app.config import settings
+
+
+class PermissionCache:
+    """In-memory cache of users' permission to post in the channel.
+
+    Denied permissions are kept for a shorter time,
+    so users who were just made admins don't have to wait long.
+    """
+
+    # Number of entries after which expired ones are removed
+    PURGE_THRESHOLD = 1000
+
+    def __init__(self, ttl: float, negative_ttl: float) -> None:
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+
+        self._permissions: dict[int, tuple[bool, float]] = {}
+
+    def get(self, user_id: int) -> bool | None:
+        item = self._permissions.get(user_id)
+        if item is None:
+            return None
+
+        allowed, expires_at = item
+        if expires_at <= time.monotonic():
+            del self._permissions[user_id]
+            return None
+        return allowed
+
+    def set(self, user_id: int, allowed: bool) -> None:
+        now = time.monotonic()
+        if len(self._permissions) >= self.PURGE_THRESHOLD:
+            self._permissions = {key: item for key, item in self._permissions.items() if item[1] > now}
+
+        self._permissions[user_id] = (allowed, now + (self.ttl if allowed else self.negative_ttl))
+
+    def invalidate(self, user_id: int) -> None:
+        self._permissions.pop(user_id, None)
+
+    def clear(self) -> None:
+        self._permissions.clear()
+
+
+permission_cache = PermissionCache(
+    ttl=settings.VTT_PERMISSION_CACHE_TTL,
+    negative_ttl=settings.VTT_PERMISSION_CACHE_NEGATIVE_TTL,
+)
@@ -0,0 +1,228 @@
+from __future__ import annotations
+
+import asyncio
+from typing import TYPE_CHECKING, cast
+
+from loguru import logger
+from telethon import events
+from telethon.errors.rpcbaseerrors import RPCError
+from telethon.events import StopPropagation
+from telethon.tl.custom.button import Button
+from vtt_common.schemas import VttTaskType
+from vtt_common.sequences import BULK_SEQUENCE
+from vtt_common.tasks import get_task_id
+
+from app.config import _, settings
+from app.plugins.wall import POST_PATTERN
+from app.state_manager import State, state_manager
+from app.task_queue import task_queue
+from app.utils import NewMessageEvent, check_is_chat, is_current_state, is_user_authorized
+from app.vk.api import get_existing_wall_posts
+
+if TYPE_CHECKING:
+    from telethon.client.telegramclient import TelegramClient
+    from telethon.tl.patched import Message
+    from vkbottle.api.api import API
+    from vtt_common.tasks import TaskMeta
+
+BULK_SEARCHING = _("BULK_SEARCHING")
+BULK_TOO_MANY_POSTS = _("BULK_TOO_MANY_POSTS")
+BULK_FILE_TOO_LARGE = _("BULK_FILE_TOO_LARGE")
+BULK_NO_LINKS = _("BULK_NO_LINKS")
+BULK_SUMMARY = _("BULK_SUMMARY")
+BULK_CONFIRM = _("BULK_CONFIRM")
+BULK_NOTHING_TO_ADD = _("BULK_NOTHING_TO_ADD")
+BULK_PROGRESS = _("BULK_PROGRESS")
+BULK_YES = _("BULK_YES")
+BULK_CANCEL = _("BULK_CANCEL")
+
+# Max number of posts in a single message or file
+MAX_POSTS = 1000
+# Max size of a file with links (in bytes)
+MAX_FILE_SIZE = 1024 * 1024
+# How often (in seconds) the progress message is updated
+PROGRESS_UPDATE_INTERVAL = 30
+# For how long (in seconds) the progress message is updated
+PROGRESS_TIMEOUT = 24 * 60 * 60
+
+# Background tasks that update progress messages
+_progress_tasks: set[asyncio.Task[None]] = set()
+
+
+def _is_text_file(event: NewMessageEvent) -> bool:
+    file = event.message.file
+    return bool(file and (file.ext == ".txt" or file.mime_type == "text/plain"))
+
+
+async def is_bulk_message(event: NewMessageEvent) -> bool:
+    """Check if the message is a text file or contains more than one wall post link."""
+    if not check_is_chat(event) or not (_is_text_file(event) or len(POST_PATTERN.findall(event.raw_text)) > 1):
+        return False
+
+    return await is_current_state(event, State.WAITING_FOR_LINK)
+
+
+def parse_post_ids(text: str) -> list[tuple[int, int]]:
+    """Return unique owner ids and ids of the wall posts linked in `text`, in the order of appearance."""
+    return list(dict.fromkeys((int(match["owner_id"]), int(match["id"])) for match in POST_PATTERN.finditer(text)))
+
+
+def _format_progress(task_ids: list[str], tasks: list[TaskMeta | None]) -> str:
+    statuses = [task["status"] if task else None for task in tasks]
+    pending = sum(status in {"SENT", "STARTED"} for status in statuses)
+    failed = statuses.count("FAILURE")
+    return BULK_PROGRESS.format(
+        total=len(task_ids),
+        done=len(task_ids) - pending - failed,
+        failed=failed,
+        pending=pending,
+    )
+
+
+async def _update_progress(message: Message, task_ids: list[str]) -> None:
+    """Update the progress message, until all tasks are finished or `PROGRESS_TIMEOUT` is reached."""
+    text = message.message
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + PROGRESS_TIMEOUT
+    while loop.time() < deadline:
+        await asyncio.sleep(PROGRESS_UPDATE_INTERVAL)
+        tasks = await task_queue.get_queued_tasks(task_ids)
+        new_text = _format_progress(task_ids, tasks)
+        if new_text != text:
+            try:
+                await message.edit(new_text)
+            except RPCError as error:
+                logger.warning("Failed to update bulk progress message: {}", error.message)
+                return
+            text = new_text
+
+        if not any(task and task["status"] in {"SENT", "STARTED"} for task in tasks):
+            return
+
+
+async def _get_links_text(event: NewMessageEvent) -> str | None:
+    """Return text of the message or content of the attached text file. Returns `None` if the file is too large."""
+    if not _is_text_file(event):
+        logger.info("User {} sent a message with links", event.sender_id)
+        return cast("str", event.raw_text)
+
+    if event.message.file.size > MAX_FILE_SIZE:
+        logger.warning("User {} sent too large file with links", event.sender_id)
+        await event.respond(BULK_FILE_TOO_LARGE.format(max_size=MAX_FILE_SIZE // 1024))
+        return None
+
+    logger.info("User {} sent a file with links", event.sender_id)
+    content = cast("bytes", await event.message.download_media(file=bytes))
+    return content.decode(errors="replace")
+
+
+async def add_event_handlers(bot: TelegramClient, vk_api: API) -> None:  # noqa: C901, PLR0915
+    @bot.on(events.CallbackQuery(data=b"bulk_confirm", func=lambda e: is_current_state(e, State.WAITING_FOR_CHOISE)))  # type: ignore[untyped-decorator]
+    async def new_bulk(event: NewMessageEvent) -> None:
+        await event.edit(buttons=Button.clear())
+        if not await is_user_authorized(event):
+            raise events.StopPropagation
+
+        data = (await state_manager.get_info(event.sender_id))[1]
+        post_ids: list[list[int]] = data["posts"]
+        logger.info("User {} confirmed {} wall posts", event.sender_id, len(post_ids))
+        await state_manager.clear_info(event.sender_id)
+
+        sent_task_ids = await task_queue.send_claimed_tasks(
+            "app.main.forward_wall",
+            queue="vtt-wall",
+            tasks={
+                get_task_id(VttTaskType.wall, owner_id, post_id): {
+                    "owner_id": owner_id,
+                    "wall_id": post_id,
+                }
+                for owner_id, post_id in post_ids
+            },
+            sequence=BULK_SEQUENCE,
+        )
+        logger.info("Sent {} of {} wall posts of user {}", len(sent_task_ids), len(post_ids), event.sender_id)
+        if not sent_task_ids:
+            await event.respond(BULK_NOTHING_TO_ADD)
+            raise StopPropagation
+
+        message = cast(
+            "Message",
+            await event.respond(_format_progress(sent_task_ids, [None] * len(sent_task_ids))),
+        )
+        progress_task = asyncio.create_task(_update_progress(message, sent_task_ids))
+        _progress_tasks.add(progress_task)
+        progress_task.add_done_callback(_progress_tasks.discard)
+        raise StopPropagation
+
+    @bot.on(events.NewMessage(func=is_bulk_message))  # type: ignore[untyped-decorator]
+    async def on_new_bulk(event: NewMessageEvent) -> None:
+        if not await is_user_authorized(event):
+            raise events.StopPropagation
+
+        sender = event.sender_id
+        text = await _get_links_text(event)
+        if text is None:
+            raise StopPropagation
+
+        post_ids = parse_post_ids(text)
+        if not post_ids:
+            await event.respond(BULK_NO_LINKS)
+            raise StopPropagation
+        if len(post_ids) > MAX_POSTS:
+            logger.warning("User {} sent {} wall posts, more than {}", sender, len(post_ids), MAX_POSTS)
+            await event.respond(BULK_TOO_MANY_POSTS.format(max_posts=MAX_POSTS))
+            raise StopPropagation
+
+        await event.respond(BULK_SEARCHING.format(count=len(post_ids)))
+
+        task_ids = [get_task_id(VttTaskType.wall, owner_id, post_id) for owner_id, post_id in post_ids]
+        async with asyncio.TaskGroup() as tg:
+            existing_post_ids = tg.create_task(get_existing_wall_posts(vk_api, post_ids))
+            queued_tasks = tg.create_task(task_queue.get_queued_tasks(task_ids))
+            message_ids = tg.create_task(task_queue.get_message_ids(settings.TGM_CHANNEL_ID, task_ids))
+
+        not_found = queued = sent = 0
+        new_post_ids: list[tuple[int, int]] = []
+        for post_id, queued_task, message_id in zip(post_ids, queued_tasks.result(), message_ids.result(), strict=True):
+            if post_id not in existing_post_ids.result():
+                not_found += 1
+            elif queued_task and queued_task["status"] in {"SENT", "STARTED"}:
+                queued += 1
+            elif message_id:
+                sent += 1
+            else:
+                new_post_ids.append(post_id)
+
+        logger.info(
+            "Checked {} wall posts of user {}: {} not found in VK, {} in queue, {} in Telegram channel, {} new",
+            len(post_ids),
+            sender,
+            not_found,
+            queued,
+            sent,
+            len(new_post_ids),
+        )
+        summary = BULK_SUMMARY.format(total=len(post_ids), not_found=not_found, queued=queued, sent=sent)
+        if not new_post_ids:
+            await event.respond(f"{summary}\n\n{BULK_NOTHING_TO_ADD}")
+            raise StopPropagation
+
+        message = cast(
+            "Message",
+            await event.respond(
+                f"{summary}\n\n{BULK_CONFIRM.format(count=len(new_post_ids))}",
+                buttons=[
+                    Button.inline(BULK_YES, data=b"bulk_confirm"),
+                    Button.inline(BULK_CANCEL, data=b"cancel"),
+                ],
+            ),
+        )
+        await state_manager.set_info(
+            sender,
+            State.WAITING_FOR_CHOISE,
+            {
+                "choice_message": message.id,
+                "posts": new_post_ids,
+            },
+        )
+        raise StopPropagation
@@ -3,10 +3,12 @@ from __future__ import annotations
 from typing import TYPE_CHECKING
 
 from loguru import logger
-from telethon import events
+from telethon import events, utils
+from telethon.tl import types
 from telethon.tl.custom.button import Button
 
 from app.config import _, settings
+from app.permission_cache import permission_cache
 from app.state_manager import State, state_manager
 from app.utils import is_current_state, is_user_authorized
 
@@ -50,6 +52,25 @@ def is_user_chat(event: EventCommon) -> bool:
     return event.is_private or False
 
 
+async def add_permission_cache_handlers(bot: TelegramClient) -> None:
+    @bot.on(events.ChatAction(chats=settings.TGM_CHANNEL_ID))  # type: ignore[untyped-decorator]
+    async def channel_action(event: events.ChatAction.Event) -> None:
+        user_ids: list[int] = event.user_ids
+        logger.debug("Channel action with users {}, invalidating their permissions", user_ids)
+        if not user_ids:
+            permission_cache.clear()
+        for user_id in user_ids:
+            permission_cache.invalidate(user_id)
+
+    @bot.on(events.Raw(types.UpdateChannelParticipant))  # type: ignore[untyped-decorator]
+    async def channel_participant(update: types.UpdateChannelParticipant) -> None:
+        if utils.get_peer_id(types.PeerChannel(update.channel_id)) != settings.TGM_CHANNEL_ID:
+            return
+
+        logger.debug("Participant {} updated, invalidating permissions", update.user_id)
+        permission_cache.invalidate(update.user_id)
+
+
 async def add_initial_event_handlers(bot: TelegramClient) -> None:
     @bot.on(events.NewMessage(pattern="/start", func=is_user_chat))  # type: ignore[untyped-decorator]
     async def start(event: Event) -> None:
@@ -59,14 +80,14 @@ async def add_initial_event_handlers(bot: TelegramClient) -> None:
             logger.warning("User {} not authorized, stopping propagation", event.sender_id)
             raise events.StopPropagation
 
-        state_manager.set_info(event.sender_id, State.WAITING_FOR_LINK)
+        await state_manager.set_info(event.sender_id, State.WAITING_FOR_LINK)
         await event.respond(WAITING_FOR_LINK)
         raise events.StopPropagation
 
     @bot.on(events.NewMessage(pattern="/cancel"))  # type: ignore[untyped-decorator]
     async def cancel(event: Event) -> None:
         logger.info("User {} cancelled via /cancel", event.sender_id)
-        state_manager.set_info(event.sender_id, State.WAITING_FOR_LINK)
+        await state_manager.set_info(event.sender_id, State.WAITING_FOR_LINK)
         await event.edit(buttons=Button.clear())
         await event.respond(CANCELLED)
         raise events.StopPropagation
@@ -74,7 +95,7 @@ async def add_initial_event_handlers(bot: TelegramClient) -> None:
     @bot.on(events.CallbackQuery(data=b"cancel"))  # type: ignore[untyped-decorator]
     async def btn_cancel(event: events.CallbackQuery.Event) -> None:
         logger.info("User {} cancelled via button", event.sender_id)
-        state_manager.set_info(event.sender_id, State.WAITING_FOR_LINK)
+        await state_manager.set_info(event.sender_id, State.WAITING_FOR_LINK)
         await event.edit(buttons=Button.clear())
         await event.respond(CANCELLED)
         raise events.StopPropagation
@@ -86,7 +107,7 @@ async def add_initial_event_handlers(bot: TelegramClient) -> None:
             logger.warning("User {} not authorized in CHOISE handler, stopping propagation", event.sender_id)
             raise events.StopPropagation
 
-        data = state_manager.get_info(event.sender_id)[1]
+        data = (await state_manager.get_info(event.sender_id))[1]
         await event.respond(CLICK_BUTTON, reply_to=data["choice_message"])
         raise events.StopPropagation
 
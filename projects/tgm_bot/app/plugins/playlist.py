@@ -1,28 +1,31 @@
 from __future__ import annotations
 
 import re
-from typing import TYPE_CHECKING, cast
+from typing import TYPE_CHECKING
 from urllib.parse import parse_qs, urlparse
 
 from loguru import logger
 from telethon import events
+from telethon.errors.rpcbaseerrors import RPCError
 from telethon.events import StopPropagation
 from telethon.tl.custom.button import Button
-from telethon.tl.functions.messages import SearchRequest
-from telethon.tl.types import InputMessagesFilterUrl
 from vtt_common.schemas import VttTaskType
-from vtt_common.tasks import get_queued_task
 
 from app.config import _, settings
 from app.state_manager import State, state_manager
-from app.utils import NewMessageEvent, get_tgm_channel_entity, is_current_state, is_user_authorized
+from app.task_queue import task_queue
+from app.utils import (
+    FORWARD_FAILED,
+    NewMessageEvent,
+    find_post,
+    forward_channel_message,
+    is_current_state,
+    is_user_authorized,
+)
 from app.vk.api import is_playlist_exists
-from app.worker import app as celery_app
 
 if TYPE_CHECKING:
     from telethon.client.telegramclient import TelegramClient
-    from telethon.tl.patched import Message
-    from telethon.tl.types.messages import ChannelMessages
     from vkbottle.api.api import API
 
 PL_NOT_READY = _("PL_NOT_READY")
@@ -33,7 +36,6 @@ PL_ALREADY_STARTED = _("PL_ALREADY_STARTED")
 PL_FOUND_IN_TGM = _("PL_FOUND_IN_TGM")
 PL_NOT_FOUND_IN_TGM = _("PL_NOT_FOUND_IN_TGM")
 PL_ADDED_TO_THE_QUEUE = _("PL_ADDED_TO_THE_QUEUE")
-PL_UNKNOWN_CHANNEL = _("PL_UNKNOWN_CHANNEL")
 PL_YES = _("PL_YES")
 PL_CANCEL = _("PL_CANCEL")
 
@@ -71,7 +73,7 @@ def _get_playlist_full_id(message: str) -> str | None:
     return full_id
 
 
-async def add_event_handlers(bot: TelegramClient, client: TelegramClient, vk_api: API) -> None:  # noqa: C901, PLR0915
+async def add_event_handlers(bot: TelegramClient, vk_api: API) -> None:  # noqa: C901, PLR0915
     # Callback for playlist button in main channel
     @bot.on(events.CallbackQuery(data=b"wait_for_pl_link"))  # type: ignore[untyped-decorator]
     async def wait_for_pl_link(event: events.CallbackQuery.Event) -> None:
@@ -83,7 +85,7 @@ async def add_event_handlers(bot: TelegramClient, client: TelegramClient, vk_api
         if not await is_user_authorized(event):
             raise events.StopPropagation
 
-        data = state_manager.get_info(event.sender_id)[1]
+        data = (await state_manager.get_info(event.sender_id))[1]
         logger.info(
             "User {} confirmed playlist {}_{} (access_key={})",
             event.sender_id,
@@ -91,17 +93,20 @@ async def add_event_handlers(bot: TelegramClient, client: TelegramClient, vk_api
             data["playlist_id"],
             data.get("access_key"),
         )
-        celery_app.send_task(
+        await task_queue.send_claimed_task(
             "app.main.forward_playlist",
-            task_id=f"{VttTaskType.playlist}_{data['owner_id']}_{data['playlist_id']}",
+            task_type=VttTaskType.playlist,
+            owner_id=data["owner_id"],
+            post_id=data["playlist_id"],
             queue="vtt-playlist",
             kwargs={
                 "owner_id": data["owner_id"],
                 "playlist_id": data["playlist_id"],
                 "access_key": data["access_key"],
             },
+            force=True,
         )
-        state_manager.clear_info(event.sender_id)
+        await state_manager.clear_info(event.sender_id)
         await event.respond(PL_ADDED_TO_THE_QUEUE)
         raise StopPropagation
 
@@ -126,19 +131,21 @@ async def add_event_handlers(bot: TelegramClient, client: TelegramClient, vk_api
 
         logger.info("Parsed playlist: owner_id={}, playlist_id={}, access_key={}", owner_id, playlist_id, access_key)
 
-        if not await is_playlist_exists(vk_api, owner_id, playlist_id, access_key):
+        lookup = await find_post(
+            is_playlist_exists(vk_api, owner_id, playlist_id, access_key),
+            task_type=VttTaskType.playlist,
+            owner_id=owner_id,
+            post_id=playlist_id,
+            channel_id=settings.TGM_PL_CHANNEL_ID,
+        )
+        if lookup is None:
             logger.warning("Playlist {}_{} not found in VK", owner_id, playlist_id)
             await event.respond(PL_NOT_FOUND_IN_VK)
             raise StopPropagation
 
         logger.debug("Playlist {}_{} confirmed in VK", owner_id, playlist_id)
 
-        queued_task = get_queued_task(
-            backend=celery_app.backend,
-            task_type=VttTaskType.playlist,
-            owner_id=owner_id,
-            post_id=playlist_id,
-        )
+        queued_task, message_id = lookup
         if queued_task and queued_task["status"] in {"SENT", "STARTED"}:
             logger.info("Playlist {}_{} already {} in queue", owner_id, playlist_id, queued_task["status"])
             waiting_text = PL_ALREADY_IN_THE_QUEUE if queued_task["status"] == "SENT" else PL_ALREADY_STARTED
@@ -149,7 +156,7 @@ async def add_event_handlers(bot: TelegramClient, client: TelegramClient, vk_api
                     Button.inline(PL_CANCEL, data=b"cancel"),
                 ],
             )
-            state_manager.set_info(
+            await state_manager.set_info(
                 sender,
                 State.WAITING_FOR_CHOISE,
                 {
@@ -162,38 +169,32 @@ async def add_event_handlers(bot: TelegramClient, client: TelegramClient, vk_api
             raise StopPropagation
 
         logger.debug("Playlist {}_{} not in queue, checking Telegram channel", owner_id, playlist_id)
-        peer = await get_tgm_channel_entity(client, settings.TGM_PL_CHANNEL_ID)
-        if peer is None:
-            logger.error(
-                "Could not resolve Telegram channel entity for TGM_PL_CHANNEL_ID={}",
-                settings.TGM_PL_CHANNEL_ID,
-            )
-            message = await event.respond(PL_UNKNOWN_CHANNEL)
-            state_manager.clear_info(event.sender_id)
-            raise StopPropagation
-
-        search_result: ChannelMessages = await client(
-            SearchRequest(
-                peer=peer,
-                q=f"https://vk.ru/music/playlist/{owner_id}_{playlist_id}",
-                filter=InputMessagesFilterUrl(),
-                min_date=None,
-                max_date=None,
-                offset_id=0,
-                add_offset=0,
-                limit=1,
-                max_id=0,
-                min_id=0,
-                hash=0,
-                from_id=None,
-            ),
-        )
         waiting_text = PL_NOT_FOUND_IN_TGM
-        if search_result.messages:
+        is_forwarded = False
+        if message_id:
+            try:
+                is_forwarded = await forward_channel_message(bot, sender, settings.TGM_PL_CHANNEL_ID, message_id)
+            except RPCError as error:
+                logger.warning(
+                    "Failed to forward playlist {}_{} from Telegram channel: {}",
+                    owner_id,
+                    playlist_id,
+                    error.message,
+                )
+                await event.respond(FORWARD_FAILED)
+                raise StopPropagation from None
+
+        if is_forwarded:
             waiting_text = PL_FOUND_IN_TGM
-            logger.info("Playlist {}_{} already exists in Telegram channel, forwarding to user", owner_id, playlist_id)
-            message = cast("Message", search_result.messages[0])
-            await bot.forward_messages(sender, message.id, from_peer=message.chat_id)
+            logger.info("Playlist {}_{} already exists in Telegram channel, forwarded to user", owner_id, playlist_id)
+        elif message_id:
+            logger.info("Playlist {}_{} was deleted from Telegram channel", owner_id, playlist_id)
+            await task_queue.delete_message_id(
+                channel_id=settings.TGM_PL_CHANNEL_ID,
+                task_type=VttTaskType.playlist,
+                owner_id=owner_id,
+                post_id=playlist_id,
+            )
         else:
             logger.info("Playlist {}_{} not found in Telegram channel", owner_id, playlist_id)
 
@@ -206,7 +207,7 @@ async def add_event_handlers(bot: TelegramClient, client: TelegramClient, vk_api
         )
 
         logger.debug("Playlist {}_{} awaiting user confirmation (message_id={})", owner_id, playlist_id, message.id)
-        state_manager.set_info(
+        await state_manager.set_info(
             sender,
             State.WAITING_FOR_CHOISE,
             {
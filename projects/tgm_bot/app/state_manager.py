@@ -1,11 +1,19 @@
 from __future__ import annotations
 
+import json
+import time
+from collections import OrderedDict
 from enum import Enum, auto
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Protocol
+
+from app.config import settings
+from app.task_queue import task_queue
 
 if TYPE_CHECKING:
     from typing import Any
 
+    from redis.asyncio import Redis
+
 
 class State(Enum):
     WAITING_FOR_LINK = auto()
@@ -13,22 +21,101 @@ class State(Enum):
     WAITING_FOR_CHOISE = auto()
 
 
-class StateManager:
-    def __init__(self) -> None:
-        self._states: dict[int, tuple[State, dict[str, Any]]] = {}
-
-    def get_info(self, sender_id: int) -> tuple[State, dict[str, Any]]:
-        info = self._states.get(sender_id)
-        if not info:
-            info = (State.WAITING_FOR_LINK, {})
-            self._states[sender_id] = info
+type StateInfo = tuple[State, dict[str, Any]]
+
+
+class StateBackend(Protocol):
+    async def get(self, sender_id: int) -> StateInfo | None: ...
+
+    async def set(self, sender_id: int, info: StateInfo) -> None: ...
+
+    async def delete(self, sender_id: int) -> None: ...
+
+
+class MemoryStateBackend:
+    """Keeps states of at most `maxsize` recently active users, each for `ttl` seconds since the last activity."""
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+
+        self._states: OrderedDict[int, tuple[StateInfo, float]] = OrderedDict()
+
+    async def get(self, sender_id: int) -> StateInfo | None:
+        item = self._states.get(sender_id)
+        if item is None:
+            return None
+
+        info, expires_at = item
+        now = time.monotonic()
+        if expires_at <= now:
+            del self._states[sender_id]
+            return None
+
+        self._states[sender_id] = (info, now + self.ttl)
+        self._states.move_to_end(sender_id)
         return info
 
-    def set_info(self, sender_id: int, state: State, data: dict[str, Any] | None = None) -> None:
-        self._states[sender_id] = (state, data or {})
+    async def set(self, sender_id: int, info: StateInfo) -> None:
+        self._states[sender_id] = (info, time.monotonic() + self.ttl)
+        self._states.move_to_end(sender_id)
+        if len(self._states) > self.maxsize:
+            self._states.popitem(last=False)
 
-    def clear_info(self, sender_id: int) -> None:
+    async def delete(self, sender_id: int) -> None:
         self._states.pop(sender_id, None)
 
 
-state_manager = StateManager()
+class RedisStateBackend:
+    """Keeps states in Redis hashes, so they are shared between several bot processes."""
+
+    KEY_PREFIX = "vtt-bot-state-"
+
+    def __init__(self, redis: Redis, ttl: int) -> None:
+        self.redis = redis
+        self.ttl = ttl
+
+    async def get(self, sender_id: int) -> StateInfo | None:
+        key = f"{self.KEY_PREFIX}{sender_id}"
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hgetall(key)
+            pipe.expire(key, self.ttl)
+            value, _ = await pipe.execute()
+
+        if not value:
+            return None
+        return State[value[b"state"].decode()], json.loads(value[b"data"])
+
+    async def set(self, sender_id: int, info: StateInfo) -> None:
+        key = f"{self.KEY_PREFIX}{sender_id}"
+        state, data = info
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(key, mapping={"state": state.name, "data": json.dumps(data)})
+            pipe.expire(key, self.ttl)
+            await pipe.execute()
+
+    async def delete(self, sender_id: int) -> None:
+        await self.redis.delete(f"{self.KEY_PREFIX}{sender_id}")
+
+
+class StateManager:
+    def __init__(self, backend: StateBackend) -> None:
+        self.backend = backend
+
+    async def get_info(self, sender_id: int) -> StateInfo:
+        return await self.backend.get(sender_id) or (State.WAITING_FOR_LINK, {})
+
+    async def set_info(self, sender_id: int, state: State, data: dict[str, Any] | None = None) -> None:
+        await self.backend.set(sender_id, (state, data or {}))
+
+    async def clear_info(self, sender_id: int) -> None:
+        await self.backend.delete(sender_id)
+
+
+def create_state_backend() -> StateBackend:
+    if settings.VTT_BOT_STATE_BACKEND == "redis":
+        return RedisStateBackend(redis=task_queue.redis, ttl=settings.VTT_BOT_STATE_TTL)
+    return MemoryStateBackend(maxsize=settings.VTT_BOT_STATE_MAX_USERS, ttl=settings.VTT_BOT_STATE_TTL)
+
+
+state_manager = StateManager(backend=create_state_backend())
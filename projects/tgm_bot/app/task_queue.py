@@ -0,0 +1,190 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from functools import partial
+from typing import TYPE_CHECKING
+
+from loguru import logger
+from redis.asyncio import Redis
+from vtt_common import celeryconfig
+from vtt_common.messages import get_message_index_key
+from vtt_common.sequences import MANUAL_SEQUENCE
+from vtt_common.tasks import (
+    get_legacy_result_key,
+    get_task_id,
+    get_task_state_key,
+    merge_task_states,
+    send_claimed_task,
+    send_claimed_tasks,
+)
+
+from app.worker import app as celery_app
+
+if TYPE_CHECKING:
+    from collections.abc import Generator
+    from typing import Any
+
+    from celery import Celery
+    from vtt_common.schemas import VttTaskType
+    from vtt_common.tasks import TaskMeta
+
+# How often (in seconds) call metrics are logged
+METRICS_LOG_INTERVAL = 600
+
+
+@dataclass(slots=True)
+class CallStats:
+    count: int = 0
+    errors: int = 0
+    total_time: float = 0.0
+    max_time: float = 0.0
+
+    @property
+    def mean_time(self) -> float:
+        return self.total_time / self.count if self.count else 0.0
+
+
+class TaskQueue:
+    """Async access to the task queue and Redis for bot handlers.
+
+    Redis is queried with an async client and tasks are published from a separate thread,
+    so slow Redis or broker don't block the event loop.
+    """
+
+    def __init__(self, celery_app: Celery, redis_url: str) -> None:
+        self.celery_app = celery_app
+        self.redis = Redis.from_url(redis_url)
+        self.metrics: dict[str, CallStats] = {}
+
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="task-queue")
+
+    @contextmanager
+    def _measure(self, name: str) -> Generator[None]:
+        stats = self.metrics.setdefault(name, CallStats())
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            stats.errors += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            stats.count += 1
+            stats.total_time += elapsed
+            stats.max_time = max(stats.max_time, elapsed)
+            logger.debug("{} took {:.1f} ms", name, elapsed * 1000)
+
+    def format_metrics(self) -> str:
+        return ", ".join(
+            f"{name}: {stats.count} calls, {stats.errors} errors, "
+            f"mean {stats.mean_time * 1000:.1f} ms, max {stats.max_time * 1000:.1f} ms"
+            for name, stats in sorted(self.metrics.items())
+        )
+
+    async def log_metrics(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            if self.metrics:
+                logger.info("Task queue metrics: {}", self.format_metrics())
+
+    async def _get_legacy_results(self, task_ids: list[str], values: list[bytes | None]) -> list[bytes | None]:
+        missing_task_ids = [task_id for task_id, value in zip(task_ids, values, strict=True) if not value]
+        if not missing_task_ids:
+            return []
+
+        legacy_values: list[bytes | None] = await self.redis.mget(
+            [get_legacy_result_key(task_id) for task_id in missing_task_ids],
+        )
+        return legacy_values
+
+    async def get_queued_task(self, task_type: VttTaskType, owner_id: int, post_id: int) -> TaskMeta | None:
+        task_id = get_task_id(task_type, owner_id, post_id)
+        with self._measure("get_queued_task"):
+            value: bytes | None = await self.redis.get(get_task_state_key(task_id))
+            legacy_values = await self._get_legacy_results([task_id], [value])
+        return merge_task_states([value], legacy_values)[0]
+
+    async def get_queued_tasks(self, task_ids: list[str]) -> list[TaskMeta | None]:
+        if not task_ids:
+            return []
+
+        with self._measure("get_queued_tasks"):
+            values: list[bytes | None] = await self.redis.mget([get_task_state_key(task_id) for task_id in task_ids])
+            legacy_values = await self._get_legacy_results(task_ids, values)
+        states: list[TaskMeta | None] = merge_task_states(values, legacy_values)
+        return states
+
+    async def get_message_id(self, channel_id: int, task_type: VttTaskType, owner_id: int, post_id: int) -> int | None:
+        with self._measure("get_message_id"):
+            message_id: bytes | None = await self.redis.hget(
+                get_message_index_key(channel_id),
+                get_task_id(task_type, owner_id, post_id),
+            )
+        return int(message_id) if message_id else None
+
+    async def get_message_ids(self, channel_id: int, task_ids: list[str]) -> list[int | None]:
+        if not task_ids:
+            return []
+
+        with self._measure("get_message_ids"):
+            message_ids: list[bytes | None] = await self.redis.hmget(get_message_index_key(channel_id), task_ids)
+        return [int(message_id) if message_id else None for message_id in message_ids]
+
+    async def delete_message_id(self, channel_id: int, task_type: VttTaskType, owner_id: int, post_id: int) -> None:
+        with self._measure("delete_message_id"):
+            await self.redis.hdel(get_message_index_key(channel_id), get_task_id(task_type, owner_id, post_id))
+
+    async def send_claimed_task(
+        self,
+        name: str,
+        task_type: VttTaskType,
+        owner_id: int,
+        post_id: int,
+        queue: str,
+        kwargs: dict[str, Any],
+        *,
+        force: bool = False,
+    ) -> bool:
+        loop = asyncio.get_running_loop()
+        with self._measure("send_claimed_task"):
+            return await loop.run_in_executor(
+                self._executor,
+                partial(
+                    send_claimed_task,
+                    self.celery_app,
+                    name,
+                    task_type=task_type,
+                    owner_id=owner_id,
+                    post_id=post_id,
+                    queue=queue,
+                    kwargs=kwargs,
+                    force=force,
+                ),
+            )
+
+    async def send_claimed_tasks(
+        self,
+        name: str,
+        queue: str,
+        tasks: dict[str, dict[str, Any]],
+        sequence: str = MANUAL_SEQUENCE,
+    ) -> list[str]:
+        loop = asyncio.get_running_loop()
+        with self._measure("send_claimed_tasks"):
+            return await loop.run_in_executor(
+                self._executor,
+                partial(send_claimed_tasks, self.celery_app, name, queue=queue, tasks=tasks, sequence=sequence),
+            )
+
+    async def close(self) -> None:
+        if self.metrics:
+            logger.info("Task queue metrics: {}", self.format_metrics())
+        await self.redis.aclose()
+        await asyncio.to_thread(self._executor.shutdown)
+
+
+task_queue = TaskQueue(celery_app=celery_app, redis_url=celeryconfig.result_backend)
@@ -1,18 +1,25 @@
 from __future__ import annotations
 
+import asyncio
 from typing import TYPE_CHECKING, cast
 
 from loguru import logger
 from telethon import events
+from telethon.errors import MessageIdInvalidError
 from telethon.errors.rpcbaseerrors import RPCError
 from telethon.tl.custom.button import Button
 
 from app.config import _, settings
+from app.permission_cache import permission_cache
 from app.state_manager import State, state_manager
+from app.task_queue import task_queue
 
 if TYPE_CHECKING:
+    from collections.abc import Awaitable
+
     from telethon.client.telegramclient import TelegramClient
-    from telethon.tl.types import TypeInputPeer
+    from vtt_common.schemas import VttTaskType
+    from vtt_common.tasks import TaskMeta
 
 # Somewhat fixed type for NewMessage event
 type NewMessageEvent = events.NewMessage.Event | events.CallbackQuery.Event
@@ -22,6 +29,8 @@ NO_PERMISSION = _("NO_PERMISSION")
 
 PERMISSION_CHECK_FAILED = _("PERMISSION_CHECK_FAILED")
 
+FORWARD_FAILED = _("FORWARD_FAILED")
+
 
 def check_is_chat(event: NewMessageEvent) -> bool | None:
     return cast("bool | None", event.is_private)
@@ -31,21 +40,26 @@ async def is_current_state(event: NewMessageEvent, expected_state: State) -> boo
     if not check_is_chat(event):
         return False
 
-    current_state = state_manager.get_info(event.sender_id)[0]
+    current_state = (await state_manager.get_info(event.sender_id))[0]
     return current_state == expected_state
 
 
 async def is_user_authorized(event: NewMessageEvent) -> bool:
     sender = event.sender_id
-    client = cast("TelegramClient", event.client)
-    try:
-        perm = await client.get_permissions(settings.TGM_CHANNEL_ID, sender)
-    except RPCError as error:
-        logger.warning("Failed to check permissions: {}", error.message)
-        await event.respond(PERMISSION_CHECK_FAILED, buttons=Button.clear())
-        return False
-
-    if perm and perm.post_messages:
+    allowed = permission_cache.get(sender)
+    if allowed is None:
+        client = cast("TelegramClient", event.client)
+        try:
+            perm = await client.get_permissions(settings.TGM_CHANNEL_ID, sender)
+        except RPCError as error:
+            logger.warning("Failed to check permissions: {}", error.message)
+            await event.respond(PERMISSION_CHECK_FAILED, buttons=Button.clear())
+            return False
+
+        allowed = bool(perm and perm.post_messages)
+        permission_cache.set(sender, allowed)
+
+    if allowed:
         return True
 
     await event.respond(NO_PERMISSION, buttons=Button.clear())
@@ -53,14 +67,55 @@ async def is_user_authorized(event: NewMessageEvent) -> bool:
     return False
 
 
-async def get_tgm_channel_entity(
+async def forward_channel_message(
     client: TelegramClient,
+    entity: int,
     channel_id: int,
-) -> TypeInputPeer | None:
-    entity = None
+    message_id: int,
+) -> bool:
+    """Forward channel message to `entity`. Returns `False` if the message no longer exists.
+
+    Other errors, e.g. flood waits, are raised, since they don't mean that the message was deleted.
+    """
     try:
-        entity = await client.get_input_entity(channel_id)
-    except ValueError:
-        logger.critical("Failed to get entity! Add bot to your channel as an admin and try again.")
+        forwarded = await client.forward_messages(entity, message_id, from_peer=channel_id)
+    except MessageIdInvalidError:
+        logger.warning("Message {} of channel {} no longer exists", message_id, channel_id)
+        return False
+
+    return bool(forwarded)
 
-    return entity
+
+class NotFoundInVkError(Exception):
+    pass
+
+
+async def _ensure_exists_in_vk(is_exists: Awaitable[bool]) -> None:
+    if not await is_exists:
+        raise NotFoundInVkError
+
+
+async def find_post(
+    is_exists_in_vk: Awaitable[bool],
+    task_type: VttTaskType,
+    owner_id: int,
+    post_id: int,
+    channel_id: int,
+) -> tuple[TaskMeta | None, int | None] | None:
+    """Check that the post exists in VK, while looking it up in the task queue and in the Telegram channel.
+
+    Returns the queued task and the channel message id.
+    If the post doesn't exist in VK, returns `None` and cancels the lookups that are still running.
+    """
+    is_found = True
+    try:
+        async with asyncio.TaskGroup() as tg:
+            tg.create_task(_ensure_exists_in_vk(is_exists_in_vk))
+            queued_task = tg.create_task(task_queue.get_queued_task(task_type, owner_id, post_id))
+            message_id = tg.create_task(task_queue.get_message_id(channel_id, task_type, owner_id, post_id))
+    except* NotFoundInVkError:
+        is_found = False
+
+    if not is_found:
+        return None
+    return queued_task.result(), message_id.result()
@@ -6,8 +6,46 @@ from loguru import logger
 from vkbottle import VKAPIError
 
 if TYPE_CHECKING:
+    from typing import Any
+
     from vkbottle.api.api import API
 
+# Max number of posts in a single `wall.getById` call
+WALL_GET_BY_ID_LIMIT = 100
+
+
+async def is_wall_post_exists(vk_api: API, owner_id: int, wall_id: int) -> bool:
+    response: list[dict[str, Any]] = (
+        await vk_api.request(
+            "wall.getById",
+            {
+                "posts": f"{owner_id}_{wall_id}",
+            },
+        )
+    )["response"]
+    return bool(response)
+
+
+async def get_existing_wall_posts(vk_api: API, post_ids: list[tuple[int, int]]) -> set[tuple[int, int]]:
+    """Return owner ids and ids of the wall posts that exist in VK.
+
+    Posts are checked in batches of `WALL_GET_BY_ID_LIMIT`.
+    """
+    existing_post_ids: set[tuple[int, int]] = set()
+    for start in range(0, len(post_ids), WALL_GET_BY_ID_LIMIT):
+        batch = post_ids[start : start + WALL_GET_BY_ID_LIMIT]
+        response = (
+            await vk_api.request(
+                "wall.getById",
+                {
+                    "posts": ",".join(f"{owner_id}_{post_id}" for owner_id, post_id in batch),
+                },
+            )
+        )["response"]
+        items: list[dict[str, Any]] = response["items"] if isinstance(response, dict) else response
+        existing_post_ids.update((item["owner_id"], item["id"]) for item in items)
+    return existing_post_ids
+
 
 async def is_playlist_exists(
     vk_api: API,
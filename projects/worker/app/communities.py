@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import TYPE_CHECKING
+
+from vtt_common.communities import get_community, load_communities_file
+
+from app.config import settings
+from app.worker import worker
+
+if TYPE_CHECKING:
+    from vtt_common.communities import Community
+
+
+@dataclass(slots=True)
+class CommunitySettings:
+    """Settings of the task, that depend on the VK community the post belongs to."""
+
+    vk_token: str
+    channel_id: int
+    pl_channel_id: int
+    mirror_channel_ids: list[int]
+    ignore_ads: bool
+
+
+@lru_cache
+def _load_communities_file(path: str) -> dict[int, Community]:
+    return load_communities_file(path)
+
+
+def _find_community(group_id: int) -> Community | None:
+    if settings.VTT_COMMUNITIES_REDIS and (community := get_community(worker.backend.client, group_id)):
+        return community
+    if settings.VTT_COMMUNITIES_FILE:
+        return _load_communities_file(settings.VTT_COMMUNITIES_FILE).get(group_id)
+    return None
+
+
+def get_community_settings(owner_id: int) -> CommunitySettings:
+    """Return settings of the community by the owner id of its post.
+
+    Communities from Redis are looked up on every call, so they can be added without restarting workers.
+    Posts of communities that are not in the routing table use the worker settings.
+    """
+    community = _find_community(-owner_id) if owner_id < 0 else None
+    if community is None:
+        return CommunitySettings(
+            vk_token=settings.VK_TOKEN,
+            channel_id=settings.TGM_CHANNEL_ID,
+            pl_channel_id=settings.TGM_PL_CHANNEL_ID,
+            mirror_channel_ids=settings.TGM_MIRROR_CHANNEL_IDS,
+            ignore_ads=settings.VTT_IGNORE_ADS,
+        )
+
+    return CommunitySettings(
+        vk_token=community.vk_token or settings.VK_TOKEN,
+        channel_id=community.channel_id,
+        pl_channel_id=community.pl_channel_id,
+        mirror_channel_ids=community.mirror_channel_ids,
+        ignore_ads=community.ignore_ads if community.ignore_ads is not None else settings.VTT_IGNORE_ADS,
+    )
@@ -8,15 +8,18 @@ class Settings(BaseSettings):
     model_config = SettingsConfigDict(env_file=".env", extra="ignore")
 
     VK_TOKEN: str
+    VK_COMMUNITY_ID: int | None = None
 
     TGM_API_ID: int
     TGM_API_HASH: str
 
     TGM_BOT_TOKEN: str
     TGM_BOT_SESSION: str
+    TGM_BOT_SESSION_BACKEND: Literal["string", "redis"] = "string"
 
     TGM_CHANNEL_ID: int
     TGM_PL_CHANNEL_ID: int = 0
+    TGM_MIRROR_CHANNEL_IDS: list[int] = []
 
     TGM_PROXY_TYPE: Literal["socks5", "socks4", "http", "mtproto"] = "socks5"
     TGM_PROXY_ADDR: str | None = None
@@ -33,6 +36,23 @@ class Settings(BaseSettings):
 
     VTT_LANGUAGE: Literal["en", "ru"] = "en"
     VTT_IGNORE_ADS: bool = True
+    VTT_BACKFILL_RATE: float = 6.0
+    # Directory with media, downloaded by the download stage and uploaded by the publish stage
+    VTT_MEDIA_DIR: str = ""
+    # Time (in seconds), that a post waits for the previous posts of the wall, before it is published out of order
+    VTT_ORDER_TIMEOUT: int = 600
+    # Downscale and re-encode photos, remux videos before they are sent, see `app.services.optimizer`
+    VTT_OPTIMIZE_MEDIA: bool = False
+    # Number of processes, that optimize media, per worker process. 0 is the number of CPUs
+    VTT_OPTIMIZE_PROCESSES: int = 0
+    # Maximum side (in pixels) of photos sent to Telegram, used to choose VK photo size and by the optimizer
+    VTT_PHOTO_MAX_SIDE: int = 1280
+    # Maximum size (in MB) of documents and audios. Larger files are not downloaded, a link is added instead
+    VTT_MAX_FILE_SIZE: int = 2000
+
+    # Other communities served by this deployment, see `vtt_common.communities.Community`
+    VTT_COMMUNITIES_FILE: str = ""
+    VTT_COMMUNITIES_REDIS: bool = False
 
 
 settings = Settings()
@@ -1,80 +1,373 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import shutil
+import tempfile
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
 from loguru import logger
+from redis.exceptions import LockError
 from telethon import TelegramClient
+from telethon.errors.rpcbaseerrors import RPCError
 from telethon.sessions import StringSession
 from vkbottle import API
 from vkbottle.http import AiohttpClient
+from vtt_common.messages import get_message_id, get_message_map, set_message_id, set_message_map
 from vtt_common.proxy import get_tgm_proxy_config
+from vtt_common.schemas import VttTaskType
+from vtt_common.sequences import LIVE_SEQUENCE, complete_sequence, is_sequence_turn
+from vtt_common.sessions import RedisSession
+from vtt_common.tasks import STAGE_PASSED, get_queued_task, send_stage_task
 
+from app.communities import get_community_settings
 from app.config import settings
 from app.decorators import async_to_sync
 from app.exceptions import VttError
+from app.services.downloader import download_message_media
+from app.services.optimizer import get_optimize_pool, optimize_message_media
 from app.services.tgm import TelegramPlaylistSender, TelegramWallSender
 from app.services.vk import VkService
 from app.vk.request_validators import VkLangRequestValidator
 from app.vtt.factories.message import VttMessageFactory
 from app.vtt.factories.playlist import VttPlaylistFactory
+from app.vtt.schemas import dump_vtt_message, load_vtt_message
 from app.worker import worker
 
+if TYPE_CHECKING:
+    from celery import Task
+    from redis.lock import Lock
+
+    from app.vtt.schemas import VttMessage
+
 logger.disable("vkbottle")
 
+# Delay (in seconds) before the next attempt to edit a post, that is still being sent
+EDIT_RETRY_DELAY = 60
+# Time (in seconds) to download, optimize and upload a post, besides waiting for the previous posts of the wall.
+# An edit waits for the post to be sent for `VTT_ORDER_TIMEOUT` and this time, then it is given up.
+EDIT_SEND_TIMEOUT = 30 * 60
 
-@worker.task()  # type: ignore[untyped-decorator]
+# Delay (in seconds) before the next attempt to publish a post, that waits for the previous posts of the wall
+ORDER_RETRY_DELAY = 5
+
+# Playlist is sent by a single task at a time, other tasks with the same playlist wait for it.
+# The lock is extended every `PLAYLIST_LOCK_EXTEND_INTERVAL` seconds, while the playlist is sent,
+# so it is held for any upload time, and expires in `PLAYLIST_LOCK_TIMEOUT` seconds, if the task is lost.
+PLAYLIST_LOCK_KEY_PREFIX = "vtt-playlist-lock-"
+PLAYLIST_LOCK_TIMEOUT = 10 * 60
+PLAYLIST_LOCK_EXTEND_INTERVAL = 60
+PLAYLIST_RETRY_DELAY = 30
+
+
+def create_tgm_bot() -> TelegramClient:
+    tgm_bot = TelegramClient(
+        session=(
+            RedisSession(worker.backend.client, settings.TGM_BOT_SESSION)
+            if settings.TGM_BOT_SESSION_BACKEND == "redis"
+            else StringSession(settings.TGM_BOT_SESSION)
+        ),
+        api_id=settings.TGM_API_ID,
+        api_hash=settings.TGM_API_HASH,
+        **get_tgm_proxy_config(
+            proxy_type=settings.TGM_PROXY_TYPE,
+            proxy_addr=settings.TGM_PROXY_ADDR,
+            proxy_port=settings.TGM_PROXY_PORT,
+            proxy_user=settings.TGM_PROXY_USER,
+            proxy_pass=settings.TGM_PROXY_PASS,
+            proxy_rdns=settings.TGM_PROXY_RDNS,
+            proxy_mtproto_secret=settings.TGM_PROXY_MTPROTO_SECRET,
+            proxy_mtproto_connection=settings.TGM_PROXY_MTPROTO_CONNECTION,
+        ),
+    )
+    tgm_bot.parse_mode = "html"
+    return tgm_bot
+
+
+def get_media_dir(task_id: str) -> Path:
+    """Return directory with media of the task, shared by download and publish stages."""
+    return Path(settings.VTT_MEDIA_DIR or tempfile.gettempdir(), "vtt-media", task_id)
+
+
+@worker.task(bind=True)  # type: ignore[untyped-decorator]
 @async_to_sync
-async def forward_wall(owner_id: int, wall_id: int) -> str:
+async def forward_wall(
+    task: Task,
+    owner_id: int,
+    wall_id: int,
+    seq: int | None = None,
+    seq_name: str = LIVE_SEQUENCE,
+) -> str:
+    """Fetch stage: get the post from VK and pass it to the download stage."""
     with logger.contextualize(owner_id=owner_id, wall_id=wall_id):
         logger.info(f"New VK wall post received: 'https://vk.ru/wall{owner_id}_{wall_id}'")
 
-        vk_api = API(token=settings.VK_TOKEN, http_client=AiohttpClient())
+        community = get_community_settings(owner_id=owner_id)
+
+        vk_api = API(token=community.vk_token, http_client=AiohttpClient())
         vk_api.request_validators.append(VkLangRequestValidator())
 
         vk_service = VkService(vk_api=vk_api)
 
-        vtt_factory = VttMessageFactory(vk_service=vk_service)
+        vtt_factory = VttMessageFactory(vk_service=vk_service, ignore_ads=community.ignore_ads)
         vtt_message = await vtt_factory.create(owner_id=owner_id, wall_id=wall_id)
 
         if isinstance(vtt_message, str):
             logger.warning(f"Post was not sent to Telegram. Reason: '{vtt_message}'")
             return vtt_message
 
-        tgm_bot = TelegramClient(
-            session=StringSession(settings.TGM_BOT_SESSION),
-            api_id=settings.TGM_API_ID,
-            api_hash=settings.TGM_API_HASH,
-            **get_tgm_proxy_config(
-                proxy_type=settings.TGM_PROXY_TYPE,
-                proxy_addr=settings.TGM_PROXY_ADDR,
-                proxy_port=settings.TGM_PROXY_PORT,
-                proxy_user=settings.TGM_PROXY_USER,
-                proxy_pass=settings.TGM_PROXY_PASS,
-                proxy_rdns=settings.TGM_PROXY_RDNS,
-                proxy_mtproto_secret=settings.TGM_PROXY_MTPROTO_SECRET,
-                proxy_mtproto_connection=settings.TGM_PROXY_MTPROTO_CONNECTION,
-            ),
+        send_stage_task(
+            worker,
+            "app.main.download_wall",
+            parent_task_id=task.request.id,
+            stage="download",
+            queue="vtt-download",
+            kwargs={
+                "owner_id": owner_id,
+                "wall_id": wall_id,
+                "vtt_message": dump_vtt_message(vtt_message),
+                "seq": seq,
+                "seq_name": seq_name,
+            },
         )
-        tgm_bot.parse_mode = "html"
+        return STAGE_PASSED
 
-        async with await tgm_bot.start(bot_token=settings.TGM_BOT_TOKEN):
-            tgm_service = TelegramWallSender(
-                tgm_client=tgm_bot,
-                channel_id=settings.TGM_CHANNEL_ID,
-            )
+
+@worker.task()  # type: ignore[untyped-decorator]
+@async_to_sync
+async def download_wall(
+    owner_id: int,
+    wall_id: int,
+    vtt_message: dict[str, Any],
+    parent_task_id: str,
+    seq: int | None = None,
+    seq_name: str = LIVE_SEQUENCE,
+) -> str:
+    """Download stage: download media of the post, optimize it if enabled, and pass it to the publish stage.
+
+    Optimization is CPU-bound, so it runs in a process pool.
+    """
+    with logger.contextualize(owner_id=owner_id, wall_id=wall_id):
+        media_dir = get_media_dir(parent_task_id)
+        await asyncio.to_thread(media_dir.mkdir, parents=True, exist_ok=True)
+        message = load_vtt_message(vtt_message)
+        try:
+            media_files = await download_message_media(message, directory=media_dir)
+            logger.info(f"Downloaded {len(media_files)} media files.")
+            if settings.VTT_OPTIMIZE_MEDIA:
+                media_files, report = await asyncio.to_thread(
+                    optimize_message_media,
+                    message,
+                    media_files,
+                    max_photo_side=settings.VTT_PHOTO_MAX_SIDE,
+                    pool=get_optimize_pool(settings.VTT_OPTIMIZE_PROCESSES),
+                )
+                logger.info(f"Media optimized: {report.format()}")
+        except Exception:
+            await asyncio.to_thread(shutil.rmtree, media_dir, ignore_errors=True)
+            raise
+
+        send_stage_task(
+            worker,
+            "app.main.publish_wall",
+            parent_task_id=parent_task_id,
+            stage="publish",
+            queue="vtt-publish",
+            kwargs={
+                "owner_id": owner_id,
+                "wall_id": wall_id,
+                "vtt_message": vtt_message,
+                "media_files": media_files,
+                "seq": seq,
+                "seq_name": seq_name,
+            },
+        )
+        return STAGE_PASSED
+
+
+@worker.task(bind=True, max_retries=None)  # type: ignore[untyped-decorator]
+@async_to_sync
+async def publish_wall(
+    task: Task,
+    owner_id: int,
+    wall_id: int,
+    vtt_message: dict[str, Any],
+    media_files: dict[str, str | None],
+    parent_task_id: str,
+    seq: int | None = None,
+    seq_name: str = LIVE_SEQUENCE,
+) -> str:
+    """Publish stage: send the post with the downloaded media to Telegram channels.
+
+    The post is published only after the previous posts of the wall in its sequence (by `seq`) are completed.
+    """
+    with logger.contextualize(owner_id=owner_id, wall_id=wall_id):
+        if seq is not None and not is_sequence_turn(worker.backend.client, owner_id, seq, seq_name):
+            if task.request.retries * ORDER_RETRY_DELAY < settings.VTT_ORDER_TIMEOUT:
+                logger.info(f"Waiting for the previous posts of the wall, retrying in {ORDER_RETRY_DELAY} s.")
+                raise task.retry(countdown=ORDER_RETRY_DELAY)
+
+            logger.warning("Previous posts of the wall were not completed in time, publishing out of order.")
+            complete_sequence(worker.backend.client, owner_id, seq - 1, seq_name, skip_previous=True)
+
+        try:
+            return await _publish_wall(owner_id, wall_id, load_vtt_message(vtt_message), media_files)
+        finally:
+            await asyncio.to_thread(shutil.rmtree, get_media_dir(parent_task_id), ignore_errors=True)
+
+
+async def _publish_wall(
+    owner_id: int,
+    wall_id: int,
+    vtt_message: VttMessage,
+    media_files: dict[str, str | None],
+) -> str:
+    community = get_community_settings(owner_id=owner_id)
+    tgm_bot = create_tgm_bot()
+
+    async with await tgm_bot.start(bot_token=settings.TGM_BOT_TOKEN):
+        tgm_service = TelegramWallSender(
+            tgm_client=tgm_bot,
+            channel_id=community.channel_id,
+            pl_channel_id=community.pl_channel_id,
+            media_files=media_files,
+        )
+        try:
+            main_message = await tgm_service.send_vtt_message(vtt_message=vtt_message)
+        except VttError as error:
+            error_msg = error.message
+            logger.warning(f"Post was not sent to Telegram. Reason: '{error_msg}'")
+            return error_msg
+
+        set_message_id(
+            worker.backend.client,
+            channel_id=community.channel_id,
+            task_type=VttTaskType.wall,
+            owner_id=owner_id,
+            post_id=wall_id,
+            message_id=main_message.id,
+        )
+        set_message_map(
+            worker.backend.client,
+            channel_id=community.channel_id,
+            task_type=VttTaskType.wall,
+            owner_id=owner_id,
+            post_id=wall_id,
+            message_map=tgm_service.get_message_map(),
+        )
+
+        for mirror_channel_id in community.mirror_channel_ids:
+            mirror_service = TelegramWallSender(tgm_client=tgm_bot, channel_id=mirror_channel_id)
             try:
-                return await tgm_service.send_vtt_message(vtt_message=vtt_message)
-            except VttError as error:
-                error_msg = error.message
-                logger.warning(f"Post was not sent to Telegram. Reason: '{error_msg}'")
-                return error_msg
+                copies = await mirror_service.copy_messages(messages=tgm_service.sent_messages)
+            except RPCError as error:
+                logger.warning(f"Post was not copied to channel {mirror_channel_id}. Reason: '{error.message}'")
+                continue
 
+            set_message_id(
+                worker.backend.client,
+                channel_id=mirror_channel_id,
+                task_type=VttTaskType.wall,
+                owner_id=owner_id,
+                post_id=wall_id,
+                message_id=copies[main_message.id].id,
+            )
+            set_message_map(
+                worker.backend.client,
+                channel_id=mirror_channel_id,
+                task_type=VttTaskType.wall,
+                owner_id=owner_id,
+                post_id=wall_id,
+                message_map=tgm_service.get_message_map(copies=copies),
+            )
 
-@worker.task()  # type: ignore[untyped-decorator]
+        return await tgm_service.get_message_link(message_id=main_message.id)
+
+
+@worker.task(bind=True, max_retries=None)  # type: ignore[untyped-decorator]
+@async_to_sync
+async def edit_wall(task: Task, owner_id: int, wall_id: int) -> str:
+    """Edit text of the Telegram messages of the edited wall post. Media is not downloaded or uploaded again."""
+    with logger.contextualize(owner_id=owner_id, wall_id=wall_id):
+        logger.info(f"VK wall post edited: 'https://vk.ru/wall{owner_id}_{wall_id}'")
+
+        community = get_community_settings(owner_id=owner_id)
+        redis_client = worker.backend.client
+
+        message_maps = {
+            channel_id: message_map
+            for channel_id in [community.channel_id, *community.mirror_channel_ids]
+            if (message_map := get_message_map(redis_client, channel_id, VttTaskType.wall, owner_id, wall_id))
+        }
+        if not message_maps:
+            queued_task = get_queued_task(worker.backend, VttTaskType.wall, owner_id, wall_id)
+            if queued_task and queued_task["status"] in {"SENT", "STARTED"}:
+                if task.request.retries * EDIT_RETRY_DELAY < settings.VTT_ORDER_TIMEOUT + EDIT_SEND_TIMEOUT:
+                    logger.info(f"Post is still being sent, retrying in {EDIT_RETRY_DELAY} s.")
+                    raise task.retry(countdown=EDIT_RETRY_DELAY)
+
+                logger.warning("Post was not edited. Reason: 'SEND_TIMEOUT'")
+                return "SEND_TIMEOUT"
+
+            logger.warning("Post was not edited. Reason: 'NOT_SENT'")
+            return "NOT_SENT"
+
+        vk_api = API(token=community.vk_token, http_client=AiohttpClient())
+        vk_api.request_validators.append(VkLangRequestValidator())
+
+        vtt_factory = VttMessageFactory(vk_service=VkService(vk_api=vk_api), ignore_ads=community.ignore_ads)
+        vtt_message = await vtt_factory.create(owner_id=owner_id, wall_id=wall_id)
+
+        if isinstance(vtt_message, str):
+            logger.warning(f"Post was not edited. Reason: '{vtt_message}'")
+            return vtt_message
+
+        tgm_bot = create_tgm_bot()
+
+        edited = 0
+        async with await tgm_bot.start(bot_token=settings.TGM_BOT_TOKEN):
+            for channel_id, message_map in message_maps.items():
+                tgm_service = TelegramWallSender(tgm_client=tgm_bot, channel_id=channel_id)
+                edited += await tgm_service.edit_vtt_message(vtt_message=vtt_message, message_map=message_map)
+                set_message_map(
+                    redis_client,
+                    channel_id=channel_id,
+                    task_type=VttTaskType.wall,
+                    owner_id=owner_id,
+                    post_id=wall_id,
+                    message_map=message_map,
+                )
+
+        return "EDITED" if edited else "NOT_MODIFIED"
+
+
+def get_playlist_lock_key(pl_channel_id: int, owner_id: int, playlist_id: int) -> str:
+    return f"{PLAYLIST_LOCK_KEY_PREFIX}{pl_channel_id}_{owner_id}_{playlist_id}"
+
+
+async def _keep_lock(lock: Lock) -> None:
+    """Reset the timeout of the lock periodically, until the task is cancelled."""
+    while True:
+        await asyncio.sleep(PLAYLIST_LOCK_EXTEND_INTERVAL)
+        try:
+            await asyncio.to_thread(lock.reacquire)
+        except LockError:
+            logger.warning("Playlist lock was lost, another task may send the playlist.")
+            return
+
+
+@worker.task(bind=True, max_retries=None)  # type: ignore[untyped-decorator]
 @async_to_sync
 async def forward_playlist(
+    task: Task,
     *,
     owner_id: int,
     playlist_id: int,
     access_key: str | None = None,
     reply_channel_id: int | None = None,
     reply_message_id: int | None = None,
+    pl_channel_id: int | None = None,
 ) -> str:
     with logger.contextualize(
         owner_id=owner_id,
@@ -83,51 +376,103 @@ async def forward_playlist(
         reply_channel_id=reply_channel_id,
         reply_message_id=reply_message_id,
     ):
+        pl_channel_id = pl_channel_id or settings.TGM_PL_CHANNEL_ID
         pl_url = f"https://vk.ru/music/playlist/{owner_id}_{playlist_id}{'_' + access_key if access_key else ''}"
         logger.info(f"New VK playlist received: '{pl_url}'")
 
-        vk_api = API(token=settings.VK_TOKEN, http_client=AiohttpClient())
-        vk_api.request_validators.append(VkLangRequestValidator())
+        lock = worker.backend.client.lock(
+            get_playlist_lock_key(pl_channel_id, owner_id, playlist_id),
+            timeout=PLAYLIST_LOCK_TIMEOUT,
+            thread_local=False,
+        )
+        if not lock.acquire(blocking=False, token=task.request.id):
+            logger.info(f"Playlist is being sent by another task, retrying in {PLAYLIST_RETRY_DELAY} s.")
+            raise task.retry(countdown=PLAYLIST_RETRY_DELAY)
 
-        vk_service = VkService(vk_api=vk_api)
+        keep_lock_task = asyncio.create_task(_keep_lock(lock))
+        try:
+            return await _forward_playlist(
+                owner_id=owner_id,
+                playlist_id=playlist_id,
+                access_key=access_key,
+                reply_channel_id=reply_channel_id,
+                reply_message_id=reply_message_id,
+                pl_channel_id=pl_channel_id,
+            )
+        finally:
+            keep_lock_task.cancel()
+            # The lock is released with a compare-and-delete script, it is not released if it is held by another task
+            with contextlib.suppress(LockError):
+                lock.release()
 
-        vtt_factory = VttPlaylistFactory(vk_service=vk_service)
-        vtt_playlist = await vtt_factory.create(
+
+async def _forward_playlist(
+    *,
+    owner_id: int,
+    playlist_id: int,
+    access_key: str | None,
+    reply_channel_id: int | None,
+    reply_message_id: int | None,
+    pl_channel_id: int,
+) -> str:
+    # Playlist linked from a wall post is sent only once, other wall posts get a link to it
+    if reply_channel_id and reply_message_id:
+        pl_message_id = get_message_id(
+            worker.backend.client,
+            channel_id=pl_channel_id,
+            task_type=VttTaskType.playlist,
             owner_id=owner_id,
-            playlist_id=playlist_id,
-            access_key=access_key,
-            with_audios=True,
+            post_id=playlist_id,
         )
-        if not vtt_playlist:
-            return "NOT_FOUND"
-
-        tgm_bot = TelegramClient(
-            session=StringSession(settings.TGM_BOT_SESSION),
-            api_id=settings.TGM_API_ID,
-            api_hash=settings.TGM_API_HASH,
-            **get_tgm_proxy_config(
-                proxy_type=settings.TGM_PROXY_TYPE,
-                proxy_addr=settings.TGM_PROXY_ADDR,
-                proxy_port=settings.TGM_PROXY_PORT,
-                proxy_user=settings.TGM_PROXY_USER,
-                proxy_pass=settings.TGM_PROXY_PASS,
-                proxy_rdns=settings.TGM_PROXY_RDNS,
-                proxy_mtproto_secret=settings.TGM_PROXY_MTPROTO_SECRET,
-                proxy_mtproto_connection=settings.TGM_PROXY_MTPROTO_CONNECTION,
-            ),
+        if pl_message_id:
+            tgm_bot = create_tgm_bot()
+            async with await tgm_bot.start(bot_token=settings.TGM_BOT_TOKEN):
+                tgm_service = TelegramPlaylistSender(
+                    tgm_client=tgm_bot,
+                    pl_channel_id=pl_channel_id,
+                    wall_channel_id=reply_channel_id,
+                    wall_message_id=reply_message_id,
+                )
+                await tgm_service.attach_to_playlist(pl_message_id=pl_message_id)
+                return await tgm_service.get_message_link(channel_id=pl_channel_id, message_id=pl_message_id)
+
+    vk_api = API(token=settings.VK_TOKEN, http_client=AiohttpClient())
+    vk_api.request_validators.append(VkLangRequestValidator())
+
+    vk_service = VkService(vk_api=vk_api)
+
+    vtt_factory = VttPlaylistFactory(vk_service=vk_service)
+    vtt_playlist = await vtt_factory.create(
+        owner_id=owner_id,
+        playlist_id=playlist_id,
+        access_key=access_key,
+        with_audios=True,
+    )
+    if not vtt_playlist:
+        return "NOT_FOUND"
+
+    tgm_bot = create_tgm_bot()
+
+    async with await tgm_bot.start(bot_token=settings.TGM_BOT_TOKEN):
+        tgm_service = TelegramPlaylistSender(
+            tgm_client=tgm_bot,
+            pl_channel_id=pl_channel_id,
+            wall_channel_id=reply_channel_id,
+            wall_message_id=reply_message_id,
         )
-        tgm_bot.parse_mode = "html"
+        try:
+            main_message = await tgm_service.send_vtt_playlist(vtt_playlist=vtt_playlist)
+        except VttError as error:
+            error_msg = error.message
+            logger.warning(f"Playlist was not sent to Telegram. Reason: '{error_msg}'")
+            return error_msg
 
-        async with await tgm_bot.start(bot_token=settings.TGM_BOT_TOKEN):
-            tgm_service = TelegramPlaylistSender(
-                tgm_client=tgm_bot,
-                pl_channel_id=settings.TGM_PL_CHANNEL_ID,
-                wall_channel_id=reply_channel_id,
-                wall_message_id=reply_message_id,
-            )
-            try:
-                return await tgm_service.send_vtt_playlist(vtt_playlist=vtt_playlist)
-            except VttError as error:
-                error_msg = error.message
-                logger.warning(f"Playlist was not sent to Telegram. Reason: '{error_msg}'")
-                return error_msg
+        set_message_id(
+            worker.backend.client,
+            channel_id=pl_channel_id,
+            task_type=VttTaskType.playlist,
+            owner_id=owner_id,
+            post_id=playlist_id,
+            message_id=main_message.id,
+        )
+        return await tgm_service.get_message_link(channel_id=pl_channel_id, message_id=main_message.id)
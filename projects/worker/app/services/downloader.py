@@ -25,13 +25,32 @@ if TYPE_CHECKING:
 
     from vkbottle_types.objects import AudioAudio
 
-    from app.vtt.schemas import VttVideo
+    from app.vtt.schemas import VttMessage, VttVideo
+
+
+def get_audio_key(audio: AudioAudio) -> str:
+    return f"audio_{audio.owner_id}_{audio.id}"
 
 
 class Downloader:
-    def __init__(self) -> None:
+    """Download media into `directory`. Downloaded files are removed on exit, unless `keep_files` is specified.
+
+    `files` are files downloaded in advance by `download_message_media`, so they are not downloaded again.
+    They are not removed on exit, since other parts of the post may use them, they are removed by their owner.
+    """
+
+    def __init__(
+        self,
+        directory: Path | None = None,
+        files: dict[str, str | None] | None = None,
+        *,
+        keep_files: bool = False,
+    ) -> None:
         self.session = ClientSession(timeout=ClientTimeout(total=3600))
         self.file_paths: list[Path] = []
+        self.directory = directory or Path(tempfile.gettempdir())
+        self.files = files or {}
+        self.keep_files = keep_files
 
     async def __aenter__(self) -> Self:
         return self
@@ -44,25 +63,42 @@ class Downloader:
     ) -> None:
         await self.session.close()
 
+        if self.keep_files:
+            return
         for path in self.file_paths:
             path.unlink(missing_ok=True)
 
+    def _get_downloaded(self, key: str) -> tuple[bool, Path | None]:
+        """Return whether the file was downloaded in advance and its path. Path is `None` if the download failed."""
+        if key not in self.files:
+            return False, None
+        path = self.files[key]
+        return True, Path(path) if path else None
+
     async def download_media(self, url: str) -> Path:
+        is_downloaded, path = self._get_downloaded(url)
+        if is_downloaded and path:
+            return path
+
         logger.info(f"Downloading document from URL: {url}")
 
         await asyncio.sleep(randbelow(3))
         async with self.session.get(url) as response:
-            filepath = Path(tempfile.gettempdir(), Path(response.url.path).name)
+            filepath = Path(self.directory, Path(response.url.path).name)
             async with aiofiles.open(filepath, "w+b") as file:
                 async for chunk, _ in response.content.iter_chunks():
                     await file.write(chunk)
         return filepath
 
     async def download_video(self, video: VttVideo) -> Path | None:
+        is_downloaded, path = self._get_downloaded(video.url)
+        if is_downloaded:
+            return path
+
         logger.info(f'Downloading video "{video.title}" from URL: {video.url}')
 
         name = sanitize_filename(video.title)
-        outtmpl = str(Path(tempfile.gettempdir(), f"{name}.%(ext)s"))
+        outtmpl = str(Path(self.directory, f"{name}.%(ext)s"))
 
         def download_by_ytdlp() -> str:
             with YoutubeDL(
@@ -91,6 +127,10 @@ class Downloader:
         self,
         audio: AudioAudio,
     ) -> Path | None:
+        is_downloaded, path = self._get_downloaded(get_audio_key(audio))
+        if is_downloaded:
+            return path
+
         url = audio.url
         audio_full_id = f"{audio.owner_id}_{audio.id}_{audio.access_key}"
         audio_full_title = f"{audio.artist} - {audio.title}"
@@ -104,10 +144,10 @@ class Downloader:
         await asyncio.sleep(randbelow(3))
 
         safe_name = sanitize_filename(f"{audio_full_title}.mp3")
-        filepath = Path(tempfile.gettempdir(), safe_name)
+        filepath = Path(self.directory, safe_name)
         counter = 1
         while await asyncio.to_thread(filepath.exists):
-            filepath = Path(tempfile.gettempdir(), f"{safe_name.removesuffix('.mp3')}_{counter}.mp3")
+            filepath = Path(self.directory, f"{safe_name.removesuffix('.mp3')}_{counter}.mp3")
             counter += 1
 
         async with aiofiles.open(filepath, "w+b") as temp:
@@ -155,6 +195,36 @@ class Downloader:
         if not file_paths:
             raise VttError("Failed to download files.")
 
-        self.file_paths.extend(file_paths)
+        downloaded_in_advance = {Path(path) for path in self.files.values() if path}
+        self.file_paths.extend(path for path in file_paths if path not in downloaded_in_advance)
 
         return file_paths
+
+
+async def download_message_media(vtt_message: VttMessage, directory: Path) -> dict[str, str | None]:
+    """Download media of the post and its reposts, that `TelegramWallSender` would download while sending.
+
+    Returns paths of the files by their URLs (audio keys for audios). Path is `None` if the download failed.
+    """
+    urls: list[str] = []
+    audios: list[AudioAudio] = []
+    videos: list[VttVideo] = []
+    for message in [vtt_message, *vtt_message.copy_history]:
+        attachments = message.attachments
+        urls.extend(attachments.photos)
+        urls.extend(document.url for document in attachments.documents)
+        if attachments.audio_playlist and attachments.audio_playlist.photo:
+            urls.append(attachments.audio_playlist.photo)
+        audios.extend(attachments.audios)
+        videos.extend(video for video in attachments.videos if video.platform is None and not video.is_live)
+
+    async with Downloader(directory=directory, keep_files=True) as downloader:
+        url_paths = await asyncio.gather(*(downloader.download_media(url) for url in dict.fromkeys(urls)))
+        audio_paths = await asyncio.gather(*(downloader.download_audio(audio) for audio in audios))
+        video_paths = await asyncio.gather(*(downloader.download_video(video) for video in videos))
+
+    return {
+        **{url: str(path) for url, path in zip(dict.fromkeys(urls), url_paths, strict=True)},
+        **{get_audio_key(audio): str(path) if path else None for audio, path in zip(audios, audio_paths, strict=True)},
+        **{video.url: str(path) if path else None for video, path in zip(videos, video_paths, strict=True)},
+    }
@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from functools import cache
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import ffmpeg
+from billiard.pool import Pool
+from loguru import logger
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+if TYPE_CHECKING:
+    from app.vtt.schemas import VttMessage
+
+# Containers, that are remuxed to MP4 without re-encoding
+REMUX_VIDEO_SUFFIXES = frozenset({".mp4", ".m4v", ".mov"})
+
+PHOTO_QUALITY = 87
+
+
+@dataclass(slots=True)
+class OptimizationReport:
+    """Sizes of the media files of a post before and after optimization."""
+
+    files: int = 0
+    optimized: int = 0
+    size_before: int = 0
+    size_after: int = 0
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.size_before - self.size_after
+
+    def add(self, size_before: int, size_after: int) -> None:
+        self.files += 1
+        self.size_before += size_before
+        self.size_after += size_after
+        if size_after != size_before:
+            self.optimized += 1
+
+    def format(self) -> str:
+        percent = self.bytes_saved / self.size_before * 100 if self.size_before else 0.0
+        return (
+            f"{self.optimized} of {self.files} files optimized, "
+            f"{self.size_before} -> {self.size_after} bytes, saved {self.bytes_saved} bytes ({percent:.1f}%)"
+        )
+
+
+def _has_alpha(image: Image.Image) -> bool:
+    return image.mode in {"RGBA", "LA", "PA"} or (image.mode == "P" and "transparency" in image.info)
+
+
+def optimize_photo(path: Path, max_side: int) -> Path:
+    """Downscale the photo to `max_side` and re-encode it without metadata.
+
+    Photos with transparency are saved as PNG, other photos as JPEG.
+    Returns path of the optimized photo, or `path` if the photo could not be made smaller.
+    """
+    with Image.open(path) as image:
+        is_large = max(image.size) > max_side
+        photo = ImageOps.exif_transpose(image)
+        photo.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+
+        # EXIF, ICC profile and other metadata are not saved
+        if _has_alpha(photo):
+            suffix = ".png"
+            temp_path = path.with_name(f"{path.stem}.tmp{suffix}")
+            photo.save(temp_path, "PNG", optimize=True)
+        else:
+            suffix = ".jpg"
+            temp_path = path.with_name(f"{path.stem}.tmp{suffix}")
+            if photo.mode != "RGB":
+                photo = photo.convert("RGB")
+            photo.save(temp_path, "JPEG", quality=PHOTO_QUALITY, optimize=True, progressive=True)
+
+    if not is_large and temp_path.stat().st_size >= path.stat().st_size:
+        temp_path.unlink()
+        return path
+
+    return _replace(path, temp_path, suffix)
+
+
+def _replace(path: Path, temp_path: Path, suffix: str) -> Path:
+    optimized_path = path.with_suffix(suffix)
+    path.unlink()
+    return temp_path.replace(optimized_path)
+
+
+def optimize_video(path: Path) -> Path:
+    """Remux the video to MP4 with faststart and without metadata. Streams are copied without re-encoding.
+
+    Returns path of the optimized video, or `path` if its container is not supported.
+    """
+    if path.suffix.lower() not in REMUX_VIDEO_SUFFIXES:
+        return path
+
+    temp_path = path.with_name(f"{path.stem}.tmp.mp4")
+    stream = ffmpeg.input(str(path))
+    stream = ffmpeg.output(
+        stream,
+        str(temp_path),
+        c="copy",
+        map_metadata=-1,
+        movflags="+faststart",
+    )
+    ffmpeg.run(stream, overwrite_output=True, quiet=True)
+
+    return _replace(path, temp_path, ".mp4")
+
+
+@cache
+def get_optimize_pool(processes: int = 0) -> Pool:
+    """Return the process pool of the current process, `processes` is the number of CPUs by default.
+
+    The pool is created on first use, so every Celery worker process, that optimizes media, has its own.
+    `billiard` pool is used, since `concurrent.futures` pools can't be started from daemonic Celery processes.
+    """
+    return Pool(processes or None)
+
+
+def _optimize_file(key: str, file: str, max_photo_side: int, is_photo: bool) -> tuple[str, str, int, int]:
+    """Optimize the file in a process of the pool. Returns the key, the path and sizes before and after optimization."""
+    path = Path(file)
+    size_before = path.stat().st_size
+    try:
+        optimized_path = optimize_photo(path, max_photo_side) if is_photo else optimize_video(path)
+    except (OSError, UnidentifiedImageError, ffmpeg.Error) as error:
+        logger.warning(f"Failed to optimize '{path.name}': {error}")
+        return key, file, size_before, size_before
+
+    return key, str(optimized_path), size_before, optimized_path.stat().st_size
+
+
+def optimize_message_media(
+    vtt_message: VttMessage,
+    media_files: dict[str, str | None],
+    max_photo_side: int,
+    pool: Pool,
+) -> tuple[dict[str, str | None], OptimizationReport]:
+    """Optimize photos and videos of the post, downloaded by `download_message_media`, in parallel in `pool`.
+
+    Documents and audios are sent as they are. Files, that failed to optimize, are kept unchanged.
+    Returns updated paths of the files and the report.
+    """
+    photo_urls: set[str] = set()
+    video_urls: set[str] = set()
+    for message in [vtt_message, *vtt_message.copy_history]:
+        attachments = message.attachments
+        photo_urls.update(attachments.photos)
+        if attachments.audio_playlist and attachments.audio_playlist.photo:
+            photo_urls.add(attachments.audio_playlist.photo)
+        video_urls.update(video.url for video in attachments.videos)
+
+    results = pool.starmap(
+        _optimize_file,
+        [
+            (key, file, max_photo_side, key in photo_urls)
+            for key, file in media_files.items()
+            if file and (key in photo_urls or key in video_urls)
+        ],
+    )
+
+    report = OptimizationReport()
+    optimized_files = dict(media_files)
+    for key, file, size_before, size_after in results:
+        report.add(size_before, size_after)
+        optimized_files[key] = file
+
+    return optimized_files, report
@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import asyncio
+from typing import TYPE_CHECKING
+from urllib.parse import urlparse
+
+from aiohttp import ClientError, ClientSession, ClientTimeout
+from loguru import logger
+
+from app.vtt.schemas import VttLink
+
+if TYPE_CHECKING:
+    from app.vtt.schemas import VttAttachments
+
+PROBE_TIMEOUT = 30
+
+
+def format_size(size: int) -> str:
+    return f"{size / 1024 / 1024:.1f} MB"
+
+
+async def get_content_length(session: ClientSession, url: str) -> int | None:
+    """Return size of the file by URL without downloading it, or `None` if the server does not report it.
+
+    `HEAD` request is tried first, then `GET` request with zero-length range.
+    """
+    async with session.head(url, allow_redirects=True) as response:
+        if response.ok and response.content_length:
+            return response.content_length
+
+    async with session.get(url, headers={"Range": "bytes=0-0"}) as response:
+        # Content-Range: bytes 0-0/<size>
+        total = response.headers.get("Content-Range", "").rpartition("/")[2]
+        if total.isdigit():
+            return int(total)
+    return None
+
+
+async def drop_oversized_files(attachments: VttAttachments, max_size: int) -> None:
+    """Remove documents and audios larger than `max_size` bytes, before they are downloaded.
+
+    Sizes of documents are taken from VK, if available. Other sizes are requested concurrently.
+    Removed files are added to `skipped_files` as links.
+    """
+
+    async def get_size(session: ClientSession, url: str) -> int | None:
+        try:
+            return await get_content_length(session, url)
+        except (ClientError, TimeoutError) as error:
+            logger.warning(f"Failed to get size of the file from URL: {url}. Error: {error}")
+            return None
+
+    document_urls = [document.url for document in attachments.documents if document.size is None]
+    # Audios from HLS playlists are downloaded by segments, their size is not known in advance
+    audio_urls = [
+        audio.url for audio in attachments.audios if audio.url and not urlparse(audio.url).path.endswith("m3u8")
+    ]
+    urls = list(dict.fromkeys(document_urls + audio_urls))
+    sizes: dict[str, int | None] = {}
+    if urls:
+        async with ClientSession(timeout=ClientTimeout(total=PROBE_TIMEOUT)) as session:
+            sizes = dict(zip(urls, await asyncio.gather(*(get_size(session, url) for url in urls)), strict=True))
+
+    documents = []
+    for document in attachments.documents:
+        size = document.size if document.size is not None else sizes.get(document.url)
+        if size is not None and size > max_size:
+            logger.warning(f"Skipping document '{document.title}': {format_size(size)}")
+            attachments.skipped_files.append(
+                VttLink(caption=f"{document.title} ({format_size(size)})", url=document.url),
+            )
+        else:
+            documents.append(document)
+    attachments.documents = documents
+
+    audios = []
+    for audio in attachments.audios:
+        size = sizes.get(audio.url) if audio.url else None
+        if size is not None and size > max_size:
+            audio_title = f"{audio.artist} - {audio.title}"
+            logger.warning(f"Skipping audio '{audio_title}': {format_size(size)}")
+            attachments.skipped_files.append(
+                VttLink(
+                    caption=f"{audio_title} ({format_size(size)})",
+                    url=f"https://vk.ru/audio{audio.owner_id}_{audio.id}",
+                ),
+            )
+        else:
+            audios.append(audio)
+    attachments.audios = audios
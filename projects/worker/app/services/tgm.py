@@ -1,8 +1,11 @@
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, cast
+import hashlib
+from itertools import groupby
+from typing import TYPE_CHECKING, Any, cast
 
 from loguru import logger
+from telethon.errors.rpcbaseerrors import RPCError
 from telethon.extensions import html
 from telethon.tl.custom.button import Button
 from telethon.tl.types import (
@@ -14,9 +17,12 @@ from telethon.tl.types import (
     PollAnswer,
     TextWithEntities,
 )
+from telethon.utils import resolve_id
+from vtt_common.sessions import RedisSession
 
 from app.config import _, settings
 from app.services.downloader import Downloader
+from app.vtt.schemas import VttText
 from app.worker import worker
 
 if TYPE_CHECKING:
@@ -24,6 +30,7 @@ if TYPE_CHECKING:
     from telethon.tl.types import Message as TelethonMessage
     from telethon.tl.types import TypeMessageEntity
     from vkbottle_types.objects import AudioAudio
+    from vtt_common.messages import MessageMap, TextMessage
 
     from app.vtt.schemas import VttAttachments, VttAudioPlaylist, VttMessage
 
@@ -32,10 +39,127 @@ GO_TO_PL = _("GO_TO_PL")
 PL_OUT_OF = _("PL_OUT_OF")
 
 
+def _group_albums(messages: list[TelethonMessage]) -> list[list[TelethonMessage]]:
+    """Split messages into albums and single messages, keeping their order."""
+    return [list(group) for _, group in groupby(messages, key=lambda message: message.grouped_id or -message.id)]
+
+
+async def get_message_link(tgm_client: TelegramClient, channel_id: int, message_id: int) -> str:
+    """Return link to the message. Username of the channel is taken from the session cache, if possible."""
+    session = tgm_client.session
+    is_cached, username = (
+        session.get_channel_username(channel_id) if isinstance(session, RedisSession) else (False, None)
+    )
+    if is_cached:
+        channel = username or f"c/{resolve_id(channel_id)[0]}"
+        return f"https://t.me/{channel}/{message_id}"
+
+    entity = await tgm_client.get_entity(channel_id)
+
+    if not isinstance(entity, Channel):
+        logger.warning(f"Entity with id '{channel_id}' is not a channel.")
+        return ""
+
+    channel = entity.username
+    if channel is None:
+        channel = f"c/{entity.id}"
+
+    return f"https://t.me/{channel}/{message_id}"
+
+
+def _get_text_hash(text: str, entities: list[TypeMessageEntity] | None) -> str:
+    return hashlib.sha256(html.unparse(text, entities).encode()).hexdigest()[:16]
+
+
+def get_post_texts(vtt_message: VttMessage) -> list[VttText]:
+    """Return texts of the post and its reposts, as they are sent by `send_vtt_message`.
+
+    Index 0 is the post itself, index N is the N-th repost of its copy history.
+    """
+    texts = [vtt_message.text, *(repost.text for repost in vtt_message.copy_history)]
+
+    # If that is a bare repost (i.e. main message does not have any text),
+    # then add footer text from main message to the last repost
+    if vtt_message.copy_history and not vtt_message.text.header:
+        texts[1] = VttText(header=texts[1].header, footer=texts[1].footer + vtt_message.text.footer)
+    return texts
+
+
+def _get_text_parts(
+    texts: list[VttText],
+    post_index: int,
+    *,
+    is_caption: bool,
+) -> list[tuple[str, list[TypeMessageEntity]]]:
+    if post_index >= len(texts):
+        return []
+    return texts[post_index].caption if is_caption else texts[post_index].message
+
+
 class TelegramWallSender:
-    def __init__(self, tgm_client: TelegramClient, channel_id: int) -> None:
+    def __init__(
+        self,
+        tgm_client: TelegramClient,
+        channel_id: int,
+        pl_channel_id: int | None = None,
+        media_files: dict[str, str | None] | None = None,
+    ) -> None:
         self.tgm_client = tgm_client
         self.channel_id = channel_id
+        self.pl_channel_id = settings.TGM_PL_CHANNEL_ID if pl_channel_id is None else pl_channel_id
+        # Media downloaded in advance by `download_message_media`
+        self.media_files = media_files
+
+        # All messages sent to the channel, in the order of sending
+        self.sent_messages: list[TelethonMessage] = []
+        # Messages with parts of the post text
+        self.text_messages: list[TextMessage] = []
+
+    async def _send_message(self, **kwargs: Any) -> TelethonMessage:
+        message = cast("TelethonMessage", await self.tgm_client.send_message(self.channel_id, **kwargs))
+        self.sent_messages.append(message)
+        return message
+
+    async def _send_file(self, **kwargs: Any) -> list[TelethonMessage]:
+        result = cast(
+            "TelethonMessage | list[TelethonMessage]",
+            await self.tgm_client.send_file(self.channel_id, **kwargs),
+        )
+        messages = result if isinstance(result, list) else [result]
+        self.sent_messages.extend(messages)
+        return messages
+
+    def _add_text_message(
+        self,
+        message: TelethonMessage,
+        text: tuple[str, list[TypeMessageEntity] | None],
+        post_index: int,
+        part: int,
+        *,
+        is_caption: bool,
+        link_preview: bool,
+    ) -> None:
+        self.text_messages.append(
+            {
+                "id": message.id,
+                "post_index": post_index,
+                "part": part,
+                "is_caption": is_caption,
+                "link_preview": link_preview,
+                "text_hash": _get_text_hash(*text),
+            },
+        )
+
+    def get_message_map(self, copies: dict[int, TelethonMessage] | None = None) -> MessageMap:
+        """Return all sent messages and messages with the post text. If `copies` are passed, return ids of copies."""
+
+        def get_id(message_id: int) -> int:
+            return copies[message_id].id if copies is not None else message_id
+
+        return {
+            "message_ids": [get_id(message.id) for message in self.sent_messages],
+            "texts": [{**text_message, "id": get_id(text_message["id"])} for text_message in self.text_messages],
+        }
 
     async def _send_first_main_message(
         self,
@@ -43,6 +167,7 @@ class TelegramWallSender:
         caption_text: list[tuple[str, list[TypeMessageEntity]]],
         attachments: VttAttachments,
         reply_to_message_id: int | None = None,
+        post_index: int = 0,
     ) -> tuple[TelethonMessage, bool]:
         logger.info("Sending first main message...")
 
@@ -55,47 +180,40 @@ class TelegramWallSender:
         has_link_preview = attachments.link or any((video.platform or video.is_live) for video in attachments.videos)
 
         is_caption = False
+        # Message with the first part of the text, if it is not the main message
+        text_msg = None
 
-        async with Downloader() as downloader:
+        async with Downloader(files=self.media_files) as downloader:
             if attachments.photos:
                 is_caption = True
                 files = await downloader.download_files(urls=attachments.photos)
                 if videos:
                     files.extend(await downloader.download_files(videos=videos))
-                main_msg = cast(
-                    "TelethonMessage",
-                    (
-                        await self.tgm_client.send_file(
-                            self.channel_id,
-                            file=files,
-                            caption=first_caption_html,
-                            video_note=True,
-                            supports_streaming=True,
-                            link_preview=has_link_preview,
-                            reply_to=reply_to_message_id,
-                        )
-                    )[0],
-                )
+                main_msg = (
+                    await self._send_file(
+                        file=files,
+                        caption=first_caption_html,
+                        video_note=True,
+                        supports_streaming=True,
+                        link_preview=has_link_preview,
+                        reply_to=reply_to_message_id,
+                    )
+                )[0]
             elif videos:
                 is_caption = True
                 current_videos = await downloader.download_files(videos=videos)
-                main_msg = cast(
-                    "TelethonMessage",
-                    (
-                        await self.tgm_client.send_file(
-                            self.channel_id,
-                            file=current_videos,
-                            caption=first_caption_html,
-                            video_note=True,
-                            supports_streaming=True,
-                            link_preview=has_link_preview,
-                            reply_to=reply_to_message_id,
-                        )
-                    )[0],
-                )
+                main_msg = (
+                    await self._send_file(
+                        file=current_videos,
+                        caption=first_caption_html,
+                        video_note=True,
+                        supports_streaming=True,
+                        link_preview=has_link_preview,
+                        reply_to=reply_to_message_id,
+                    )
+                )[0]
             elif has_link_preview:
-                main_msg = await self.tgm_client.send_message(
-                    self.channel_id,
+                main_msg = await self._send_message(
                     message=first_message_text,
                     formatting_entities=first_message_entities,
                     link_preview=True,
@@ -105,67 +223,79 @@ class TelegramWallSender:
                 is_caption = True
                 document = attachments.documents[0]
                 downloaded_documents = await downloader.download_media(document.url)
-                main_msg = cast(
-                    "TelethonMessage",
-                    await self.tgm_client.send_file(
-                        self.channel_id,
+                main_msg = (
+                    await self._send_file(
                         file=downloaded_documents,
                         caption=first_caption_text,
                         formatting_entities=first_caption_entities,
                         reply_to=reply_to_message_id,
-                    ),
-                )
+                    )
+                )[0]
             elif attachments.audios:
                 is_caption = True
                 downloaded_audios = await downloader.download_files(audios=attachments.audios[:10])
-                main_msg = cast(
-                    "TelethonMessage",
-                    (
-                        await self.tgm_client.send_file(
-                            self.channel_id,
-                            caption=[""] * (len(downloaded_audios) - 1) + [first_caption_html],
-                            file=downloaded_audios,
-                            voice_note=True,
-                            reply_to=reply_to_message_id,
-                        )
-                    )[0],
+                audio_messages = await self._send_file(
+                    caption=[""] * (len(downloaded_audios) - 1) + [first_caption_html],
+                    file=downloaded_audios,
+                    voice_note=True,
+                    reply_to=reply_to_message_id,
                 )
+                main_msg = audio_messages[0]
+                text_msg = audio_messages[-1]
                 attachments.audios = attachments.audios[10:]
             else:
-                main_msg = await self.tgm_client.send_message(
-                    self.channel_id,
+                main_msg = await self._send_message(
                     message=first_message_text,
                     formatting_entities=first_message_entities,
                     link_preview=has_link_preview,
                     reply_to=reply_to_message_id,
                 )
 
+        self._add_text_message(
+            text_msg or main_msg,
+            (first_caption_text, first_caption_entities)
+            if is_caption
+            else (first_message_text, first_message_entities),
+            post_index=post_index,
+            part=0,
+            is_caption=is_caption,
+            link_preview=bool(has_link_preview),
+        )
         return main_msg, is_caption
 
     async def _send_rest_main_text_messages(
         self,
         first_message_id: int,
         rest_messages_text: list[tuple[str, list[TypeMessageEntity]]],
+        post_index: int = 0,
+        *,
+        is_caption: bool = False,
     ) -> None:
         if not rest_messages_text:
             return
 
         logger.info("Sending rest main message...")
-        for text, entities in rest_messages_text:
-            await self.tgm_client.send_message(
-                self.channel_id,
+        for part, (text, entities) in enumerate(rest_messages_text, start=1):
+            message = await self._send_message(
                 message=text,
                 formatting_entities=entities,
                 link_preview=False,
                 reply_to=first_message_id,
             )
+            self._add_text_message(
+                message,
+                (text, entities),
+                post_index=post_index,
+                part=part,
+                is_caption=is_caption,
+                link_preview=False,
+            )
 
     async def _send_rest_main_media_messages(self, first_message_id: int, attachments: VttAttachments) -> None:
         if attachments.geo and attachments.geo.coordinates:
             logger.info("Sending geo location...")
             latitude, longitude = (float(x) for x in attachments.geo.coordinates.split(" "))
-            await self.tgm_client.send_file(
-                self.channel_id,
+            await self._send_file(
                 file=InputMediaGeoLive(geo_point=InputGeoPoint(lat=latitude, long=longitude)),
                 reply_to=first_message_id,
             )
@@ -173,8 +303,7 @@ class TelegramWallSender:
         if attachments.poll:
             logger.info("Sending poll...")
             poll = attachments.poll
-            await self.tgm_client.send_file(
-                self.channel_id,
+            await self._send_file(
                 file=InputMediaPoll(
                     poll=Poll(
                         id=0,
@@ -190,12 +319,11 @@ class TelegramWallSender:
                 reply_to=first_message_id,
             )
 
-        async with Downloader() as downloader:
+        async with Downloader(files=self.media_files) as downloader:
             if attachments.audios:
                 logger.info("Sending audios...")
                 current_audios = await downloader.download_files(audios=attachments.audios)
-                await self.tgm_client.send_file(
-                    self.channel_id,
+                await self._send_file(
                     file=current_audios,
                     voice_note=True,
                     reply_to=first_message_id,
@@ -206,8 +334,7 @@ class TelegramWallSender:
                 logger.info("Sending documents...")
                 document_urls = [doc.url for doc in attachments.documents[1:]]
                 document_paths = await downloader.download_files(urls=document_urls)
-                await self.tgm_client.send_file(
-                    self.channel_id,
+                await self._send_file(
                     file=document_paths,
                     force_document=True,
                     reply_to=first_message_id,
@@ -227,14 +354,13 @@ class TelegramWallSender:
                     downloaded_photo = await downloader.download_media(url=playlist.photo)
 
                 # Send playlist message without audios to the main channel
-                main_pl_message = await self.tgm_client.send_message(
-                    self.channel_id,
+                main_pl_message = await self._send_message(
                     message=first_pl_caption_html,
                     file=downloaded_photo,
                     reply_to=first_message_id,
                 )
 
-                if settings.TGM_PL_CHANNEL_ID:
+                if self.pl_channel_id:
                     logger.info("Sending playlist task...")
 
                     # Send task to create messages in the playlist channel
@@ -247,7 +373,9 @@ class TelegramWallSender:
                             "access_key": playlist.access_key,
                             "reply_channel_id": self.channel_id,
                             "reply_message_id": main_pl_message.id,
+                            "pl_channel_id": self.pl_channel_id,
                         },
+                        ignore_result=True,
                     )
 
                     logger.info(f"[{playlist.full_id}] Playlist task sent successfully.")
@@ -255,8 +383,7 @@ class TelegramWallSender:
                 # Send rest playlist messages if any to the main channel
                 rest_messages = playlist_caption[1:]
                 for text, entities in rest_messages:
-                    await self.tgm_client.send_message(
-                        self.channel_id,
+                    await self._send_message(
                         message=text,
                         formatting_entities=entities,
                         link_preview=False,
@@ -267,9 +394,12 @@ class TelegramWallSender:
         self,
         vtt_message: VttMessage,
         reply_to_message_id: int | None = None,
+        post_index: int = 0,
+        text: VttText | None = None,
     ) -> TelethonMessage:
-        message_text = vtt_message.text.message
-        caption_text = vtt_message.text.caption
+        text = text or vtt_message.text
+        message_text = text.message
+        caption_text = text.caption
 
         attachments = vtt_message.attachments
 
@@ -278,12 +408,15 @@ class TelegramWallSender:
             caption_text=caption_text,
             attachments=attachments,
             reply_to_message_id=reply_to_message_id,
+            post_index=post_index,
         )
 
         rest_messages_text = caption_text[1:] if is_caption else message_text[1:]
         await self._send_rest_main_text_messages(
             first_message_id=first_message.id,
             rest_messages_text=rest_messages_text,
+            post_index=post_index,
+            is_caption=is_caption,
         )
 
         await self._send_rest_main_media_messages(
@@ -294,57 +427,114 @@ class TelegramWallSender:
         logger.info("Main message sent successfully.")
         return first_message
 
-    async def _get_message_link(self, message_id: int) -> str:
-        entity = await self.tgm_client.get_entity(self.channel_id)
+    async def get_message_link(self, message_id: int) -> str:
+        return await get_message_link(self.tgm_client, channel_id=self.channel_id, message_id=message_id)
 
-        if not isinstance(entity, Channel):
-            logger.warning(f"Entity with id '{self.channel_id}' is not a channel.")
-            return ""
+    async def copy_messages(self, messages: list[TelethonMessage]) -> dict[int, TelethonMessage]:
+        """Send copies of `messages` from another channel, keeping their order, albums and replies.
 
-        channel = entity.username
-        if channel is None:
-            channel = f"c/{entity.id}"
+        Media of copies refers to the already uploaded files, so nothing is downloaded or uploaded again.
+        Returns copies by ids of the original messages.
+        """
+        copies: dict[int, TelethonMessage] = {}
+        for album in _group_albums(messages):
+            first_message = album[0]
+            reply_to_id = first_message.reply_to.reply_to_msg_id if first_message.reply_to else None
+            reply_to = copies[reply_to_id].id if reply_to_id in copies else None
 
-        return f"https://t.me/{channel}/{message_id}"
-
-    async def send_vtt_message(self, vtt_message: VttMessage) -> str:
+            if len(album) == 1:
+                copied_messages = [await self._send_message(message=first_message, reply_to=reply_to)]
+            else:
+                copied_messages = await self._send_file(
+                    file=[message.media for message in album],
+                    caption=[message.text for message in album],
+                    reply_to=reply_to,
+                )
+            copies.update(zip((message.id for message in album), copied_messages, strict=True))
+
+        logger.info("Copied {} messages to channel {}.", len(copies), self.channel_id)
+        return copies
+
+    async def edit_vtt_message(self, vtt_message: VttMessage, message_map: MessageMap) -> int:
+        """Edit messages of `message_map`, whose text differs from the text of the edited post.
+
+        Text hashes of `message_map` are updated in place. Returns number of edited messages.
+        """
+        texts = get_post_texts(vtt_message)
+        edited = 0
+        for text_message in message_map["texts"]:
+            post_index, part = text_message["post_index"], text_message["part"]
+            parts = _get_text_parts(texts, post_index, is_caption=text_message["is_caption"])
+            if part >= len(parts):
+                logger.warning(f"Part {part} of post {post_index} no longer exists, message {text_message['id']} kept.")
+                continue
+
+            text, entities = parts[part]
+            text_hash = _get_text_hash(text, entities)
+            if text_hash == text_message["text_hash"]:
+                continue
+
+            try:
+                await self.tgm_client.edit_message(
+                    self.channel_id,
+                    text_message["id"],
+                    text=text,
+                    formatting_entities=entities,
+                    link_preview=text_message["link_preview"],
+                )
+            except RPCError as error:
+                logger.warning(f"Message {text_message['id']} was not edited. Reason: '{error.message}'")
+                continue
+
+            text_message["text_hash"] = text_hash
+            edited += 1
+
+        parts_count: dict[tuple[int, bool], int] = {}
+        for text_message in message_map["texts"]:
+            key = (text_message["post_index"], text_message["is_caption"])
+            parts_count[key] = max(parts_count.get(key, 0), text_message["part"] + 1)
+        for (post_index, is_caption), count in parts_count.items():
+            new_count = len(_get_text_parts(texts, post_index, is_caption=is_caption))
+            if new_count > count:
+                logger.warning(f"Text of post {post_index} became longer, {new_count - count} parts were not sent.")
+
+        logger.info("Edited {} messages in channel {}.", edited, self.channel_id)
+        return edited
+
+    async def send_vtt_message(self, vtt_message: VttMessage) -> TelethonMessage:
         if not vtt_message.copy_history:
             main_message = await self.send_main_message(vtt_message=vtt_message)
         else:
+            texts = get_post_texts(vtt_message)
+            reposts_count = len(vtt_message.copy_history)
             reversed_posts = vtt_message.copy_history[::-1]
 
             # Send all reposts except the last one
             reply_id = None
-            for repost in reversed_posts[:-1]:
+            for index, repost in enumerate(reversed_posts[:-1]):
                 repost_message = await self.send_main_message(
                     vtt_message=repost,
                     reply_to_message_id=reply_id,
+                    post_index=reposts_count - index,
                 )
                 reply_id = repost_message.id
 
-            repost = reversed_posts[-1]
-
-            main_text = vtt_message.text
-
-            # If that is a bare repost (i.e. main message does not have any text),
-            # then add footer text from main message
-            if not main_text.header:
-                repost.text.footer += main_text.footer
-
             # Send last repost
             main_message = await self.send_main_message(
-                vtt_message=repost,
+                vtt_message=reversed_posts[-1],
                 reply_to_message_id=reply_id,
+                post_index=1,
+                text=texts[1],
             )
 
             # Send main message if it has text
-            if main_text.header:
+            if vtt_message.text.header:
                 main_message = await self.send_main_message(
                     vtt_message=vtt_message,
                     reply_to_message_id=reply_id,
                 )
 
-        return await self._get_message_link(message_id=main_message.id)
+        return main_message
 
 
 class TelegramPlaylistSender:
@@ -361,24 +551,14 @@ class TelegramPlaylistSender:
         self.wall_channel_id = wall_channel_id
         self.wall_message_id = wall_message_id
 
-    async def _get_message_link(self, channel_id: int, message_id: int) -> str:
-        entity = await self.tgm_client.get_entity(channel_id)
-
-        if not isinstance(entity, Channel):
-            logger.warning(f"Entity with id '{channel_id}' is not a channel.")
-            return ""
-
-        channel = entity.username
-        if channel is None:
-            channel = f"c/{entity.id}"
-
-        return f"https://t.me/{channel}/{message_id}"
+    async def get_message_link(self, channel_id: int, message_id: int) -> str:
+        return await get_message_link(self.tgm_client, channel_id=channel_id, message_id=message_id)
 
     async def _add_link_buttons(self, pl_message: TelethonMessage) -> None:
         if not self.wall_channel_id or not self.wall_message_id:
             return
 
-        wall_post_link = await self._get_message_link(
+        wall_post_link = await self.get_message_link(
             channel_id=self.wall_channel_id,
             message_id=self.wall_message_id,
         )
@@ -386,10 +566,12 @@ class TelegramPlaylistSender:
             entity=pl_message,
             buttons=Button.url(f"🔗 {GO_TO_POST}", wall_post_link),
         )
+        await self._add_playlist_button(pl_message_id=pl_main_message.id)
 
-        pl_post_link = await self._get_message_link(
+    async def _add_playlist_button(self, pl_message_id: int) -> None:
+        pl_post_link = await self.get_message_link(
             channel_id=self.pl_channel_id,
-            message_id=pl_main_message.id,
+            message_id=pl_message_id,
         )
         wall_message = cast(
             "TelethonMessage",
@@ -403,6 +585,14 @@ class TelegramPlaylistSender:
             buttons=Button.url(f"🔊 {GO_TO_PL}", pl_post_link),
         )
 
+    async def attach_to_playlist(self, pl_message_id: int) -> None:
+        """Link the wall message to the playlist message, that was already sent, without sending the playlist again."""
+        if not self.wall_channel_id or not self.wall_message_id:
+            return
+
+        logger.info("Adding link to the existing playlist message...")
+        await self._add_playlist_button(pl_message_id=pl_message_id)
+
     async def _send_first_main_message(self, vtt_playlist: VttAudioPlaylist) -> tuple[TelethonMessage, bool]:
         logger.info("Sending first main message...")
 
@@ -479,10 +669,9 @@ class TelegramPlaylistSender:
                     reply_to=main_message_id,
                 )
 
-    async def send_vtt_playlist(self, vtt_playlist: VttAudioPlaylist) -> str:
+    async def send_vtt_playlist(self, vtt_playlist: VttAudioPlaylist) -> TelethonMessage:
         main_message = await self._send_main_message(vtt_playlist=vtt_playlist)
-        main_message_id = main_message.id
 
-        await self._send_audios(audios=vtt_playlist.audios, main_message_id=main_message_id)
+        await self._send_audios(audios=vtt_playlist.audios, main_message_id=main_message.id)
 
-        return await self._get_message_link(channel_id=self.pl_channel_id, message_id=main_message_id)
+        return main_message
@@ -38,23 +38,34 @@ PHOTO_SIZES = [
     )
 ]
 
+# Rank of photo size, from the smallest to the largest
+PHOTO_SIZE_RANKS = {size: rank for rank, size in enumerate(PHOTO_SIZES)}
+
 
 class PhotoHandler(AttachmentHandler):
     def _get_photo_url(self, sizes: list[PhotosPhotoSizes] | None) -> str | None:
+        """Return URL of the largest photo size, that fits into `VTT_PHOTO_MAX_SIDE`.
+
+        If all sizes are larger, return URL of the smallest one.
+        If the setting is 0 or dimensions of the sizes are unknown, return URL of the largest size.
+        """
         if not sizes:
             return None
 
-        best_index = -1
-        best_url: str | None = None
-        for size in sizes:
-            try:
-                current_index = PHOTO_SIZES.index(size.type)
-            except ValueError:
-                continue
-            if current_index > best_index:
-                best_index = current_index
-                best_url = size.url
-        return best_url
+        ranked_sizes = sorted(
+            (size for size in sizes if size.type in PHOTO_SIZE_RANKS),
+            key=lambda size: PHOTO_SIZE_RANKS[size.type],
+        )
+        if not ranked_sizes:
+            return None
+
+        max_side = settings.VTT_PHOTO_MAX_SIDE
+        known_sizes = [size for size in ranked_sizes if size.width and size.height]
+        if not (max_side and known_sizes):
+            return ranked_sizes[-1].url
+
+        fitting_sizes = [size for size in known_sizes if max(size.width or 0, size.height or 0) <= max_side]
+        return fitting_sizes[-1].url if fitting_sizes else known_sizes[0].url
 
     def add_to_message(self, vtt_attachments: VttAttachments) -> None:
         photo = self.attachment.photo
@@ -96,6 +107,8 @@ class DocumentHandler(AttachmentHandler):
             VttDocument(
                 url=document.url,
                 extension=document.ext,
+                title=document.title or "",
+                size=document.size,
             ),
         )
 
@@ -5,6 +5,7 @@ from typing import TYPE_CHECKING, cast
 from loguru import logger
 
 from app.config import settings
+from app.services.probe import drop_oversized_files
 from app.vtt.attachments import get_attachment_handler
 from app.vtt.factories.playlist import VttPlaylistFactory
 from app.vtt.factories.text import VttWallTextFactory
@@ -17,8 +18,9 @@ if TYPE_CHECKING:
 
 
 class VttMessageFactory:
-    def __init__(self, vk_service: VkService) -> None:
+    def __init__(self, vk_service: VkService, *, ignore_ads: bool | None = None) -> None:
         self.vk_service = vk_service
+        self.ignore_ads = settings.VTT_IGNORE_ADS if ignore_ads is None else ignore_ads
 
     async def _get_attachments(self, wall: WallWallpostFull) -> VttAttachments:
         vtt_attachments = VttAttachments()
@@ -46,6 +48,9 @@ class VttMessageFactory:
         if vtt_attachments.video_ids:
             vtt_attachments.videos = await self.vk_service.get_video_by_ids(video_ids=vtt_attachments.video_ids)
 
+        if settings.VTT_MAX_FILE_SIZE:
+            await drop_oversized_files(vtt_attachments, max_size=settings.VTT_MAX_FILE_SIZE * 1024 * 1024)
+
         return vtt_attachments
 
     async def _get_text(
@@ -81,7 +86,7 @@ class VttMessageFactory:
             logger.warning("Skipping donut wall post.")
             return "IS_DONUT"
 
-        if wall.marked_as_ads and settings.VTT_IGNORE_ADS:
+        if wall.marked_as_ads and self.ignore_ads:
             logger.warning("Skipping ad wall post.")
             return "IS_AD"
 
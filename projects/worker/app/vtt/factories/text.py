@@ -24,6 +24,7 @@ SOURCE = _("SOURCE")
 VK_POST = _("VK_POST")
 VK_REPOST = _("VK_REPOST")
 VK_PLAYLIST = _("VK_PLAYLIST")
+FILE_TOO_LARGE = _("FILE_TOO_LARGE")
 
 
 def get_html_link(href: str, title: str) -> str:
@@ -106,6 +107,9 @@ class VttWallTextFactory:
     def _get_direct_link(self, link: VttLink) -> str:
         return f"\n\n🔗 {get_html_link(link.url, link.caption)}"
 
+    def _get_skipped_file_link(self, link: VttLink) -> str:
+        return f"\n\n⚠️ {FILE_TOO_LARGE}: {get_html_link(link.url, link.caption)}"
+
     def _get_copyright_link(self, wall_copyright: WallPostCopyright) -> str:
         return f"\n\n📎 {get_html_link(wall_copyright.link, f'{SOURCE}: {wall_copyright.name}')}"
 
@@ -144,6 +148,9 @@ class VttWallTextFactory:
         if self._attachments.link:
             footer_text += self._get_direct_link(link=self._attachments.link)
 
+        for skipped_file in self._attachments.skipped_files:
+            footer_text += self._get_skipped_file_link(link=skipped_file)
+
         if self._wall.copyright:
             footer_text += self._get_copyright_link(wall_copyright=self._wall.copyright)
 
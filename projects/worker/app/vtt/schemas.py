@@ -1,14 +1,17 @@
 from __future__ import annotations
 
 from dataclasses import dataclass, field
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Any, cast
 
+from pydantic import TypeAdapter
 from telethon.extensions import html
 from telethon.utils import split_text as telethon_split_text
 
+# Imported at runtime, so `VttMessage` can be validated by pydantic
+from vkbottle_types.objects import AudioAudio, WallGeo  # noqa: TC002
+
 if TYPE_CHECKING:
     from telethon.tl.types import TypeMessageEntity
-    from vkbottle_types.objects import AudioAudio, WallGeo
 
 
 MAX_MESSAGE_LENGTH = 4096
@@ -50,6 +53,8 @@ def split_text(
 class VttDocument:
     url: str
     extension: str
+    title: str = ""
+    size: int | None = None
 
 
 @dataclass(slots=True, frozen=True)
@@ -132,6 +137,8 @@ class VttAttachments:
     market: VttMarket | None = None
     link: VttLink | None = None
     geo: WallGeo | None = None
+    # Files, that are not sent, because they are too large
+    skipped_files: list[VttLink] = field(default_factory=list)
 
 
 @dataclass(slots=True, frozen=True)
@@ -139,3 +146,15 @@ class VttMessage:
     text: VttText
     attachments: VttAttachments
     copy_history: list[VttMessage] = field(default_factory=list)
+
+
+_vtt_message_adapter = TypeAdapter(VttMessage)
+
+
+def dump_vtt_message(vtt_message: VttMessage) -> dict[str, Any]:
+    """Serialize `vtt_message` to JSON-compatible dict, to pass it between tasks."""
+    return cast("dict[str, Any]", _vtt_message_adapter.dump_python(vtt_message, mode="json"))
+
+
+def load_vtt_message(data: dict[str, Any]) -> VttMessage:
+    return _vtt_message_adapter.validate_python(data)
@@ -0,0 +1,271 @@
+"""Forward the existing wall of the VK community to the Telegram channel.
+
+Posts are sent as `forward_wall` tasks from the oldest to the newest, at most `VTT_BACKFILL_RATE` posts per minute,
+so live posts don't wait behind the whole history.
+Id of the last sent post is stored in Redis, so an interrupted backfill continues from where it stopped.
+
+Usage: `python -m app.wall_backfill [--community-id ID] [--rate POSTS_PER_MINUTE] [--dry-run] [--reset]`
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, cast
+
+from aiohttp import ClientError, ClientSession, ClientTimeout
+from loguru import logger
+from vkbottle import API
+from vkbottle.http import AiohttpClient
+from vkbottle_types.objects import WallPostType
+from vtt_common.messages import get_message_id
+from vtt_common.schemas import VttTaskType
+from vtt_common.sequences import BACKFILL_SEQUENCE
+from vtt_common.tasks import send_claimed_task
+
+from app.communities import get_community_settings
+from app.config import settings
+from app.vk.request_validators import VkLangRequestValidator
+from app.vtt.attachments import get_attachment_handler
+from app.vtt.schemas import VttAttachments
+from app.worker import worker
+
+if TYPE_CHECKING:
+    from collections.abc import AsyncGenerator
+
+    from redis import Redis
+    from vkbottle_types.objects import WallWallpostFull
+
+# Max number of posts in a single `wall.get` call
+WALL_GET_LIMIT = 100
+# Pages overlap, so a page can be checked to continue the previously read posts
+PAGE_OVERLAP = 10
+
+# Key with id of the last sent post
+CHECKPOINT_KEY_PREFIX = "vtt-backfill-"
+
+# Max number of concurrent requests for media sizes in dry run
+MAX_SIZE_REQUESTS = 10
+
+FORWARDED_POST_TYPES = {WallPostType.POST, WallPostType.REPLY, WallPostType.PHOTO, WallPostType.VIDEO}
+
+
+@dataclass(slots=True)
+class BackfillStats:
+    posts: int = 0
+    sent: int = 0
+    skipped: int = 0
+    media_files: int = 0
+    media_bytes: int = 0
+    unknown_size_files: int = 0
+
+
+def get_checkpoint_key(owner_id: int) -> str:
+    return f"{CHECKPOINT_KEY_PREFIX}{owner_id}"
+
+
+def get_checkpoint(redis_client: Redis, owner_id: int) -> int:
+    value: bytes | None = redis_client.get(get_checkpoint_key(owner_id))
+    return int(value) if value else 0
+
+
+def set_checkpoint(redis_client: Redis, owner_id: int, post_id: int) -> None:
+    redis_client.set(get_checkpoint_key(owner_id), str(post_id))
+
+
+def get_skip_reason(post: WallWallpostFull, *, ignore_ads: bool) -> str | None:
+    """Check the post the same way as `wall_post_new` callbacks are checked. Returns `None` if the post is forwarded."""
+    if post.marked_as_ads and ignore_ads:
+        return "ad post"
+    if post.donut and post.donut.is_donut:
+        return "donut post"
+    if post.post_type not in FORWARDED_POST_TYPES:
+        return f"{post.post_type} post"
+    return None
+
+
+async def iter_wall(vk_api: API, owner_id: int, after_id: int) -> AsyncGenerator[WallWallpostFull]:
+    """Yield posts with ids greater than `after_id`, from the oldest to the newest.
+
+    Offsets count from the newest post, so posts published during the backfill shift every offset up.
+    The offset is corrected by the growth of the post count, and a page that does not overlap
+    the previously read posts is fetched again from an older offset.
+    """
+    count = (await vk_api.wall.get(owner_id=owner_id, count=1)).count or 0
+    offset = max(count - WALL_GET_LIMIT, 0)
+    last_id = after_id
+    is_first_page = True
+    while True:
+        page = await vk_api.wall.get(owner_id=owner_id, offset=offset, count=WALL_GET_LIMIT)
+        page_count = page.count or 0
+        if page_count != count:
+            offset = max(offset + page_count - count, 0)
+            count = page_count
+            continue
+
+        # Pinned post is returned on top of the first page, whatever its date is
+        ids = [post.id for post in page.items if post.id and not post.is_pinned]
+        if not is_first_page and ids and min(ids) > last_id and offset + WALL_GET_LIMIT < count:
+            logger.warning("Page at offset {} does not overlap the previous one, fetching older posts", offset)
+            offset += WALL_GET_LIMIT - PAGE_OVERLAP
+            continue
+        is_first_page = False
+
+        posts = sorted((post for post in page.items if post.id and post.id > last_id), key=lambda post: post.id or 0)
+        for post in posts:
+            yield post
+        if posts:
+            last_id = posts[-1].id or last_id
+
+        if offset == 0:
+            return
+        offset = max(offset - (WALL_GET_LIMIT - PAGE_OVERLAP), 0)
+
+
+def get_attachments(post: WallWallpostFull) -> VttAttachments:
+    """Collect attachments of the post and its reposts, as they would be collected by the worker."""
+    vtt_attachments = VttAttachments()
+    for wall in [post, *(post.copy_history or [])]:
+        for attachment in wall.attachments or []:
+            get_attachment_handler(attachment=attachment).add_to_message(vtt_attachments=vtt_attachments)
+    return vtt_attachments
+
+
+async def get_media_size(session: ClientSession, semaphore: asyncio.Semaphore, url: str) -> int | None:
+    async with semaphore:
+        try:
+            async with session.head(url, allow_redirects=True) as response:
+                response.raise_for_status()
+                return response.content_length
+        except (ClientError, TimeoutError) as error:
+            logger.warning("Failed to get size of {}: {}", url, error)
+            return None
+
+
+async def estimate_media(session: ClientSession, post: WallWallpostFull, stats: BackfillStats) -> None:
+    """Add sizes of photos and documents to `stats`. Sizes of videos and audios are not known before downloading."""
+    attachments = get_attachments(post)
+    urls = attachments.photos + [document.url for document in attachments.documents]
+    semaphore = asyncio.Semaphore(MAX_SIZE_REQUESTS)
+    sizes = await asyncio.gather(*(get_media_size(session, semaphore, url) for url in urls))
+
+    stats.media_files += len(urls) + len(attachments.video_ids) + len(attachments.audio_ids)
+    stats.media_bytes += sum(size for size in sizes if size)
+    stats.unknown_size_files += (
+        sum(not size for size in sizes)
+        + len(attachments.video_ids)
+        + len(attachments.audio_ids)
+        + bool(attachments.audio_playlist_id)
+    )
+
+
+async def backfill(owner_id: int, rate: float, *, dry_run: bool = False, reset: bool = False) -> BackfillStats:
+    redis_client = worker.backend.client
+    community = get_community_settings(owner_id=owner_id)
+    vk_api = API(token=community.vk_token, http_client=AiohttpClient())
+    vk_api.request_validators.append(VkLangRequestValidator())
+
+    checkpoint = 0 if reset else get_checkpoint(redis_client, owner_id)
+    if checkpoint:
+        logger.info("Continuing backfill of wall {} after post {}", owner_id, checkpoint)
+
+    stats = BackfillStats()
+    try:
+        async with ClientSession(timeout=ClientTimeout(total=30)) as session:
+            async for post in iter_wall(vk_api, owner_id, after_id=checkpoint):
+                stats.posts += 1
+                post_id = cast("int", post.id)
+                full_id = f"{owner_id}_{post_id}"
+                is_sent = False
+                reason = get_skip_reason(post, ignore_ads=community.ignore_ads)
+                if not reason and get_message_id(
+                    redis_client,
+                    community.channel_id,
+                    VttTaskType.wall,
+                    owner_id,
+                    post_id,
+                ):
+                    reason = "already in Telegram channel"
+
+                if reason:
+                    logger.info("Skipping post {}: {}", full_id, reason)
+                    stats.skipped += 1
+                elif dry_run:
+                    await estimate_media(session, post, stats)
+                    stats.sent += 1
+                else:
+                    is_sent = send_claimed_task(
+                        worker,
+                        "app.main.forward_wall",
+                        task_type=VttTaskType.wall,
+                        owner_id=owner_id,
+                        post_id=post_id,
+                        queue="vtt-wall",
+                        kwargs={
+                            "owner_id": owner_id,
+                            "wall_id": post_id,
+                        },
+                        sequence=BACKFILL_SEQUENCE,
+                    )
+                    if is_sent:
+                        logger.info("Sent post {}", full_id)
+                        stats.sent += 1
+                    else:
+                        logger.info("Skipping post {}: already in queue", full_id)
+                        stats.skipped += 1
+
+                if not dry_run:
+                    set_checkpoint(redis_client, owner_id, post_id)
+                if is_sent:
+                    await asyncio.sleep(60 / rate)
+    finally:
+        await vk_api.http_client.close()
+
+    return stats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Forward the existing wall of the VK community to Telegram.")
+    parser.add_argument(
+        "--community-id",
+        type=int,
+        default=settings.VK_COMMUNITY_ID,
+        help="id of VK community, one of the routed communities or VK_COMMUNITY_ID (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=settings.VTT_BACKFILL_RATE,
+        help="max number of posts sent per minute (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="don't send posts, only count them and estimate size of their media",
+    )
+    parser.add_argument("--reset", action="store_true", help="start from the oldest post, ignoring the checkpoint")
+    args = parser.parse_args()
+
+    if not args.community_id:
+        parser.error("VK_COMMUNITY_ID is not set, pass --community-id")
+    if args.rate <= 0:
+        parser.error("--rate must be positive")
+
+    logger.disable("vkbottle")
+    stats = asyncio.run(backfill(-abs(args.community_id), args.rate, dry_run=args.dry_run, reset=args.reset))
+    if args.dry_run:
+        logger.info(
+            "Posts to send: {} of {}, media files: {} (~{:.1f} MB), files of unknown size: {}",
+            stats.sent,
+            stats.posts,
+            stats.media_files,
+            stats.media_bytes / 1024 / 1024,
+            stats.unknown_size_files,
+        )
+    else:
+        logger.info("Sent {} posts, skipped {}", stats.sent, stats.skipped)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 from celery import Celery
 from vtt_common import celeryconfig
+from vtt_common.tasks import set_task_state_handlers
 
 worker = Celery()
 worker.config_from_object(celeryconfig)
@@ -7,7 +8,18 @@ worker.conf.task_routes = {
     "app.main.forward_wall": {
         "queue": "vtt-wall",
     },
+    "app.main.download_wall": {
+        "queue": "vtt-download",
+    },
+    "app.main.publish_wall": {
+        "queue": "vtt-publish",
+    },
+    "app.main.edit_wall": {
+        "queue": "vtt-wall",
+    },
     "app.main.forward_playlist": {
         "queue": "vtt-playlist",
     },
 }
+
+set_task_state_handlers(backend=worker.backend)
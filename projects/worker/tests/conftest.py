@@ -0,0 +1,15 @@
+from __future__ import annotations
+
+import os
+
+# Settings are read on import of `app.config`
+os.environ.update(
+    {
+        "VK_TOKEN": "vk-token",
+        "TGM_API_ID": "12345",
+        "TGM_API_HASH": "tgm-api-hash",
+        "TGM_BOT_TOKEN": "tgm-bot-token",
+        "TGM_BOT_SESSION": "",
+        "TGM_CHANNEL_ID": "-1001234567890",
+    },
+)
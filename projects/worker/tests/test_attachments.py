@@ -0,0 +1,52 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+from unittest.mock import MagicMock
+
+import pytest
+from vkbottle_types.objects import PhotosPhotoSizes, PhotosPhotoSizesType
+
+from app.config import settings
+from app.vtt.attachments import PhotoHandler
+
+if TYPE_CHECKING:
+    from pytest_mock import MockerFixture
+
+# Sizes of a 4000x3000 photo, as they are returned by VK
+PHOTO_SIZES = [
+    PhotosPhotoSizes(type=PhotosPhotoSizesType.S, url="https://sun.userapi.com/s.jpg", width=75, height=56),
+    PhotosPhotoSizes(type=PhotosPhotoSizesType.M, url="https://sun.userapi.com/m.jpg", width=130, height=97),
+    PhotosPhotoSizes(type=PhotosPhotoSizesType.X, url="https://sun.userapi.com/x.jpg", width=604, height=453),
+    PhotosPhotoSizes(type=PhotosPhotoSizesType.O, url="https://sun.userapi.com/o.jpg", width=130, height=98),
+    PhotosPhotoSizes(type=PhotosPhotoSizesType.Y, url="https://sun.userapi.com/y.jpg", width=807, height=605),
+    PhotosPhotoSizes(type=PhotosPhotoSizesType.Z, url="https://sun.userapi.com/z.jpg", width=1080, height=810),
+    PhotosPhotoSizes(type=PhotosPhotoSizesType.W, url="https://sun.userapi.com/w.jpg", width=2560, height=1920),
+]
+
+
+@pytest.mark.parametrize(
+    ("max_side", "url"),
+    [
+        (1280, "https://sun.userapi.com/z.jpg"),
+        (1080, "https://sun.userapi.com/z.jpg"),
+        (1000, "https://sun.userapi.com/y.jpg"),
+        (2560, "https://sun.userapi.com/w.jpg"),
+        (50, "https://sun.userapi.com/s.jpg"),
+        (0, "https://sun.userapi.com/w.jpg"),
+    ],
+)
+def test_get_photo_url(mocker: MockerFixture, max_side: int, url: str) -> None:
+    mocker.patch.object(settings, "VTT_PHOTO_MAX_SIDE", max_side)
+
+    assert PhotoHandler(MagicMock())._get_photo_url(PHOTO_SIZES) == url
+
+
+def test_get_photo_url_default() -> None:
+    assert PhotoHandler(MagicMock())._get_photo_url(PHOTO_SIZES) == "https://sun.userapi.com/z.jpg"
+
+
+def test_get_photo_url_unknown_dimensions(mocker: MockerFixture) -> None:
+    mocker.patch.object(settings, "VTT_PHOTO_MAX_SIDE", 1280)
+    sizes = [size.model_copy(update={"width": 0, "height": 0}) for size in PHOTO_SIZES]
+
+    assert PhotoHandler(MagicMock())._get_photo_url(sizes) == "https://sun.userapi.com/w.jpg"
@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+from PIL import Image
+
+from app.services.optimizer import get_optimize_pool, optimize_message_media, optimize_photo
+from app.vtt.schemas import VttAttachments, VttMessage, VttText
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+
+def test_optimize_photo_to_jpeg(tmp_path: Path) -> None:
+    path = tmp_path / "photo.png"
+    Image.new("RGB", (400, 300), (200, 100, 50)).save(path)
+
+    optimized_path = optimize_photo(path, max_side=200)
+
+    assert optimized_path == tmp_path / "photo.jpg"
+    assert not path.exists()
+    with Image.open(optimized_path) as image:
+        assert image.format == "JPEG"
+        assert image.size == (200, 150)
+
+
+def test_optimize_transparent_photo_to_png(tmp_path: Path) -> None:
+    path = tmp_path / "photo.png"
+    Image.new("RGBA", (400, 300), (200, 100, 50, 0)).save(path)
+
+    optimized_path = optimize_photo(path, max_side=200)
+
+    assert optimized_path == path
+    with Image.open(optimized_path) as image:
+        assert image.format == "PNG"
+        assert image.size == (200, 150)
+        assert image.getpixel((0, 0))[3] == 0
+
+
+def test_optimize_message_media(tmp_path: Path) -> None:
+    photo_path = tmp_path / "photo.png"
+    Image.new("RGB", (400, 300), (200, 100, 50)).save(photo_path)
+    document_path = tmp_path / "document.png"
+    Image.new("RGB", (400, 300), (200, 100, 50)).save(document_path)
+    message = VttMessage(
+        text=VttText(header="Post", footer=""),
+        attachments=VttAttachments(photos=["https://sun.userapi.com/photo.png"]),
+    )
+
+    optimized_files, report = optimize_message_media(
+        message,
+        {
+            "https://sun.userapi.com/photo.png": str(photo_path),
+            "https://vk.com/doc1_2": str(document_path),
+            "https://vk.com/doc1_3": None,
+        },
+        max_photo_side=200,
+        pool=get_optimize_pool(1),
+    )
+
+    assert optimized_files == {
+        "https://sun.userapi.com/photo.png": str(tmp_path / "photo.jpg"),
+        "https://vk.com/doc1_2": str(document_path),
+        "https://vk.com/doc1_3": None,
+    }
+    assert report.files == report.optimized == 1
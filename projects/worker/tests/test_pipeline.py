@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+import json
+from typing import TYPE_CHECKING, Any, Self, cast
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from vtt_common.tasks import STAGE_PASSED
+
+from app.config import settings
+from app.main import download_wall, forward_wall, publish_wall
+from app.vtt.schemas import VttAttachments, VttMessage, VttText
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+    from pytest_mock import MockerFixture
+
+PHOTO_URL = "https://sun.userapi.com/photo.jpg"
+
+
+class FakeResponse:
+    def __init__(self, url: str) -> None:
+        self.url = MagicMock(path=url.removeprefix("https://sun.userapi.com"))
+        self.content = MagicMock()
+        self.content.iter_chunks = self._iter_chunks
+
+    async def _iter_chunks(self) -> Any:  # noqa: ANN401
+        yield b"photo", True
+
+    async def __aenter__(self) -> Self:
+        return self
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        pass
+
+
+@pytest.fixture
+def http_get(mocker: MockerFixture) -> MagicMock:
+    mocker.patch("app.services.downloader.randbelow", return_value=0)
+    session = mocker.patch("app.services.downloader.ClientSession").return_value
+    session.close = AsyncMock()
+    session.get.side_effect = FakeResponse
+    return cast("MagicMock", session.get)
+
+
+def _run_stage(mocker: MockerFixture, stage: Any, **kwargs: Any) -> dict[str, Any]:  # noqa: ANN401
+    """Run the stage task and return kwargs of the next stage, as they are received from the broker."""
+    send_stage_task = mocker.patch("app.main.send_stage_task")
+    assert stage.run(**kwargs) == STAGE_PASSED
+    return cast("dict[str, Any]", json.loads(json.dumps(send_stage_task.call_args.kwargs["kwargs"])))
+
+
+def test_wall_pipeline(mocker: MockerFixture, tmp_path: Path, http_get: MagicMock) -> None:
+    mocker.patch.object(settings, "VTT_MEDIA_DIR", str(tmp_path))
+    mocker.patch("celery.backends.redis.RedisBackend.client", MagicMock())
+    # The repost and the post have the same photo, it is downloaded once and sent twice
+    mocker.patch(
+        "app.main.VttMessageFactory.create",
+        return_value=VttMessage(
+            text=VttText(header="Post", footer=""),
+            attachments=VttAttachments(photos=[PHOTO_URL]),
+            copy_history=[
+                VttMessage(text=VttText(header="Repost", footer=""), attachments=VttAttachments(photos=[PHOTO_URL])),
+            ],
+        ),
+    )
+
+    sent_files: list[list[Path]] = []
+
+    async def send_file(_channel_id: int, file: list[Path], **_: Any) -> list[MagicMock]:
+        assert all(path.exists() for path in file)
+        sent_files.append(file)
+        return [MagicMock(id=len(sent_files), grouped_id=None)]
+
+    tgm_bot = MagicMock()
+    tgm_bot.start = AsyncMock(return_value=tgm_bot)
+    tgm_bot.send_file = send_file
+    mocker.patch("app.main.create_tgm_bot", return_value=tgm_bot)
+    mocker.patch("app.main.TelegramWallSender.get_message_link", AsyncMock(return_value="https://t.me/c/1/2"))
+
+    forward_wall.push_request(id="wall_-1_2")
+    try:
+        download_kwargs = _run_stage(mocker, forward_wall, owner_id=-1, wall_id=2)
+    finally:
+        forward_wall.pop_request()
+    publish_kwargs = _run_stage(mocker, download_wall, **download_kwargs, parent_task_id="wall_-1_2")
+
+    media_dir = tmp_path / "vtt-media" / "wall_-1_2"
+    assert publish_kwargs["media_files"] == {PHOTO_URL: str(media_dir / "photo.jpg")}
+
+    assert publish_wall.run(**publish_kwargs, parent_task_id="wall_-1_2") == "https://t.me/c/1/2"
+    assert sent_files == [[media_dir / "photo.jpg"], [media_dir / "photo.jpg"]]
+    assert http_get.call_count == 1
+    assert not media_dir.exists()